@@ -0,0 +1,422 @@
+"""
+推論の実行キューとアドミッション制御
+
+model.generate はブロッキング呼び出しなので、イベントループではなく専用のワーカースレッドで実行します。
+- 待機キューは上限付き。満杯なら QueueFull（HTTP 429 + Retry-After）で即座に断る
+- リクエスト毎の期限（deadline）を過ぎたジョブは実行せず、実行中なら生成を打ち切る
+- キューの深さと待ち時間を stats() で公開する
+- 待機キュー（FairQueue）はテナントの優先度クラスと重みで順番を決める（テナントの設定は tenancy.py）
+"""
+
+import heapq
+import itertools
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class QueueFull(Exception):
+    """待機キューが満杯。retry_after は再試行までの目安（秒）"""
+
+    def __init__(self, retry_after=1, message="Inference queue is full"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimited(QueueFull):
+    """テナントのレート制限（トークンバケット）を超えた。retry_after はトークンが貯まるまでの目安（秒）"""
+
+    def __init__(self, tenant, retry_after=1):
+        super().__init__(retry_after, f"Rate limit exceeded for tenant {tenant}")
+
+
+class DeadlineExceeded(Exception):
+    """リクエストの期限までに生成が終わらなかった"""
+
+    def __init__(self):
+        super().__init__("Request deadline exceeded")
+
+
+def retry_after_seconds(depth, service_time, concurrency):
+    """キューが捌けるまでの目安（1〜60秒）"""
+    return max(1, min(60, math.ceil((depth + 1) * service_time / max(1, concurrency))))
+
+
+class WaitStats:
+    """直近のキュー待ち時間と処理時間を記録する"""
+
+    def __init__(self, window=1024):
+        self.waits = deque(maxlen=window)
+        self.services = deque(maxlen=window)
+        self.rejected = 0
+        self.expired = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.waits.append(seconds)
+
+    def record_service(self, seconds):
+        with self._lock:
+            self.services.append(seconds)
+            self.completed += 1
+
+    def mean_service_time(self, default=1.0):
+        with self._lock:
+            return sum(self.services) / len(self.services) if self.services else default
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self.waits)
+        return {
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "completed": self.completed,
+            "wait_ms_mean": sum(waits) / len(waits) * 1000 if waits else 0.0,
+            "wait_ms_p50": waits[len(waits) // 2] * 1000 if waits else 0.0,
+            "wait_ms_p99": waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000 if waits else 0.0,
+        }
+
+
+class PriorityClass:
+    """優先度クラス。priority の大きいクラスから実行する"""
+
+    def __init__(self, name="default", priority=0, slo=None):
+        self.name = name
+        self.priority = priority
+        # 待ち時間の目標（秒）。これを超えて待ったリクエストは slo 毎に1件、クラスに関係なく先に実行する。
+        # None なら繰り上げない
+        self.slo = slo
+
+
+class QueueTenant:
+    """FairQueue に投入するリクエストの持ち主。同じクラスの中では weight に比例して順番が回る
+
+    acquire() / release() はレート制限のフック（tenancy.Tenant がトークンバケットで実装する）。
+    """
+
+    def __init__(self, name="default", priority_class=None, weight=1.0):
+        self.name = name
+        self.priority_class = priority_class or PriorityClass()
+        self.weight = weight
+
+    def acquire(self, cost):
+        """cost トークン分のレート制限を確認する。超えていれば RateLimited"""
+
+    def release(self, cost):
+        """acquire() したが実行しなかった分を戻す"""
+
+
+DEFAULT_TENANT = QueueTenant()
+
+
+class QueuedItem:
+    """FairQueue で待機中の1件"""
+
+    def __init__(self, item, tenant, cost, start, seq):
+        self.item = item
+        self.tenant = tenant
+        self.cost = cost
+        # WFQ の仮想開始時刻（取り出したときにクラスの仮想時間をここまで進める）
+        self.start = start
+        self.seq = seq
+        self.enqueued_at = time.perf_counter()
+        slo = tenant.priority_class.slo
+        self.overdue_at = self.enqueued_at + slo if slo is not None else None
+        self.removed = False
+
+
+class ClassQueue:
+    """1つの優先度クラスで待機中のリクエスト
+
+    heap は取り出す順（WFQ なら仮想終了時刻、SJF なら cost）、arrivals は到着順（SLO の繰り上げと押し出しに使う）。
+    取り出した・押し出したものは removed にしておき、先頭に来たときに捨てる。
+    """
+
+    def __init__(self, priority_class):
+        self.priority_class = priority_class
+        self.heap = []
+        self.arrivals = deque()
+        self.size = 0
+        # 最後に SLO の超過で繰り上げて取り出した時刻
+        self.promoted_at = None
+        self.virtual_time = 0.0
+        # テナント名 -> 直近の仮想終了時刻
+        self.finish = {}
+        self.wait_stats = WaitStats()
+
+    def head(self):
+        while self.heap[0][2].removed:
+            heapq.heappop(self.heap)
+        return self.heap[0][2]
+
+    def oldest(self):
+        while self.arrivals[0].removed:
+            self.arrivals.popleft()
+        return self.arrivals[0]
+
+    def newest(self):
+        while self.arrivals[-1].removed:
+            self.arrivals.pop()
+        return self.arrivals[-1]
+
+
+class FairQueue:
+    """テナントの優先度クラスと重みで順番を決める待機キュー（queue.Queue の get / get_nowait / qsize と同じ使い方）
+
+    - priority の大きいクラスから取り出す。ただし待ち時間がクラスの slo を超えたリクエストは、クラス毎に slo に
+      1件まで、クラスに関係なく先に取り出す（低いクラスも飢餓にならず、高いクラスを待たせるのは slo 毎に1件だけ）
+    - 同じクラスの中は重み付き公平キューイング（start-time fair queueing）。テナント毎に cost / weight を
+      仮想時間に積み、仮想終了時刻の小さい順に取り出す。1つのテナントが大量に投入しても、他のテナントの順番は
+      weight の比で回ってくる（テナントが1つなら FIFO）
+    - sjf=True なら同じクラスの中は cost（見込みのトークン数）の小さい順（Shortest Expected Job First）
+    - max_size 件待機しているとき、低いクラスのリクエストがあれば、一番低いクラスで最後に来たものを押し出す
+    """
+
+    def __init__(self, sjf=False):
+        self.sjf = sjf
+        self._classes = {}
+        self._counts = {}
+        self._size = 0
+        self._stops = 0
+        self._seq = itertools.count()
+        self._not_empty = threading.Condition()
+
+    def qsize(self):
+        return self._size
+
+    def put(self, item, tenant=None, cost=1, max_size=None):
+        """item を待機させ、押し出したアイテム（なければ None）を返す
+
+        tenant のレート制限を超えていれば RateLimited、max_size 件待機していて押し出せるものがなければ queue.Full。
+        item が None なら、待機中のものがなくなった後に get() が None を返す（ワーカーの停止に使う）。
+        """
+        with self._not_empty:
+            if item is None:
+                self._stops += 1
+                self._not_empty.notify()
+                return None
+            tenant = tenant or DEFAULT_TENANT
+            counts = self._tenant_counts(tenant)
+            try:
+                tenant.acquire(cost)
+            except RateLimited:
+                counts["rate_limited"] += 1
+                raise
+            evicted = None
+            if max_size is not None and self._size >= max_size:
+                evicted = self._push_out(tenant.priority_class.priority)
+                if evicted is None:
+                    tenant.release(cost)
+                    counts["rejected"] += 1
+                    raise queue.Full
+            self._push(item, tenant, cost)
+            self._not_empty.notify()
+        return evicted
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            if block and not self._not_empty.wait_for(lambda: self._size or self._stops, timeout):
+                raise queue.Empty
+            if not self._size:
+                if self._stops:
+                    self._stops -= 1
+                    return None
+                raise queue.Empty
+            class_queue, entry = self._next()
+            self._remove(class_queue, entry)
+            class_queue.virtual_time = max(class_queue.virtual_time, entry.start)
+        class_queue.wait_stats.record_wait(time.perf_counter() - entry.enqueued_at)
+        return entry.item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def _tenant_counts(self, tenant):
+        counts = self._counts.get(tenant.name)
+        if counts is None:
+            counts = self._counts[tenant.name] = {"rate_limited": 0, "rejected": 0, "evicted": 0}
+        return counts
+
+    def _push(self, item, tenant, cost):
+        class_queue = self._classes.get(tenant.priority_class.name)
+        if class_queue is None:
+            class_queue = self._classes[tenant.priority_class.name] = ClassQueue(tenant.priority_class)
+        start = max(class_queue.virtual_time, class_queue.finish.get(tenant.name, 0.0))
+        finish = class_queue.finish[tenant.name] = start + cost / tenant.weight
+        entry = QueuedItem(item, tenant, cost, start, next(self._seq))
+        heapq.heappush(class_queue.heap, (cost if self.sjf else finish, entry.seq, entry))
+        class_queue.arrivals.append(entry)
+        class_queue.size += 1
+        self._size += 1
+
+    def _remove(self, class_queue, entry):
+        entry.removed = True
+        class_queue.size -= 1
+        self._size -= 1
+        if not class_queue.size:
+            class_queue.heap.clear()
+            class_queue.arrivals.clear()
+
+    def _next(self):
+        """(クラス, 次に取り出すもの)。slo を超えて待っていて、繰り上げられるものがあれば、超えた時刻が一番早いもの"""
+        now = time.perf_counter()
+        waiting = [class_queue for class_queue in self._classes.values() if class_queue.size]
+        overdue = [(class_queue, class_queue.oldest()) for class_queue in waiting
+                   if class_queue.promoted_at is None or now - class_queue.promoted_at >= class_queue.priority_class.slo]
+        overdue = [(class_queue, entry) for class_queue, entry in overdue
+                   if entry.overdue_at is not None and entry.overdue_at <= now]
+        if overdue:
+            class_queue, entry = min(overdue, key=lambda pair: pair[1].overdue_at)
+            class_queue.promoted_at = now
+            return class_queue, entry
+        class_queue = max(waiting, key=lambda class_queue: class_queue.priority_class.priority)
+        return class_queue, class_queue.head()
+
+    def _push_out(self, priority):
+        """priority より低いクラスのうち一番低いクラスで、最後に来たものを外して返す（なければ None）"""
+        lower = [class_queue for class_queue in self._classes.values()
+                 if class_queue.size and class_queue.priority_class.priority < priority]
+        if not lower:
+            return None
+        class_queue = min(lower, key=lambda class_queue: class_queue.priority_class.priority)
+        entry = class_queue.newest()
+        self._remove(class_queue, entry)
+        entry.tenant.release(entry.cost)
+        self._tenant_counts(entry.tenant)["evicted"] += 1
+        return entry.item
+
+    def stats(self):
+        with self._not_empty:
+            classes = list(self._classes.values())
+            counts = {name: dict(value) for name, value in self._counts.items()}
+        return {
+            "policy": "sjf" if self.sjf else "wfq",
+            "classes": {
+                class_queue.priority_class.name: {
+                    "priority": class_queue.priority_class.priority,
+                    "queue_depth": class_queue.size,
+                    **{key: value for key, value in class_queue.wait_stats.stats().items() if key.startswith("wait_")},
+                }
+                for class_queue in classes
+            },
+            "tenants": counts,
+        }
+
+
+class InferenceJob:
+    """実行キューに投入した1件のジョブ"""
+
+    def __init__(self, fn, deadline=None):
+        self.fn = fn
+        # time.perf_counter() 基準の期限（None なら無期限）
+        self.deadline = deadline
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.future = Future()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """結果が不要になった（クライアント切断など）。実行中の生成は次のトークンで止まる"""
+        self._cancelled.set()
+
+    def expired(self):
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def should_stop(self):
+        return self._cancelled.is_set() or self.expired()
+
+
+class InferenceExecutor:
+    """上限付きの待機キューを持つ推論専用のスレッドプール
+
+    submit(fn) の fn は実行中のジョブを引数に呼ばれ、job.should_stop() で打ち切りを確認できる。
+    """
+
+    def __init__(self, workers=1, max_queue=16, fair_queue=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        # テナントのクラスと重みで順番を決める（テナントを指定しなければ FIFO）
+        self.queue = fair_queue if fair_queue is not None else FairQueue()
+        self.running = 0
+        self.wait_stats = WaitStats()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'inference-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, fn, deadline=None, tenant=None, cost=1):
+        """ジョブを投入する
+
+        tenant（QueueTenant）と cost（見込みのトークン数）で実行の順番が決まる。待機中のジョブが max_queue 件あり、
+        押し出せる低いクラスのジョブもなければ QueueFull。テナントのレート制限を超えていれば RateLimited。
+        """
+        job = InferenceJob(fn, deadline)
+        try:
+            evicted = self.queue.put(job, tenant, cost, self.max_queue)
+        except queue.Full:
+            self.wait_stats.rejected += 1
+            raise QueueFull(self.retry_after())
+        if evicted is not None:
+            # 優先度の高いジョブに押し出された
+            self.wait_stats.rejected += 1
+            evicted.future.set_exception(QueueFull(self.retry_after()))
+        return job
+
+    def retry_after(self):
+        return retry_after_seconds(self.queue.qsize(), self.wait_stats.mean_service_time(), self.workers)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.started_at = time.perf_counter()
+            self.wait_stats.record_wait(job.started_at - job.submitted_at)
+
+            if job.should_stop():
+                # 待っている間に期限切れ・キャンセルになったジョブは実行しない
+                self.wait_stats.expired += 1
+                job.future.set_exception(DeadlineExceeded())
+                continue
+
+            with self._lock:
+                self.running += 1
+            try:
+                result = job.fn(job)
+                self.wait_stats.record_service(time.perf_counter() - job.started_at)
+                job.future.set_result(result)
+            except DeadlineExceeded as e:
+                self.wait_stats.expired += 1
+                job.future.set_exception(e)
+            except Exception as e:
+                job.future.set_exception(e)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "workers": self.workers,
+            **self.wait_stats.stats(),
+            **self.queue.stats(),
+        }
@@ -0,0 +1,887 @@
+import os
+import asyncio
+import time
+import logging
+import signal
+from threading import Thread, Timer
+from typing import List, Dict, Any, Literal, Optional, Union
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, TextIteratorStreamer
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from admission import DeadlineExceeded, InferenceExecutor, QueueFull
+from backends import BACKENDS, model_bytes, prepare_model
+from batching import ContinuousBatchScheduler
+from embeddings import EmbeddingBatcher, encode_embedding
+from fastjson import dumps
+from graceful import DRAIN, reuse_port_socket
+from kv_cache import cache_layers, make_cache, shared_prefill
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, THROUGHPUT_BUCKETS, Registry, http_metrics
+from model_loader import load_mmap_model
+from prefix_cache import PrefixCache
+from prompting import PromptBuilder, usage
+from request_limits import (
+    MAX_BODY_BYTES, MAX_CHOICES, MAX_EMBEDDING_INPUTS, MAX_MESSAGES, MAX_TOKENS_LIMIT, RequestRejected, body_length
+)
+from response_cache import ResponseCache, cache_key, is_cacheable
+from speculative import SpeculativeStats, speculative_generate
+from sse import stream_chat_completion
+from tenancy import Tenants
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Jan Nano 4B Q8 API", version="1.0.0")
+
+# CORS設定
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# /metrics（Prometheus 形式）。記録はスレッド毎のシャードに行い、ロックを取らない
+METRICS = Registry()
+HTTP_REQUESTS, HTTP_REQUEST_SECONDS = http_metrics(METRICS)
+QUEUE_WAIT_SECONDS = METRICS.histogram("jan_nano_queue_wait_seconds", "Time waiting for an inference slot")
+TOKENIZE_SECONDS = METRICS.histogram("jan_nano_tokenize_seconds", "Prompt tokenization time")
+PREFILL_SECONDS = METRICS.histogram("jan_nano_prefill_seconds", "Prompt prefill time (until the first token)")
+DECODE_SECONDS = METRICS.histogram("jan_nano_decode_seconds", "Decode time after the first token")
+TTFT_SECONDS = METRICS.histogram("jan_nano_time_to_first_token_seconds", "Request start to first generated token")
+DECODE_TOKENS_PER_SECOND = METRICS.histogram(
+    "jan_nano_decode_tokens_per_second", "Per-request decode speed", buckets=THROUGHPUT_BUCKETS
+)
+GENERATED_TOKENS = METRICS.counter("jan_nano_generated_tokens_total", "Generated completion tokens")
+# ルートのラベル。それ以外のパスは "other" にまとめる
+ROUTES = frozenset(["/", "/health", "/metrics", "/stats", "/v1/models", "/v1/chat/completions", "/v1/embeddings"])
+
+class MetricsMiddleware:
+    """ルート・ステータス別のリクエスト数と処理時間を記録する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        start = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope["path"] if scope["path"] in ROUTES else "other"
+            HTTP_REQUESTS.inc(scope["method"], route, status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+
+class QueueDepthMiddleware:
+    """全ての応答に X-Queue-Depth（推論待ち・推論中のリクエスト数）を付ける。router.py の振り分けに使う"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_depth(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-queue-depth", str(inference_load()).encode("latin-1"))
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_depth)
+
+class BodyLimitMiddleware:
+    """Content-Length が不正（400）または MAX_BODY_BYTES を超える（413）リクエストをボディを読まずに拒否する。
+    Content-Length のない chunked のボディは受信した量を数え、上限を超えた時点で 413 にする"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                content_length = value.decode("latin-1")
+        try:
+            body_length(content_length, limit=MAX_BODY_BYTES)
+        except RequestRejected as e:
+            response = JSONResponse({"detail": str(e)}, status_code=e.status, headers={"Connection": "close"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def receive_with_limit():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_BODY_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {MAX_BODY_BYTES} bytes")
+            return message
+
+        await self.app(scope, receive_with_limit, send)
+
+class DrainMiddleware:
+    """drain 中の応答に Connection: close を付け、keep-alive の接続を（新しいプロセスへ）切り替えさせる"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_close(message):
+            if message["type"] == "http.response.start" and DRAIN.draining.is_set():
+                message["headers"] = list(message.get("headers", [])) + [(b"connection", b"close")]
+            await send(message)
+
+        await self.app(scope, receive, send_with_close)
+
+app.add_middleware(BodyLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueueDepthMiddleware)
+app.add_middleware(DrainMiddleware)
+
+# モデルとトークナイザーの初期化
+MODEL_PATH = os.environ.get("JAN_NANO_MODEL_PATH", "/home/ubuntu/models/jan-nano-4b-q8")
+tokenizer = None
+model = None
+prompt_builder = None
+
+# 重みの読み込み方法: "eager"（from_pretrained）または "mmap"（safetensors を mmap してコピーしない）
+LOAD_MODE = os.environ.get("JAN_NANO_LOAD_MODE", "eager")
+# 推論バックエンド（backends.py）: "torch"（読み込んだまま）または "int8"（Linear を動的量子化、CPU のみ）
+BACKEND = os.environ.get("JAN_NANO_BACKEND", "torch")
+if BACKEND not in BACKENDS:
+    raise ValueError(f"JAN_NANO_BACKEND must be one of {', '.join(sorted(BACKENDS))}: {BACKEND}")
+# ready にする前のウォームアップ生成のトークン数。0 でウォームアップしない
+WARMUP_TOKENS = int(os.environ.get("JAN_NANO_WARMUP_TOKENS", "8"))
+# ワーカープロセス数（0 で CPU コア数）。2以上で uvicorn のワーカープロセスを起動し、接続を各プロセスに分散する。
+# JAN_NANO_LOAD_MODE=mmap なら各プロセスが同じ safetensors を mmap し、重みはページキャッシュで共有される
+PROCESSES = int(os.environ.get("JAN_NANO_PROCESSES", "1")) or os.cpu_count() or 1
+if PROCESSES > 1:
+    # プロセス同士でコアを取り合わないよう、演算スレッドをコア数で分ける
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // PROCESSES))
+# SIGTERM を受けてから /health を 503（draining）にしたまま接続を受け付け続ける秒数と、
+# その後で処理中のリクエストを待つ最大秒数（graceful.py）
+DRAIN_GRACE = float(os.environ.get("JAN_NANO_DRAIN_GRACE", "1"))
+DRAIN_TIMEOUT = float(os.environ.get("JAN_NANO_DRAIN_TIMEOUT", "30"))
+# 1 で SO_REUSEPORT でバインドし、動作中のプロセスと同じポートで起動して新しい接続を引き継ぐ
+REUSE_PORT = os.environ.get("JAN_NANO_REUSE_PORT", "0") == "1"
+# /health で返す状態: "loading"（読み込み・ウォームアップ中）→ "ready"
+model_status = "loading"
+METRICS.gauge("jan_nano_model_ready", "1 when the model is loaded and warmed up", lambda: int(model_status == "ready"))
+
+# 推論はイベントループ外の専用スレッドで実行する。待機キューが満杯なら 429 を返す
+INFERENCE_WORKERS = int(os.environ.get("JAN_NANO_INFERENCE_WORKERS", "1"))
+MAX_QUEUE = int(os.environ.get("JAN_NANO_MAX_QUEUE", "16"))
+# リクエストの期限（秒）。X-Request-Timeout ヘッダーで上書きできる。0 で無期限
+REQUEST_TIMEOUT = float(os.environ.get("JAN_NANO_REQUEST_TIMEOUT", "120"))
+executor = None
+# API キー毎の優先度クラス・重み・レート制限（JSON、tenancy.py）。未設定なら全リクエストが既定のテナントで FIFO
+TENANTS_FILE = os.environ.get("JAN_NANO_TENANTS_FILE")
+TENANTS = Tenants.from_file(TENANTS_FILE) if TENANTS_FILE else Tenants()
+
+# 投機的デコーディング: 同じトークナイザーの小さなドラフトモデルのパス。指定すると1リクエストずつの生成で使う
+DRAFT_MODEL_PATH = os.environ.get("JAN_NANO_DRAFT_MODEL_PATH")
+# ドラフトモデルが1回に提案するトークン数
+DRAFT_TOKENS = int(os.environ.get("JAN_NANO_DRAFT_TOKENS", "4"))
+draft_model = None
+speculative_stats = SpeculativeStats()
+SPECULATIVE_DRAFT_TOKENS = METRICS.counter(
+    "jan_nano_speculative_draft_tokens_total", "Draft tokens proposed in speculative decoding",
+    labelnames=("result",)
+)
+SPECULATIVE_FORWARDS = METRICS.counter(
+    "jan_nano_speculative_verify_forwards_total", "Main model forward passes in speculative decoding"
+)
+
+# 連続バッチング: 2以上で同時リクエストを1つのデコードバッチにまとめる
+MAX_BATCH_SIZE = int(os.environ.get("JAN_NANO_MAX_BATCH", "1"))
+scheduler = None
+
+def inference_load():
+    """推論待ちと推論中のリクエスト数"""
+    runner = scheduler or executor
+    if runner is None:
+        return 0
+    stats = runner.stats()
+    return stats["queue_depth"] + stats["running"]
+
+METRICS.gauge(
+    "jan_nano_queue_depth", "Requests waiting for an inference slot",
+    lambda: (scheduler or executor).stats()["queue_depth"] if (scheduler or executor) is not None else 0
+)
+
+# /v1/embeddings のマイクロバッチング: 最初の入力からまとめて待つ時間と、1回の forward の入力数・トークン数の上限
+EMBEDDING_WINDOW_MS = float(os.environ.get("JAN_NANO_EMBEDDING_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH = int(os.environ.get("JAN_NANO_EMBEDDING_MAX_BATCH", "32"))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.environ.get("JAN_NANO_EMBEDDING_MAX_BATCH_TOKENS", "16384"))
+# 1入力のトークン数の上限（超えれば 400）
+EMBEDDING_MAX_TOKENS = int(os.environ.get("JAN_NANO_EMBEDDING_MAX_TOKENS", "8192"))
+embedding_batcher = None
+EMBEDDING_INPUTS = METRICS.counter("jan_nano_embedding_inputs_total", "Inputs embedded by /v1/embeddings")
+EMBEDDING_TOKENS = METRICS.counter("jan_nano_embedding_tokens_total", "Input tokens embedded by /v1/embeddings")
+
+# プレフィックスKVキャッシュのメモリ上限（MB）。0 で無効
+PREFIX_CACHE_MB = int(os.environ.get("JAN_NANO_PREFIX_CACHE_MB", "0"))
+prefix_cache = PrefixCache(PREFIX_CACHE_MB * 1024 * 1024) if PREFIX_CACHE_MB > 0 else None
+
+# 決定的なリクエスト（temperature == 0 または seed 指定）の応答キャッシュ。0 で無効
+RESPONSE_CACHE_MB = int(os.environ.get("JAN_NANO_RESPONSE_CACHE_MB", "0"))
+RESPONSE_CACHE_TTL = int(os.environ.get("JAN_NANO_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_PATH = os.environ.get("JAN_NANO_RESPONSE_CACHE_PATH")  # sqlite ファイル（任意）
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MB * 1024 * 1024, ttl=RESPONSE_CACHE_TTL, path=RESPONSE_CACHE_PATH
+) if RESPONSE_CACHE_MB > 0 else None
+
+def load_weights(model_path=MODEL_PATH):
+    """LOAD_MODE に従ってモデルを読み込む"""
+    dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    if LOAD_MODE == "mmap":
+        try:
+            # CPU ではチェックポイントの dtype のまま使い、重みをコピーしない
+            loaded = load_mmap_model(model_path, dtype=dtype if torch.cuda.is_available() else None)
+            return loaded.to("cuda") if torch.cuda.is_available() else loaded
+        except FileNotFoundError:
+            logger.warning("safetensors not found, falling back to from_pretrained")
+    
+    return AutoModelForCausalLM.from_pretrained(
+        model_path,
+        torch_dtype=dtype,
+        device_map="auto" if torch.cuda.is_available() else None,
+        low_cpu_mem_usage=True
+    )
+
+def warmup():
+    """短い生成を1回実行し、重みのページインやカーネルの初期化を最初のリクエストの前に済ませる"""
+    prompt_ids = prompt_builder.encode([{"role": "user", "content": "こんにちは"}])
+    with torch.no_grad():
+        model.generate(
+            torch.tensor([prompt_ids], device=model.device),
+            max_new_tokens=WARMUP_TOKENS,
+            min_new_tokens=WARMUP_TOKENS,
+            do_sample=False,
+            pad_token_id=tokenizer.eos_token_id
+        )
+
+def load_model():
+    global tokenizer, model, draft_model, scheduler, executor, embedding_batcher, prompt_builder, model_status
+    try:
+        started = time.perf_counter()
+        logger.info("Loading tokenizer...")
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+        prompt_builder = PromptBuilder(tokenizer)
+        
+        logger.info(f"Loading model ({LOAD_MODE}, backend: {BACKEND})...")
+        model = prepare_model(BACKEND, load_weights())
+        logger.info(f"Model loaded successfully! ({model_bytes(model) / 1024 ** 2:.0f} MB, "
+                    f"{time.perf_counter() - started:.1f}s)")
+        
+        if DRAFT_MODEL_PATH and MAX_BATCH_SIZE > 1:
+            logger.warning("Speculative decoding is disabled with continuous batching; the draft model is not loaded")
+        elif DRAFT_MODEL_PATH:
+            draft_model = prepare_model(BACKEND, load_weights(DRAFT_MODEL_PATH))
+            logger.info(f"Draft model loaded for speculative decoding ({model_bytes(draft_model) / 1024 ** 2:.0f} MB, "
+                        f"{DRAFT_TOKENS} tokens per step)")
+            if prefix_cache is not None:
+                logger.warning("The prefix cache is not used with speculative decoding")
+        
+        if WARMUP_TOKENS > 0:
+            warmup()
+            logger.info(f"Warmup finished ({time.perf_counter() - started:.1f}s)")
+        
+        if MAX_BATCH_SIZE > 1:
+            scheduler = ContinuousBatchScheduler(
+                model, eos_token_id=tokenizer.eos_token_id, max_batch_size=MAX_BATCH_SIZE,
+                prefix_cache=prefix_cache, max_pending=MAX_QUEUE, fair_queue=TENANTS.fair_queue()
+            ).start()
+            logger.info(f"Continuous batching enabled (max batch size: {MAX_BATCH_SIZE})")
+        else:
+            executor = InferenceExecutor(workers=INFERENCE_WORKERS, max_queue=MAX_QUEUE,
+                                         fair_queue=TENANTS.fair_queue()).start()
+        embedding_batcher = EmbeddingBatcher(
+            model, window=EMBEDDING_WINDOW_MS / 1000, max_batch_size=EMBEDDING_MAX_BATCH,
+            max_batch_tokens=EMBEDDING_MAX_BATCH_TOKENS
+        ).start()
+        
+        model_status = "ready"
+        logger.info(f"Ready ({time.perf_counter() - started:.1f}s)")
+        
+    except Exception as e:
+        logger.error(f"Error loading model: {e}")
+        # systemd (Restart=always) に再起動させる
+        os._exit(1)
+
+# リクエストモデル
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+# 上限は proven_api.py と同じ（request_limits.validate_chat_request）
+class ChatCompletionRequest(BaseModel):
+    model: str = "jan-nano-4b-q8"
+    messages: List[ChatMessage] = Field(min_length=1, max_length=MAX_MESSAGES)
+    max_tokens: Optional[int] = Field(512, ge=1, le=MAX_TOKENS_LIMIT)
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+    stream: Optional[bool] = False
+    seed: Optional[int] = None
+    n: Optional[int] = Field(1, ge=1, le=MAX_CHOICES)
+
+    @field_validator("max_tokens", "temperature", "top_p", "n", mode="before")
+    @classmethod
+    def null_means_default(cls, value, info):
+        # OpenAI API・proven_api.py と同じく null は省略と同じ扱い（既定値にする）
+        return cls.model_fields[info.field_name].default if value is None else value
+
+class EmbeddingRequest(BaseModel):
+    model: str = "jan-nano-4b-q8"
+    # 文字列・文字列のリスト・トークンIDのリスト・トークンIDのリストのリスト（OpenAI API と同じ）
+    input: Union[str, List[str], List[int], List[List[int]]]
+    encoding_format: Literal["float", "base64"] = "float"
+
+class ChatCompletionResponse(BaseModel):
+    id: str
+    object: str = "chat.completion"
+    created: int
+    model: str
+    choices: List[Dict[str, Any]]
+    usage: Dict[str, int]
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    # OpenAI API と同じく、不正なリクエストは 422 ではなく 400 で返す（大きな入力をそのまま返さないよう input は除く）
+    errors = [{key: value for key, value in error.items() if key != "input"} for error in exc.errors()]
+    return JSONResponse({"detail": jsonable_encoder(errors)}, status_code=400)
+
+def install_drain_handler():
+    """uvicorn の SIGTERM ハンドラーの前に drain を挟む
+
+    SIGTERM で /health を draining にし、DRAIN_GRACE 秒後に uvicorn の停止（受け付けの停止と、
+    処理中のリクエストを最大 DRAIN_TIMEOUT 秒待つ）に渡す。uvicorn のハンドラーは startup の前に設定される。
+    """
+    uvicorn_handler = signal.getsignal(signal.SIGTERM)
+    if not callable(uvicorn_handler):
+        return
+
+    def on_sigterm(signum, frame):
+        if DRAIN.draining.is_set():
+            return
+        DRAIN.start()
+        logger.info(f"SIGTERM received, draining for {DRAIN_GRACE:.1f}s")
+        Timer(DRAIN_GRACE, uvicorn_handler, (signum, frame)).start()
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+@app.on_event("startup")
+async def startup_event():
+    install_drain_handler()
+    # 読み込み中もリクエストを受け付け、/health で "loading" を返せるよう別スレッドで読み込む
+    Thread(target=load_model, daemon=True).start()
+
+@app.get("/")
+async def root():
+    return {"message": "Jan Nano 4B Q8 API Server", "status": "running"}
+
+@app.get("/health")
+async def health():
+    """ALB のヘルスチェック用。読み込みとウォームアップが終わるまでと、drain 中は 503"""
+    status = "draining" if DRAIN.draining.is_set() else model_status
+    return JSONResponse(
+        {"status": status, "load_mode": LOAD_MODE, "backend": BACKEND, "pid": os.getpid()},
+        status_code=200 if status == "ready" else 503
+    )
+
+@app.get("/v1/models")
+async def list_models():
+    return {
+        "object": "list",
+        "data": [
+            {
+                "id": "jan-nano-4b-q8",
+                "object": "model",
+                "created": int(time.time()),
+                "owned_by": "jan-hq"
+            }
+        ]
+    }
+
+class StopWhenJobStops(StoppingCriteria):
+    """ジョブの期限切れ・キャンセルで model.generate をトークン境界で打ち切る"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.job.should_stop(), dtype=torch.bool, device=input_ids.device)
+
+class TokenTimer(StoppingCriteria):
+    """生成を止めずに、最初と最後のトークンの時刻と生成数を記録する"""
+
+    def __init__(self):
+        self.first_token_at = None
+        self.last_token_at = None
+        self.tokens = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.last_token_at = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = self.last_token_at
+        self.tokens += 1
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+def observe_generation(started, generation_started, first_token_at, finished_at, tokens):
+    """プリフィル・デコード・TTFT・tokens/sec を記録する"""
+    if first_token_at is None:
+        return
+    PREFILL_SECONDS.observe(first_token_at - generation_started)
+    if started is not None:
+        TTFT_SECONDS.observe(first_token_at - started)
+    decode = finished_at - first_token_at
+    DECODE_SECONDS.observe(decode)
+    if tokens > 1 and decode > 0:
+        DECODE_TOKENS_PER_SECOND.observe((tokens - 1) / decode)
+    GENERATED_TOKENS.inc(amount=tokens)
+
+def generate(input_ids, generation_kwargs, streamer=None, seed=None, job=None, started=None, n=1):
+    """model.generate を実行し、プロンプトを含むトークン列 (n, seq_len) を返す
+
+    プレフィックスキャッシュが有効なら、一致する KV を再利用してプリフィルを省略し、
+    生成後のシーケンスの KV をキャッシュに登録する。
+    seed はグローバルな乱数状態に設定する（同時に他の生成が動いていると再現しない場合がある。
+    確実に再現させるには連続バッチングを有効にする）。
+    job（実行キューのジョブ）を渡すと、期限切れで生成を打ち切り DeadlineExceeded を送出する。
+    started（リクエストの受付時刻）は TTFT の計測に使う。
+    n > 1 ならプロンプトを1回だけプリフィルして n 件をまとめて生成する（先に終わった行は pad_token_id で埋まる）。
+    """
+    if seed is not None:
+        torch.manual_seed(seed)
+    timer = TokenTimer()
+    stopping_criteria = [timer]
+    if job is not None:
+        QUEUE_WAIT_SECONDS.observe(job.started_at - job.submitted_at)
+        stopping_criteria.append(StopWhenJobStops(job))
+    generation_kwargs = dict(generation_kwargs, stopping_criteria=stopping_criteria)
+    generation_started = time.perf_counter()
+    
+    if n > 1:
+        outputs = generate_choices(input_ids, n, generation_kwargs)
+        tokens = sum(len(ids) for ids, _ in split_completions(outputs, input_ids.shape[1],
+                                                               generation_kwargs["max_new_tokens"]))
+        observe_generation(started, generation_started, timer.first_token_at, timer.last_token_at, tokens)
+        if job is not None and job.should_stop():
+            raise DeadlineExceeded()
+        return outputs
+    
+    if draft_model is not None:
+        outputs = generate_speculative(input_ids, generation_kwargs, streamer, seed, job, timer)
+        observe_generation(started, generation_started, timer.first_token_at, timer.last_token_at, timer.tokens)
+        if job is not None and job.should_stop():
+            raise DeadlineExceeded()
+        return outputs
+    
+    if prefix_cache is None:
+        with torch.no_grad():
+            outputs = model.generate(input_ids, streamer=streamer, **generation_kwargs)
+        observe_generation(started, generation_started, timer.first_token_at, timer.last_token_at, timer.tokens)
+        if job is not None and job.should_stop():
+            raise DeadlineExceeded()
+        return outputs
+    
+    _, prefix = prefix_cache.match(input_ids[0].tolist())
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids,
+            streamer=streamer,
+            past_key_values=make_cache(prefix) if prefix is not None else None,
+            return_dict_in_generate=True,
+            **generation_kwargs
+        )
+    
+    observe_generation(started, generation_started, timer.first_token_at, timer.last_token_at, timer.tokens)
+    
+    # KV は最後の生成トークンを含まない
+    token_ids = outputs.sequences[0][:-1].tolist()
+    layers = [(key[:1, :, :len(token_ids)], value[:1, :, :len(token_ids)])
+              for key, value in cache_layers(outputs.past_key_values)]
+    prefix_cache.insert(token_ids, layers)
+    if job is not None and job.should_stop():
+        raise DeadlineExceeded()
+    return outputs.sequences
+
+def generate_choices(input_ids, n, generation_kwargs):
+    """プロンプトを1回だけプリフィルし、その KV を n 行で共有して n 件をまとめて生成する"""
+    _, prefix = prefix_cache.match(input_ids[0].tolist()) if prefix_cache is not None else (0, None)
+    cache = shared_prefill(model, input_ids, n, prefix)
+    with torch.no_grad():
+        return model.generate(input_ids.repeat(n, 1), past_key_values=cache, **generation_kwargs)
+
+def split_completions(outputs, prompt_length, max_tokens):
+    """生成結果の各行を EOS までの生成トークンに切り詰め、[(トークンIDのリスト, finish_reason), ...] を返す"""
+    completions = []
+    for row in outputs:
+        completion_ids = row[prompt_length:].tolist()
+        if tokenizer.eos_token_id in completion_ids:
+            completion_ids = completion_ids[:completion_ids.index(tokenizer.eos_token_id) + 1]
+            finish_reason = "stop"
+        else:
+            finish_reason = "length" if len(completion_ids) >= max_tokens else "stop"
+        completions.append((completion_ids, finish_reason))
+    return completions
+
+def completion_response(request, prompt_length, completions):
+    """(トークンIDのリスト, finish_reason) のリストから choices と usage を組み立てる
+
+    貪欲デコードでは全候補が同じなので1件だけ生成し、n 件に複製する。
+    usage の prompt_tokens は共有したプロンプトの1回分、completion_tokens は全候補の合計。
+    """
+    completions = (completions * request.n)[:request.n]
+    choices = [
+        {
+            "index": index,
+            "message": {
+                "role": "assistant",
+                "content": tokenizer.decode(completion_ids, skip_special_tokens=True).strip()
+            },
+            "finish_reason": finish_reason
+        }
+        for index, (completion_ids, finish_reason) in enumerate(completions)
+    ]
+    return ChatCompletionResponse(
+        id=f"chatcmpl-{int(time.time())}",
+        created=int(time.time()),
+        model=request.model,
+        choices=choices,
+        usage=usage(prompt_length, sum(len(completion_ids) for completion_ids, _ in completions))
+    )
+
+def generate_speculative(input_ids, generation_kwargs, streamer, seed, job, timer):
+    """ドラフトモデルで投機的デコーディングを行う（generate() の代わり。プレフィックスキャッシュは使わない）"""
+    def on_tokens(token_ids):
+        for _ in token_ids:
+            timer(input_ids, None)
+        if streamer is not None:
+            streamer.put(torch.tensor(token_ids))
+    
+    if streamer is not None:
+        # TextIteratorStreamer(skip_prompt=True) は最初の put をプロンプトとして読み飛ばす
+        streamer.put(input_ids[0])
+    sampling = generation_kwargs.get("do_sample", False)
+    try:
+        outputs, stats = speculative_generate(
+            model, draft_model, input_ids.to(model.device), generation_kwargs["max_new_tokens"],
+            temperature=generation_kwargs["temperature"] if sampling else 0.0,
+            top_p=generation_kwargs["top_p"] if sampling else 1.0,
+            num_draft_tokens=DRAFT_TOKENS,
+            eos_token_id=tokenizer.eos_token_id,
+            generator=torch.Generator().manual_seed(seed) if seed is not None else None,
+            on_tokens=on_tokens,
+            should_stop=job.should_stop if job is not None else None
+        )
+    finally:
+        if streamer is not None:
+            streamer.end()
+    speculative_stats.record(stats)
+    SPECULATIVE_DRAFT_TOKENS.inc("accepted", amount=stats["accepted"])
+    SPECULATIVE_DRAFT_TOKENS.inc("rejected", amount=stats["proposed"] - stats["accepted"])
+    SPECULATIVE_FORWARDS.inc(amount=stats["rounds"])
+    return outputs
+
+def start_generation_stream(input_ids, generation_kwargs, seed=None, deadline=None, started=None, tenant=None):
+    """実行キューで model.generate を実行し、生成テキストを逐次返すストリーマーと finish を返す
+
+    finish() は生成の完了を待って finish_reason を返す。生成が失敗した場合（キューからの押し出し、
+    期限切れ、生成中のエラー）はその例外を送出する（stream_chat_completion が error イベントにする）。
+    """
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    job = executor.submit(
+        lambda job: generate(input_ids, generation_kwargs, streamer=streamer, seed=seed, job=job, started=started),
+        deadline=deadline,
+        tenant=tenant,
+        cost=input_ids.shape[1] + generation_kwargs["max_new_tokens"]
+    )
+    # 実行前に期限切れになった場合や失敗した場合もストリームを終わらせる
+    job.future.add_done_callback(lambda future: future.exception() is not None and streamer.end())
+
+    def finish():
+        outputs = job.future.result()
+        return split_completions(outputs, input_ids.shape[1], generation_kwargs["max_new_tokens"])[0][1]
+
+    return streamer, finish
+
+async def wait_for_job(job):
+    """ジョブの完了を待つ。待っている側がキャンセルされたら生成も打ち切る"""
+    try:
+        return await asyncio.wrap_future(job.future)
+    except asyncio.CancelledError:
+        job.cancel()
+        raise
+
+def log_stream_stats(stats):
+    ttft = f"{stats['ttft']:.3f}s" if stats["ttft"] is not None else "n/a"
+    logger.info(f"Stream finished: ttft={ttft} chunks={stats['chunks']} duration={stats['duration']:.3f}s "
+                f"finish_reason={stats['finish_reason']}")
+
+def observe_scheduled(generation, started):
+    """スケジューラーで完了したリクエストの待ち時間と生成時間を記録する"""
+    if generation.admitted_at is not None:
+        QUEUE_WAIT_SECONDS.observe(generation.admitted_at - generation.submitted_at)
+        observe_generation(started, generation.admitted_at, generation.first_token_at,
+                           generation.finished_at, len(generation.output_ids))
+
+async def scheduled_completion(request, input_ids, started, deadline=None, n=1, tenant=None):
+    """連続バッチングのスケジューラーで生成する（n 件はプリフィルを共有して同じバッチに加える）"""
+    streamer = None
+    if request.stream:
+        # スケジューラーは生成トークンだけを put するので skip_prompt は不要
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=False, skip_special_tokens=True)
+    
+    generations = scheduler.submit_group(
+        input_ids,
+        n,
+        max_new_tokens=request.max_tokens,
+        temperature=request.temperature,
+        top_p=request.top_p,
+        streamer=streamer,
+        seed=request.seed,
+        deadline=deadline,
+        tenant=tenant
+    )
+    for generation in generations:
+        generation.future.add_done_callback(lambda future, generation=generation: observe_scheduled(generation, started))
+    
+    if request.stream:
+        def finish():
+            # 失敗（押し出し・期限切れ・生成中のエラー）なら例外を送出する
+            generations[0].future.result()
+            return generations[0].finish_reason
+
+        return StreamingResponse(
+            stream_chat_completion(streamer, request.model, started=started, on_complete=log_stream_stats,
+                                   finish=finish),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
+    
+    outputs = await asyncio.gather(*(wait_for_job(generation) for generation in generations))
+    return completion_response(request, len(input_ids), [
+        (output_ids, generation.finish_reason) for output_ids, generation in zip(outputs, generations)
+    ])
+
+@app.get("/stats")
+async def stats():
+    """トークン化・プレフィックス・応答キャッシュのヒット率など"""
+    return {
+        "prompt_cache": prompt_builder.stats() if prompt_builder is not None else None,
+        "prefix_cache": prefix_cache.stats() if prefix_cache is not None else None,
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "queue": (scheduler or executor).stats() if (scheduler or executor) is not None else None,
+        "speculative": speculative_stats.stats() if draft_model is not None else None,
+        "embeddings": embedding_batcher.stats() if embedding_batcher is not None else None
+    }
+
+def request_deadline(raw_request):
+    """X-Request-Timeout ヘッダー（秒）または REQUEST_TIMEOUT から time.perf_counter() 基準の期限を返す"""
+    timeout = raw_request.headers.get("x-request-timeout")
+    try:
+        timeout = float(timeout) if timeout is not None else REQUEST_TIMEOUT
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid X-Request-Timeout")
+    return time.perf_counter() + timeout if timeout > 0 else None
+
+def request_tenant(raw_request):
+    """Authorization: Bearer <API キー> のテナント（キーがない・未登録なら既定のテナント）"""
+    scheme, _, api_key = raw_request.headers.get("authorization", "").partition(" ")
+    return TENANTS.resolve(api_key.strip() if scheme.lower() == "bearer" else None)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 形式のメトリクス"""
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest, raw_request: Request):
+    if model_status != "ready":
+        raise HTTPException(status_code=503, detail="Model is loading", headers={"Retry-After": "5"})
+    deadline = request_deadline(raw_request)
+    tenant = request_tenant(raw_request)
+    if request.stream and request.n > 1:
+        raise HTTPException(status_code=400, detail="Streaming supports n=1 only")
+    
+    # 決定的なリクエストは応答キャッシュを確認（X-Cache: HIT|MISS）
+    payload = request.model_dump()
+    if response_cache is None or not is_cacheable(payload):
+        return await create_chat_completion(request, deadline, tenant)
+    
+    key = cache_key(payload)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
+    
+    response = await create_chat_completion(request, deadline, tenant)
+    body = dumps(response.model_dump())
+    response_cache.put(key, body)
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+def embedding_inputs(value):
+    """EmbeddingRequest.input をトークンIDのリストのリストにする（空・上限超えは 400）"""
+    if isinstance(value, str) or (value and isinstance(value[0], int)):
+        value = [value]
+    if not value:
+        raise HTTPException(status_code=400, detail="input must not be empty")
+    if len(value) > MAX_EMBEDDING_INPUTS:
+        raise HTTPException(status_code=400, detail=f"Too many inputs ({len(value)} > {MAX_EMBEDDING_INPUTS})")
+    texts = [(index, text) for index, text in enumerate(value) if isinstance(text, str)]
+    inputs = list(value)
+    if texts:
+        tokenize_started = time.perf_counter()
+        encoded = tokenizer([text for _, text in texts], add_special_tokens=False)["input_ids"]
+        TOKENIZE_SECONDS.observe(time.perf_counter() - tokenize_started)
+        for (index, _), token_ids in zip(texts, encoded):
+            inputs[index] = token_ids
+    vocab_size = len(tokenizer)
+    for token_ids in inputs:
+        if not token_ids:
+            raise HTTPException(status_code=400, detail="input must not contain empty strings or token lists")
+        if len(token_ids) > EMBEDDING_MAX_TOKENS:
+            raise HTTPException(status_code=400,
+                                detail=f"Input is too long ({len(token_ids)} > {EMBEDDING_MAX_TOKENS} tokens)")
+        if not all(0 <= token_id < vocab_size for token_id in token_ids):
+            raise HTTPException(status_code=400, detail="Token ID out of range")
+    return inputs
+
+@app.post("/v1/embeddings")
+async def create_embeddings(request: EmbeddingRequest, raw_request: Request):
+    if model_status != "ready":
+        raise HTTPException(status_code=503, detail="Model is loading", headers={"Retry-After": "5"})
+    deadline = request_deadline(raw_request)
+    inputs = embedding_inputs(request.input)
+    
+    try:
+        items = embedding_batcher.submit(inputs, deadline=deadline)
+        vectors = await asyncio.gather(*(asyncio.wrap_future(item.future) for item in items))
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    
+    tokens = sum(len(token_ids) for token_ids in inputs)
+    EMBEDDING_INPUTS.inc(amount=len(inputs))
+    EMBEDDING_TOKENS.inc(amount=tokens)
+    # 埋め込みは大きいので pydantic を通さずに直接エンコードする
+    body = dumps({
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": index, "embedding": encode_embedding(vector, request.encoding_format)}
+            for index, vector in enumerate(vectors)
+        ],
+        "model": request.model,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    })
+    return Response(content=body, media_type="application/json")
+
+async def create_chat_completion(request, deadline=None, tenant=None):
+    try:
+        started = time.perf_counter()
+
+        # プロンプトのトークンID（chat template で構築し、メッセージ単位のトークン化をキャッシュ）
+        tokenize_started = time.perf_counter()
+        prompt_ids = prompt_builder.encode(request.messages)
+        TOKENIZE_SECONDS.observe(time.perf_counter() - tokenize_started)
+        input_ids = torch.tensor([prompt_ids])
+        
+        # 生成パラメータ
+        generation_kwargs = {
+            "max_new_tokens": request.max_tokens,
+            "pad_token_id": tokenizer.eos_token_id,
+        }
+        if request.temperature > 0:
+            generation_kwargs.update(do_sample=True, temperature=request.temperature, top_p=request.top_p)
+        else:
+            # temperature == 0 は貪欲デコード
+            generation_kwargs.update(do_sample=False)
+        # 貪欲デコードの候補は全て同じなので1件だけ生成する
+        n = request.n if request.temperature > 0 else 1
+        
+        if scheduler is not None:
+            return await scheduled_completion(request, prompt_ids, started, deadline, n, tenant)
+        
+        # ストリーミング: トークン生成ごとに chat.completion.chunk を送信
+        if request.stream:
+            streamer, finish = start_generation_stream(
+                input_ids, generation_kwargs, seed=request.seed, deadline=deadline, started=started, tenant=tenant
+            )
+            return StreamingResponse(
+                stream_chat_completion(streamer, request.model, started=started, on_complete=log_stream_stats,
+                                       finish=finish),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"}
+            )
+        
+        # テキスト生成（イベントループを止めないよう実行キューで実行）
+        # 見込みのトークン数（プロンプト + 生成する候補の max_tokens）をテナントの枠とレート制限に数える
+        job = executor.submit(
+            lambda job: generate(input_ids, generation_kwargs, seed=request.seed, job=job, started=started, n=n),
+            deadline=deadline,
+            tenant=tenant,
+            cost=len(prompt_ids) + n * request.max_tokens
+        )
+        outputs = await wait_for_job(job)
+        
+        # 新しく生成したトークンだけをデコードしてレスポンスを構築
+        return completion_response(request, len(prompt_ids),
+                                   split_completions(outputs, len(prompt_ids), request.max_tokens))
+        
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in chat completion: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+if __name__ == "__main__":
+    port = int(os.environ.get("JAN_NANO_PORT", "8000"))
+    if PROCESSES > 1 and LOAD_MODE != "mmap":
+        logger.warning("Each worker process loads its own copy of the weights; "
+                       "set JAN_NANO_LOAD_MODE=mmap to share them")
+    # ワーカーは api_server モジュールを読み込み直すので、アプリはインポート文字列で渡す。
+    # torch と transformers の import に数秒かかるため、ワーカーの死活確認の待ち時間を延ばす
+    config = uvicorn.Config("api_server:app" if PROCESSES > 1 else app, host="0.0.0.0", port=port,
+                            workers=PROCESSES, timeout_worker_healthcheck=60,
+                            timeout_graceful_shutdown=DRAIN_TIMEOUT)
+    # uvicorn.run() は SO_REUSEPORT を設定できないので、ソケットを作って渡す
+    sock = reuse_port_socket("0.0.0.0", port) if REUSE_PORT else config.bind_socket()
+    try:
+        if PROCESSES > 1:
+            Multiprocess(config, sockets=[sock]).run()
+        else:
+            uvicorn.Server(config).run(sockets=[sock])
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,71 @@
+"""
+推論バックエンド
+api_server.py が JAN_NANO_BACKEND で選び、読み込んだモデルを prepare_model() で変換してから使います
+
+バックエンドは読み込み済みの HF モデルを受け取り、generate() と forward() をそのまま使えるモデルを返す関数です。
+chat_completions・連続バッチング・プレフィックスキャッシュはバックエンドを意識しません。
+register_backend() で追加できます。
+
+- "torch"（既定）: そのまま使う（JAN_NANO_LOAD_MODE の dtype。eager なら CPU では float32）
+- "int8": nn.Linear を動的量子化（重みは int8、活性化は実行時に量子化）に置き換える。CPU のみ。
+  1層ずつ変換して元の重みを解放するので、全体の float32 コピーを作らない
+"""
+
+import torch
+from torch import nn
+
+BACKENDS = {}
+
+
+def register_backend(name):
+    """prepare(model) -> model をバックエンドとして登録するデコレーター"""
+    def decorator(prepare):
+        BACKENDS[name] = prepare
+        return prepare
+    return decorator
+
+
+def prepare_model(name, model):
+    """name のバックエンドでモデルを変換する（eval モードで返す）"""
+    try:
+        prepare = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown backend: {name} (choose from {', '.join(sorted(BACKENDS))})")
+    return prepare(model).eval()
+
+
+def model_bytes(model):
+    """パラメーター・バッファ・量子化済み重みのバイト数"""
+    total = 0
+    for module in model.modules():
+        for tensor in (*module.parameters(recurse=False), *module.buffers(recurse=False)):
+            total += tensor.numel() * tensor.element_size()
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight, bias = module._weight_bias()
+            total += weight.numel() * weight.element_size()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+    return total
+
+
+@register_backend("torch")
+def torch_backend(model):
+    return model
+
+
+@register_backend("int8")
+def int8_backend(model):
+    if next(model.parameters()).device.type != "cpu":
+        raise ValueError("the int8 backend supports CPU only")
+
+    # モジュールではなく名前を集め、置き換えた層の float32 の重みがすぐに解放されるようにする
+    names = [name for name, module in model.named_modules() if type(module) is nn.Linear]
+    for name in names:
+        parent_name, _, child = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        # mmap で読み込んだ bfloat16 などの層もこの層だけ float32 にしてから量子化する
+        linear = getattr(parent, child).float()
+        linear.qconfig = torch.ao.quantization.default_dynamic_qconfig
+        setattr(parent, child, torch.ao.nn.quantized.dynamic.Linear.from_float(linear))
+    # 埋め込みと正規化層は量子化しない。int8 の Linear に合わせて float32 にする
+    return model.float()
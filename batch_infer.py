@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+JSONL のチャットリクエストをまとめて処理するオフラインのバッチ推論
+
+HTTP を通さずにモデルを読み込み、入力ファイルの各行を連続バッチングのスケジューラー（batching.py）に流して、
+結果を入力と同じ順に JSONL で書き出します。
+
+    python3 batch_infer.py requests.jsonl results.jsonl --model-path /home/ubuntu/models/jan-nano-4b-q8
+    python3 batch_infer.py requests.jsonl results.jsonl --resume   # 中断したところから再開
+
+入力の各行は /v1/chat/completions のリクエスト（messages, max_tokens, temperature, top_p, seed, n）か、
+OpenAI Batch API と同じ {"custom_id": ..., "body": {リクエスト}} の形式です。
+出力の各行は {"custom_id", "line", "response", "error"} で、response は chat.completion の応答、
+失敗した行（不正な JSON・上限超えなど）は error にメッセージが入ります。空行は出力しません。
+
+- 入力は --window 行ずつ読み、プロンプトの長さ順に並べて投入する（同じバッチのシーケンスの長さが揃う）。
+  処理中（書き出し前）の行が --window 行以下になったら次の --window 行を読むので、
+  メモリ使用量は入力ファイルの大きさに関係なく 2 × --window 行分で収まる
+- 書き出しが済んだ入力行数と出力ファイルのバイト数を <出力>.checkpoint に記録する（--checkpoint-every 行毎）。
+  --resume では出力をそのバイト数に切り詰め、続きの行から処理する
+- SIGTERM を受けると、その時点までに書き出した行でチェックポイントを保存して終了する（生成中の行は --resume で
+  やり直す）
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from backends import BACKENDS, prepare_model
+from batching import ContinuousBatchScheduler
+from fastjson import dumps, loads
+from model_loader import load_mmap_model
+from prompting import PromptBuilder, usage
+from request_limits import RequestRejected, validate_chat_request
+
+
+def load_model(model_path, load_mode="eager", backend="torch"):
+    """api_server.py と同じ設定でトークナイザーとモデルを読み込む"""
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = None
+    if load_mode == "mmap":
+        try:
+            model = load_mmap_model(model_path)
+        except FileNotFoundError:
+            print("safetensors が見つからないため from_pretrained で読み込みます", file=sys.stderr)
+    if model is None:
+        model = AutoModelForCausalLM.from_pretrained(model_path, dtype=torch.float32, low_cpu_mem_usage=True)
+    return tokenizer, prepare_model(backend, model)
+
+
+class Checkpoint:
+    """書き出し済みの入力行数と出力ファイルのバイト数を記録する（一時ファイルに書いてから置き換える）"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, input_lines, output_bytes, complete=False):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({"input_lines": input_lines, "output_bytes": output_bytes, "complete": complete}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class LineJob:
+    """入力の1行。generations が終わるか、error / blank が決まっていれば書き出せる"""
+
+    def __init__(self, line_number, custom_id=None, request=None, prompt_ids=None, error=None, blank=False):
+        self.line_number = line_number
+        self.custom_id = custom_id
+        self.request = request
+        self.prompt_ids = prompt_ids
+        self.error = error
+        self.blank = blank
+        self.generations = []
+
+    def done(self):
+        return all(generation.future.done() for generation in self.generations)
+
+    def record(self, tokenizer, model_name):
+        """出力する1行（bytes）。空行なら None"""
+        if self.blank:
+            return None
+        response = None
+        if self.error is None:
+            try:
+                outputs = [generation.result() for generation in self.generations]
+            except Exception as e:
+                self.error = str(e) or type(e).__name__
+            else:
+                # 貪欲デコードでは1件だけ生成して n 件に複製する
+                n = self.request.get('n') or 1
+                completions = ([(output_ids, generation.finish_reason)
+                                for output_ids, generation in zip(outputs, self.generations)] * n)[:n]
+                response = {
+                    "id": f"batch-{self.line_number}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": self.request.get('model') or model_name,
+                    "choices": [
+                        {
+                            "index": index,
+                            "message": {
+                                "role": "assistant",
+                                "content": tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+                            },
+                            "finish_reason": finish_reason
+                        }
+                        for index, (output_ids, finish_reason) in enumerate(completions)
+                    ],
+                    "usage": usage(len(self.prompt_ids), sum(len(output_ids) for output_ids, _ in completions))
+                }
+        return dumps({
+            "custom_id": self.custom_id,
+            "line": self.line_number,
+            "response": response,
+            "error": {"message": self.error} if self.error is not None else None
+        }) + b'\n'
+
+
+def parse_line(line_number, line, prompt_builder):
+    """入力の1行を LineJob にする（プロンプトのトークン化まで）"""
+    if not line.strip():
+        return LineJob(line_number, blank=True)
+    custom_id = None
+    try:
+        data = loads(line)
+        if isinstance(data, dict) and isinstance(data.get('body'), dict):
+            custom_id = data.get('custom_id')
+            data = data['body']
+        request = validate_chat_request(data)
+        if not request.get('messages'):
+            raise RequestRejected(400, "messages must not be empty")
+        # null は省略と同じ扱い（既定値は api_server.py と同じ）
+        for key, default in (('temperature', 0.7), ('top_p', 0.9)):
+            value = request.get(key)
+            if value is None:
+                request[key] = default
+            elif isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise RequestRejected(400, f"{key} must be a number")
+        if request.get('seed') is not None and not isinstance(request['seed'], int):
+            raise RequestRejected(400, "seed must be an integer")
+        return LineJob(line_number, custom_id, request, prompt_builder.encode(request['messages']))
+    except (ValueError, RequestRejected) as e:
+        return LineJob(line_number, custom_id, error=str(e))
+
+
+def submit(scheduler, job):
+    """1行分の生成を投入する（temperature と top_p は parse_line で既定値を入れてある）"""
+    request = job.request
+    temperature = request['temperature']
+    n = request.get('n') or 1
+    job.generations = scheduler.submit_group(
+        job.prompt_ids,
+        n if temperature > 0 else 1,
+        max_new_tokens=request.get('max_tokens') or 512,
+        temperature=temperature,
+        top_p=request['top_p'],
+        seed=request.get('seed')
+    )
+
+
+def run(scheduler, tokenizer, input_path, output_path, window=256, resume=False, checkpoint_every=64,
+        model_name="jan-nano-4b-q8", log=None, stop=None):
+    """input_path の全行を処理して output_path に書き出し、統計を返す
+
+    stop（threading.Event）がセットされたら、書き出し済みの行でチェックポイントを保存して途中で戻る
+    （stats["interrupted"] が True）。
+    """
+    prompt_builder = PromptBuilder(tokenizer)
+    checkpoint = Checkpoint(output_path + '.checkpoint')
+    state = checkpoint.load()
+    if state is not None and not resume:
+        raise SystemExit(f"{checkpoint.path} があります。--resume で再開するか、削除してからやり直してください")
+    if state is not None and state["complete"]:
+        return {"lines": 0, "errors": 0, "tokens": 0, "seconds": 0.0, "resumed_from": state["input_lines"],
+                "interrupted": False, "next_line": state["input_lines"]}
+    start_line, output_bytes = (state["input_lines"], state["output_bytes"]) if state else (0, 0)
+
+    stats = {"lines": 0, "errors": 0, "tokens": 0, "resumed_from": start_line, "interrupted": False}
+    started = time.perf_counter()
+    with open(input_path, 'rb') as source, open(output_path, 'r+b' if state else 'wb') as output:
+        # 前回の最後のチェックポイントより後に書いた分は捨てる
+        output.truncate(output_bytes)
+        output.seek(output_bytes)
+        lines = enumerate(source)
+        for _ in islice(lines, start_line):
+            pass
+
+        pending = {}  # 行番号 -> LineJob（書き出し前）
+        next_line = start_line
+        last_checkpoint = start_line
+        exhausted = False
+        while True:
+            # 書き出し前の行が window 行以下なら次の window 行を読み、プロンプトの短い順に投入する
+            if not exhausted and len(pending) <= window:
+                chunk = [parse_line(line_number, line, prompt_builder) for line_number, line in islice(lines, window)]
+                exhausted = len(chunk) < window
+                for job in sorted((job for job in chunk if job.prompt_ids is not None),
+                                  key=lambda job: len(job.prompt_ids)):
+                    submit(scheduler, job)
+                pending.update((job.line_number, job) for job in chunk)
+
+            # 入力の順に、終わっている行を書き出す
+            while next_line in pending and pending[next_line].done():
+                job = pending.pop(next_line)
+                record = job.record(tokenizer, model_name)
+                if record is not None:
+                    output.write(record)
+                    stats["lines"] += 1
+                    stats["errors"] += job.error is not None
+                    stats["tokens"] += sum(len(generation.output_ids) for generation in job.generations)
+                next_line += 1
+            if next_line - last_checkpoint >= checkpoint_every:
+                output.flush()
+                os.fsync(output.fileno())
+                checkpoint.save(next_line, output.tell())
+                last_checkpoint = next_line
+                if log is not None:
+                    elapsed = time.perf_counter() - started
+                    log(f"{next_line} 行完了（{stats['lines'] / elapsed:.1f} 行/秒、{stats['tokens'] / elapsed:.1f} tokens/秒）")
+
+            if exhausted and not pending:
+                break
+            if stop is not None and stop.is_set():
+                stats["interrupted"] = True
+                break
+            futures = [generation.future for job in pending.values() for generation in job.generations
+                       if not generation.future.done()]
+            if futures:
+                wait(futures, timeout=1.0, return_when=FIRST_COMPLETED)
+
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint.save(next_line, output.tell(), complete=not stats["interrupted"])
+    stats["next_line"] = next_line
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONL のチャットリクエストをまとめて処理するオフラインのバッチ推論")
+    parser.add_argument('input', help="入力 JSONL（1行に1リクエスト）")
+    parser.add_argument('output', help="出力 JSONL（入力と同じ順）")
+    parser.add_argument('--model-path', default=os.environ.get("JAN_NANO_MODEL_PATH",
+                                                               "/home/ubuntu/models/jan-nano-4b-q8"))
+    parser.add_argument('--load-mode', default=os.environ.get("JAN_NANO_LOAD_MODE", "eager"),
+                        choices=['eager', 'mmap'])
+    parser.add_argument('--backend', default=os.environ.get("JAN_NANO_BACKEND", "torch"), choices=sorted(BACKENDS))
+    parser.add_argument('--batch-size', type=int, default=8, help="1つのデコードバッチの最大シーケンス数")
+    parser.add_argument('--window', type=int, default=256, help="一度に読んで長さ順に並べる行数")
+    parser.add_argument('--checkpoint-every', type=int, default=64, help="チェックポイントを保存する間隔（行）")
+    parser.add_argument('--resume', action='store_true', help="<出力>.checkpoint から再開する")
+    parser.add_argument('--json', help="統計を保存するJSONファイル")
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    loading = time.perf_counter()
+    tokenizer, model = load_model(args.model_path, args.load_mode, args.backend)
+    print(f"モデルを読み込みました（{time.perf_counter() - loading:.1f}秒、backend: {args.backend}）")
+
+    # SIGTERM（systemctl stop など）ではチェックポイントを保存してから終了する
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    scheduler = ContinuousBatchScheduler(model, eos_token_id=tokenizer.eos_token_id,
+                                         max_batch_size=args.batch_size).start()
+    try:
+        stats = run(scheduler, tokenizer, args.input, args.output, window=args.window, resume=args.resume,
+                    checkpoint_every=args.checkpoint_every, log=print, stop=stop)
+    finally:
+        scheduler.stop()
+
+    if stats["resumed_from"]:
+        print(f"{stats['resumed_from']} 行目から再開しました")
+    if stats["interrupted"]:
+        print(f"SIGTERM を受けたため中断しました（--resume で {stats['next_line']} 行目から再開できます）")
+    seconds = stats["seconds"] or float('inf')
+    print(f"完了: {stats['lines']} 行（エラー {stats['errors']}）、生成 {stats['tokens']} トークン、{stats['seconds']:.1f}秒 "
+          f"（{stats['lines'] / seconds:.2f} 行/秒、{stats['tokens'] / seconds:.1f} tokens/秒）")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(stats, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
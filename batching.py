@@ -0,0 +1,362 @@
+"""
+連続バッチング（continuous batching）スケジューラー
+
+同時に届いたリクエストを1つのデコードバッチにまとめ、1ステップの forward で
+全シーケンスの次トークンを生成します。新しいリクエストはトークン境界で
+バッチに加わり、終了したシーケンスはその場でバッチから外れます。
+max_tokens / temperature / top_p はリクエスト毎に保持します。
+
+KVキャッシュは左詰めのパディングで長さを揃え、attention_mask で無効化します。
+prefix_cache を渡すと、プリフィル時に一致するプレフィックスの KV を再利用し、
+終了したシーケンスの KV をキャッシュに登録します。
+
+submit_group() は同じプロンプトから n 件を生成する（OpenAI API の n）。プリフィルは1回だけ行い、
+その KV を n 行に複製してバッチに加える。
+
+待機中のリクエスト数は max_pending で制限し（超えると QueueFull）、
+期限（deadline）を過ぎたリクエストはバッチから外して DeadlineExceeded で終了します。
+待機中のリクエストは FairQueue に入り、テナントの優先度クラスと重み（tenancy.py）の順にバッチに加わります。
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from admission import DeadlineExceeded, FairQueue, QueueFull, WaitStats, retry_after_seconds
+from kv_cache import cache_layers, make_cache, left_pad, select_rows, concat_rows, expand_rows
+from sampling import sample_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest:
+    """スケジューラーに投入された1件の生成リクエスト"""
+
+    def __init__(self, input_ids, max_new_tokens=512, temperature=0.7, top_p=0.9, streamer=None, seed=None,
+                 deadline=None):
+        self.input_ids = list(input_ids)
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        # seed を指定すると、バッチの組み合わせに関係なく同じ出力になる
+        self.generator = torch.Generator().manual_seed(seed) if seed is not None else None
+        # transformers のストリーマー（put / end を持つオブジェクト）
+        self.streamer = streamer
+        # time.perf_counter() 基準の期限（None なら無期限）
+        self.deadline = deadline
+        self.output_ids = []
+        self.finish_reason = None
+        self.submitted_at = time.perf_counter()
+        self.admitted_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        # 完了時に生成トークンIDのリストが入る
+        self.future = Future()
+
+        self._cancelled = threading.Event()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def cancel(self):
+        """結果が不要になった。次のトークン境界でバッチから外す"""
+        self._cancelled.set()
+
+    def should_stop(self):
+        return self._cancelled.is_set() or (self.deadline is not None and time.perf_counter() >= self.deadline)
+
+
+class ContinuousBatchScheduler:
+    """バックグラウンドスレッドで共有デコードバッチを回すスケジューラー"""
+
+    def __init__(self, model, eos_token_id=None, max_batch_size=8, prefix_cache=None, max_pending=None,
+                 fair_queue=None):
+        self.model = model
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.max_pending = max_pending
+        # 要素は同じプロンプトから生成するリクエストのリスト（submit() なら1件）。テナントを指定しなければ FIFO
+        self.pending = fair_queue if fair_queue is not None else FairQueue()
+        # バッチの空きが足りずに加えられなかったグループ（次のトークン境界で最初に加える）
+        self._deferred = None
+        self.wait_stats = WaitStats()
+
+        # バッチの状態（行の並びは self.active と一致）
+        self.active = []
+        self.layers = None
+        self.attention_mask = None
+        self.next_tokens = None
+        self.temperatures = None
+        self.top_ps = None
+
+        self.steps = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def submit(self, input_ids, max_new_tokens=512, temperature=0.7, top_p=0.9, streamer=None, seed=None,
+               deadline=None, tenant=None):
+        """リクエストを投入する。戻り値の future で生成結果を待てる
+
+        待機中のリクエストが max_pending 件あり、押し出せる低いクラスのリクエストもなければ QueueFull。
+        """
+        return self.submit_group(input_ids, 1, max_new_tokens, temperature, top_p, streamer, seed, deadline,
+                                 tenant)[0]
+
+    def submit_group(self, input_ids, n, max_new_tokens=512, temperature=0.7, top_p=0.9, streamer=None, seed=None,
+                     deadline=None, tenant=None):
+        """同じプロンプトから n 件を生成するリクエストを投入し、GenerationRequest のリストを返す
+
+        プリフィルは1回だけ行う。seed を指定すると i 件目は seed + i で生成する。
+        streamer は n == 1 の場合だけ使える。
+        tenant（admission.QueueTenant）のクラスと重みで順番が決まり、見込みのトークン数
+        （プロンプト + n × max_new_tokens）をテナントの枠とレート制限に数える。
+        """
+        if streamer is not None and n > 1:
+            raise ValueError("streaming supports a single sequence")
+        group = [
+            GenerationRequest(input_ids, max_new_tokens, temperature, top_p, streamer,
+                              seed + i if seed is not None else None, deadline)
+            for i in range(n)
+        ]
+        try:
+            evicted = self.pending.put(group, tenant, len(group[0].input_ids) + n * max_new_tokens, self.max_pending)
+        except queue.Full:
+            self.wait_stats.rejected += 1
+            raise QueueFull(self.retry_after())
+        if evicted is not None:
+            # 優先度の高いリクエストに押し出された
+            self.wait_stats.rejected += 1
+            for request in evicted:
+                if request.streamer is not None:
+                    request.streamer.end()
+                request.future.set_exception(QueueFull(self.retry_after()))
+        return group
+
+    def retry_after(self):
+        return retry_after_seconds(self.pending.qsize(), self.wait_stats.mean_service_time(), self.max_batch_size)
+
+    def stats(self):
+        return {
+            "queue_depth": self.pending.qsize(),
+            "max_queue": self.max_pending,
+            "running": len(self.active),
+            "max_batch_size": self.max_batch_size,
+            **self.wait_stats.stats(),
+            **self.pending.stats(),
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self.active:
+                group, self._deferred = self._deferred, None
+                if group is None:
+                    try:
+                        group = self.pending.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                # バッチが空なら max_batch_size より大きいグループもそのまま加える
+                self._admit(group)
+
+            # トークン境界で待機中のリクエストを空き枠の分だけ追加
+            while len(self.active) < self.max_batch_size:
+                group, self._deferred = self._deferred, None
+                if group is None:
+                    try:
+                        group = self.pending.get_nowait()
+                    except queue.Empty:
+                        break
+                if self.active and len(self.active) + len(group) > self.max_batch_size:
+                    self._deferred = group
+                    break
+                self._admit(group)
+
+            if self.active:
+                try:
+                    self._decode_step()
+                except Exception as e:
+                    logger.error(f"Batch decode failed: {e}")
+                    self._fail_all(e)
+
+    def _admit(self, group):
+        """グループ共通のプリフィルを1回実行し、各リクエストの最初のトークンをサンプリングしてバッチに加える"""
+        admitted_at = time.perf_counter()
+        live = []
+        for request in group:
+            request.admitted_at = admitted_at
+            self.wait_stats.record_wait(admitted_at - request.submitted_at)
+            if request.should_stop():
+                # 待っている間に期限切れ・キャンセルになったリクエストはプリフィルしない
+                self._expire(request)
+            else:
+                live.append(request)
+        if not live:
+            return
+        group, n = live, len(live)
+        input_ids = group[0].input_ids
+
+        try:
+            matched, prefix = 0, None
+            if self.prefix_cache is not None:
+                matched, prefix = self.prefix_cache.match(input_ids)
+            with torch.no_grad():
+                outputs = self.model(
+                    input_ids=torch.tensor([input_ids[matched:]]),
+                    past_key_values=make_cache(prefix) if prefix is not None else None,
+                    use_cache=True
+                )
+            temperature = torch.tensor([float(request.temperature) for request in group])
+            top_p = torch.tensor([float(request.top_p) for request in group])
+            token = sample_tokens(outputs.logits[:, -1].expand(n, -1), temperature, top_p,
+                                  [request.generator for request in group])
+        except Exception as e:
+            logger.error(f"Batch prefill failed: {e}")
+            for request in group:
+                if request.streamer is not None:
+                    request.streamer.end()
+                request.finished_at = time.perf_counter()
+                request.future.set_exception(e)
+            return
+
+        # プリフィルの KV を n 行で共有する
+        layers = cache_layers(outputs.past_key_values)
+        if n > 1:
+            layers = expand_rows(layers, n)
+        mask = torch.ones(n, len(input_ids), dtype=torch.long)
+
+        if not self.active:
+            self.layers, self.attention_mask = layers, mask
+            self.next_tokens, self.temperatures, self.top_ps = token, temperature, top_p
+        else:
+            length = max(self.attention_mask.shape[1], mask.shape[1])
+            self.layers = concat_rows(left_pad(self.layers, length), left_pad(layers, length))
+            self.attention_mask = torch.cat([
+                torch.nn.functional.pad(self.attention_mask, (length - self.attention_mask.shape[1], 0)),
+                torch.nn.functional.pad(mask, (length - mask.shape[1], 0)),
+            ])
+            self.next_tokens = torch.cat([self.next_tokens, token])
+            self.temperatures = torch.cat([self.temperatures, temperature])
+            self.top_ps = torch.cat([self.top_ps, top_p])
+        first_row = len(self.active)
+        self.active.extend(group)
+
+        finished = [first_row + i for i, request in enumerate(group) if self._append_token(request, int(token[i]))]
+        if finished:
+            self._remove(finished)
+
+    def _decode_step(self):
+        """バッチ全体で1トークン分の forward を実行する"""
+        attention_mask = torch.cat(
+            [self.attention_mask, torch.ones(len(self.active), 1, dtype=torch.long)], dim=1
+        )
+        position_ids = self.attention_mask.sum(dim=1, keepdim=True)
+
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=self.next_tokens[:, None],
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=make_cache(self.layers),
+                use_cache=True
+            )
+
+        self.layers = cache_layers(outputs.past_key_values)
+        self.attention_mask = attention_mask
+        self.next_tokens = sample_tokens(
+            outputs.logits[:, -1], self.temperatures, self.top_ps,
+            [request.generator for request in self.active]
+        )
+        self.steps += 1
+
+        finished = []
+        for row, (request, token) in enumerate(zip(self.active, self.next_tokens.tolist())):
+            if self._append_token(request, token):
+                finished.append(row)
+            elif request.should_stop():
+                self._expire(request)
+                finished.append(row)
+        if finished:
+            self._remove(finished)
+
+    def _append_token(self, request, token):
+        """生成トークンを記録し、リクエストが終了したら True を返す"""
+        request.output_ids.append(token)
+        if request.first_token_at is None:
+            request.first_token_at = time.perf_counter()
+        if request.streamer is not None:
+            request.streamer.put(torch.tensor([token]))
+
+        if self.eos_token_id is not None and token == self.eos_token_id:
+            request.finish_reason = "stop"
+        elif len(request.output_ids) >= request.max_new_tokens:
+            request.finish_reason = "length"
+        else:
+            return False
+
+        if request.streamer is not None:
+            request.streamer.end()
+        request.finished_at = time.perf_counter()
+        self.wait_stats.record_service(request.finished_at - request.admitted_at)
+        request.future.set_result(request.output_ids)
+        return True
+
+    def _expire(self, request):
+        """期限切れ・キャンセルのリクエストを DeadlineExceeded で終了する"""
+        self.wait_stats.expired += 1
+        if request.streamer is not None:
+            request.streamer.end()
+        request.finished_at = time.perf_counter()
+        request.future.set_exception(DeadlineExceeded())
+
+    def _remove(self, rows):
+        """終了した行をバッチから外し、全行で不要になった左側のパディングを詰める"""
+        if self.prefix_cache is not None:
+            self._cache_finished(rows)
+
+        keep = [row for row in range(len(self.active)) if row not in rows]
+        self.active = [self.active[row] for row in keep]
+        if not keep:
+            self.layers = self.attention_mask = self.next_tokens = None
+            self.temperatures = self.top_ps = None
+            return
+
+        index = torch.tensor(keep)
+        attention_mask = self.attention_mask[index]
+        start = attention_mask.shape[1] - int(attention_mask.sum(dim=1).max())
+        self.layers = select_rows(self.layers, index, start)
+        self.attention_mask = attention_mask[:, start:]
+        self.next_tokens = self.next_tokens[index]
+        self.temperatures = self.temperatures[index]
+        self.top_ps = self.top_ps[index]
+
+    def _cache_finished(self, rows):
+        """終了した行の KV（プロンプト + 最後以外の生成トークン）をプレフィックスキャッシュに登録する"""
+        length = self.attention_mask.shape[1]
+        for row in rows:
+            request = self.active[row]
+            token_ids = request.input_ids + request.output_ids[:-1]
+            layers = select_rows(self.layers, torch.tensor([row]), length - len(token_ids))
+            self.prefix_cache.insert(token_ids, layers)
+
+    def _fail_all(self, error):
+        for request in self.active:
+            if request.streamer is not None:
+                request.streamer.end()
+            request.future.set_exception(error)
+        self.active = []
+        self.layers = self.attention_mask = self.next_tokens = None
+        self.temperatures = self.top_ps = None
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+推論バックエンド（backends.py）のベンチマーク
+
+ローカルで生成した小さなチェックポイント（既定は配布モデルと同じ bfloat16）を api_server.py の eager と同じく
+float32 で読み込み、各バックエンドで変換して以下を比較します。
+計測はバックエンド毎に別プロセスで行います（RSS を分けるため）。
+
+- 重みのメモリ（パラメーター・バッファ・量子化済み重み）と、読み込み前からの匿名メモリ・RSS・ピーク RSS の増分
+  （生成後）。チェックポイントの dtype のまま使う重みは safetensors の mmap（ページキャッシュ）に残るため、
+  プロセス固有のメモリは匿名メモリで比べる
+- greedy 生成の tokens/sec（バッチサイズ 1、プロンプト毎に --max-tokens トークン）
+- float32（torch バックエンド）との差: 次トークン分布の KL ダイバージェンス、top-1 一致率、
+  greedy 生成が最初に食い違うまでのトークン数
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from backends import model_bytes, prepare_model
+from tiny_model import random_prompts, save_tiny_checkpoint
+
+
+def memory_mb():
+    """このプロセスの VmRSS・VmHWM（ピーク RSS）・RssAnon（MB）"""
+    values = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM', 'RssAnon'):
+                values[key] = int(value.split()[0]) / 1024
+    return values
+
+
+def measure(backend, model_path, prompts, max_tokens):
+    """このプロセスで backend のモデルを読み込んで計測する"""
+    from transformers import AutoModelForCausalLM
+
+    before = memory_mb()
+    model = prepare_model(backend, AutoModelForCausalLM.from_pretrained(model_path, dtype=torch.float32))
+
+    with torch.no_grad():
+        logits = torch.stack([model(torch.tensor([prompt])).logits[0, -1].float() for prompt in prompts])
+        model.generate(torch.tensor([prompts[0]]), max_new_tokens=2, do_sample=False)  # ウォームアップ
+        outputs = []
+        start = time.perf_counter()
+        for prompt in prompts:
+            sequence = model.generate(torch.tensor([prompt]), max_new_tokens=max_tokens, min_new_tokens=max_tokens,
+                                      do_sample=False, pad_token_id=0)
+            outputs.append(sequence[0, len(prompt):].tolist())
+        elapsed = time.perf_counter() - start
+    memory = memory_mb()
+
+    return {
+        "backend": backend,
+        "weights_mb": model_bytes(model) / 1024 ** 2,
+        "anon_mb": memory["RssAnon"] - before["RssAnon"],
+        "rss_mb": memory["VmRSS"] - before["VmRSS"],
+        "peak_rss_mb": memory["VmHWM"] - before["VmRSS"],
+        "tokens_per_sec": len(prompts) * max_tokens / elapsed,
+        "logits": logits,
+        "outputs": outputs,
+    }
+
+
+def divergence(reference, result):
+    """reference（float32）との次トークン分布の差と greedy 生成の一致"""
+    log_p = torch.log_softmax(reference["logits"], dim=-1)
+    log_q = torch.log_softmax(result["logits"], dim=-1)
+    kl = (log_p.exp() * (log_p - log_q)).sum(dim=-1)
+    top1 = (reference["logits"].argmax(dim=-1) == result["logits"].argmax(dim=-1)).float()
+    matched = []
+    for expected, actual in zip(reference["outputs"], result["outputs"]):
+        length = 0
+        while length < len(expected) and expected[length] == actual[length]:
+            length += 1
+        matched.append(length)
+    return {
+        "kl_mean": kl.mean().item(),
+        "top1_agreement": top1.mean().item(),
+        "greedy_match_tokens": sum(matched) / len(matched),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推論バックエンドのベンチマーク")
+    parser.add_argument('--backends', default='torch,int8')
+    parser.add_argument('--model-path', help="使用するチェックポイント（省略時は小さなモデルを生成）")
+    parser.add_argument('--dtype', default='bfloat16', choices=['float32', 'bfloat16', 'float16'],
+                        help="生成するチェックポイントの dtype")
+    parser.add_argument('--hidden-size', type=int, default=768)
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--vocab-size', type=int, default=32000)
+    parser.add_argument('--prompts', type=int, default=8)
+    parser.add_argument('--max-tokens', type=int, default=32)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    prompts = random_prompts(args.prompts, vocab_size=args.vocab_size)
+    if args.measure:
+        torch.save(measure(args.measure, args.model_path, prompts, args.max_tokens), args.output)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model_path
+        if model_path is None:
+            model_path = os.path.join(tmp, 'model')
+            save_tiny_checkpoint(model_path, hidden_size=args.hidden_size, num_layers=args.layers,
+                                 num_heads=args.hidden_size // 64, vocab_size=args.vocab_size,
+                                 dtype=getattr(torch, args.dtype))
+
+        results = []
+        for backend in args.backends.split(','):
+            output = os.path.join(tmp, f'{backend}.pt')
+            subprocess.run([
+                sys.executable, __file__, '--measure', backend, '--output', output, '--model-path', model_path,
+                '--prompts', str(args.prompts), '--max-tokens', str(args.max_tokens),
+                '--vocab-size', str(args.vocab_size),
+            ], check=True, stderr=subprocess.DEVNULL)
+            results.append(torch.load(output))
+
+    reference = results[0]
+    model_name = model_path if args.model_path else f"hidden {args.hidden_size} × {args.layers}層 {args.dtype}"
+    print(f"=== 推論バックエンド（{model_name}、"
+          f"{args.prompts}プロンプト × {args.max_tokens}トークン、基準: {reference['backend']}） ===")
+    print(f"{'backend':<8} {'weights':>9} {'anon +':>9} {'RSS +':>9} {'peak +':>9} {'tok/s':>8} {'KL':>9} "
+          f"{'top-1':>7} {'greedy match':>13}")
+    report = []
+    for result in results:
+        summary = {key: value for key, value in result.items() if key not in ('logits', 'outputs')}
+        summary.update(divergence(reference, result))
+        report.append(summary)
+        print(f"{summary['backend']:<8} {summary['weights_mb']:>7.1f}MB {summary['anon_mb']:>7.1f}MB "
+              f"{summary['rss_mb']:>7.1f}MB {summary['peak_rss_mb']:>7.1f}MB "
+              f"{summary['tokens_per_sec']:>8.1f} {summary['kl_mean']:>9.2e} {summary['top1_agreement']:>6.0%} "
+              f"{summary['greedy_match_tokens']:>7.1f}/{args.max_tokens}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+オフラインのバッチ推論（batch_infer.py）と HTTP 経由の比較
+
+COMPLEX_QUESTIONS（test_japanese_complex.py）を --lines 行の JSONL にし、ローカルで生成した小さな
+チェックポイントで同じファイルを以下の方法で処理して、スループット（行/秒・生成 tokens/秒）を比べます。
+モデルの読み込み時間は含めません。
+
+- http sequential: api_server.py に1件ずつ送る（send_request と同じ、現在のやり方）
+- http concurrent: 連続バッチング（JAN_NANO_MAX_BATCH=--batch-size）の api_server.py に --batch-size 件ずつ同時に送る
+- batch_infer: batch_infer.py（同じ --batch-size の連続バッチング、長さ順の投入）
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import torch
+
+from batch_infer import load_model, run
+from batching import ContinuousBatchScheduler
+from bench_serving import HERE, free_port
+from test_japanese_complex import COMPLEX_QUESTIONS, build_payload
+from tiny_model import save_tiny_checkpoint
+
+
+def write_requests(path, lines, max_tokens):
+    with open(path, 'w') as f:
+        for i in range(lines):
+            payload = build_payload(COMPLEX_QUESTIONS[i % len(COMPLEX_QUESTIONS)])
+            payload.update(max_tokens=max_tokens, seed=i)
+            f.write(json.dumps(payload, ensure_ascii=False) + '\n')
+
+
+def start_api_server(model_path, max_batch, timeout=120):
+    port = free_port()
+    env = dict(os.environ, JAN_NANO_MODEL_PATH=model_path, JAN_NANO_PORT=str(port), JAN_NANO_WARMUP_TOKENS='0',
+               JAN_NANO_MAX_BATCH=str(max_batch), JAN_NANO_MAX_QUEUE='1024', JAN_NANO_REQUEST_TIMEOUT='0')
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'api_server.py')], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("api_server.py が終了しました")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return proc, port
+        except OSError:
+            pass
+        time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"{timeout}秒以内に ready になりませんでした")
+
+
+def post_lines(port, bodies, concurrency):
+    """bodies を concurrency 本の keep-alive 接続で送り、(秒, 生成トークン数, エラー数) を返す"""
+    lock = threading.Lock()
+    remaining = list(reversed(bodies))
+    totals = {"tokens": 0, "errors": 0}
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        try:
+            while True:
+                with lock:
+                    if not remaining:
+                        return
+                    body = remaining.pop()
+                conn.request('POST', '/v1/chat/completions', body=body, headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                data = response.read()
+                with lock:
+                    if response.status == 200:
+                        totals["tokens"] += json.loads(data)["usage"]["completion_tokens"]
+                    else:
+                        totals["errors"] += 1
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, totals["tokens"], totals["errors"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="オフラインのバッチ推論と HTTP 経由の比較")
+    parser.add_argument('--lines', type=int, default=64)
+    parser.add_argument('--max-tokens', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--hidden-size', type=int, default=256)
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = save_tiny_checkpoint(os.path.join(tmp, 'model'), hidden_size=args.hidden_size,
+                                          num_layers=args.layers)
+        input_path = os.path.join(tmp, 'requests.jsonl')
+        write_requests(input_path, args.lines, args.max_tokens)
+        with open(input_path, 'rb') as f:
+            bodies = [line.rstrip(b'\n') for line in f]
+
+        for name, max_batch, concurrency in (("http sequential", 1, 1),
+                                             ("http concurrent", args.batch_size, args.batch_size)):
+            proc, port = start_api_server(model_path, max_batch)
+            try:
+                post_lines(port, bodies[:2], 1)  # ウォームアップ
+                seconds, tokens, errors = post_lines(port, bodies, concurrency)
+            finally:
+                proc.terminate()
+                proc.wait()
+            results.append({"mode": name, "seconds": seconds, "tokens": tokens, "errors": errors})
+
+        torch.set_grad_enabled(False)
+        tokenizer, model = load_model(model_path)
+        scheduler = ContinuousBatchScheduler(model, eos_token_id=tokenizer.eos_token_id,
+                                             max_batch_size=args.batch_size).start()
+        try:
+            stats = run(scheduler, tokenizer, input_path, os.path.join(tmp, 'results.jsonl'))
+        finally:
+            scheduler.stop()
+        results.append({"mode": "batch_infer", "seconds": stats["seconds"], "tokens": stats["tokens"],
+                        "errors": stats["errors"]})
+
+    print(f"=== オフラインのバッチ推論と HTTP（{args.lines}行 × 最大 {args.max_tokens}トークン、"
+          f"バッチ {args.batch_size}、hidden {args.hidden_size} × {args.layers}層） ===")
+    print(f"{'mode':<16} {'秒':>7} {'行/秒':>8} {'tokens/s':>9} {'errors':>7} {'speedup':>8}")
+    baseline = results[0]["seconds"]
+    for result in results:
+        result.update(lines_per_sec=args.lines / result["seconds"], tokens_per_sec=result["tokens"] / result["seconds"],
+                      speedup=baseline / result["seconds"])
+        print(f"{result['mode']:<16} {result['seconds']:>7.1f} {result['lines_per_sec']:>8.2f} "
+              f"{result['tokens_per_sec']:>9.1f} {result['errors']:>7} {result['speedup']:>7.2f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+連続バッチング ベンチマーク
+小さなランダム初期化モデルで、従来の1リクエストずつの model.generate と
+ContinuousBatchScheduler の合計トークン/秒を比較します
+"""
+
+import argparse
+import json
+import time
+
+import torch
+
+from batching import ContinuousBatchScheduler
+from tiny_model import build_tiny_model, random_prompts
+
+
+def run_sequential(model, prompts, max_new_tokens, temperature, top_p):
+    """現在の api_server.py と同じく、リクエスト毎に model.generate を呼ぶ"""
+    start = time.perf_counter()
+    tokens = 0
+    latencies = []
+    for prompt in prompts:
+        with torch.no_grad():
+            outputs = model.generate(
+                torch.tensor([prompt]),
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=True,
+                eos_token_id=None,
+                pad_token_id=0
+            )
+        tokens += outputs.shape[1] - len(prompt)
+        # 全リクエストが同時に届いた想定なので、待ち時間も含めて開始からの時間を記録
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - start
+    return tokens, elapsed, latencies
+
+
+def run_batched(model, prompts, max_new_tokens, temperature, top_p, max_batch_size):
+    scheduler = ContinuousBatchScheduler(model, eos_token_id=None, max_batch_size=max_batch_size).start()
+    try:
+        start = time.perf_counter()
+        requests = [
+            scheduler.submit(prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+            for prompt in prompts
+        ]
+        latencies = []
+        tokens = 0
+        for request in requests:
+            tokens += len(request.result())
+        for request in requests:
+            latencies.append(request.finished_at - start)
+        elapsed = time.perf_counter() - start
+    finally:
+        scheduler.stop()
+    return tokens, elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="連続バッチング ベンチマーク")
+    parser.add_argument('--requests', type=int, default=16, help="同時に届くリクエスト数")
+    parser.add_argument('--max-tokens', type=int, default=64)
+    parser.add_argument('--batch-sizes', default='4,8,16')
+    parser.add_argument('--temperature', type=float, default=0.7)
+    parser.add_argument('--top-p', type=float, default=0.9)
+    parser.add_argument('--hidden-size', type=int, default=128)
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    model = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    prompts = random_prompts(args.requests)
+
+    print("=== 連続バッチング ベンチマーク ===")
+    print(f"リクエスト数: {args.requests}  max_tokens: {args.max_tokens}  "
+          f"モデル: hidden={args.hidden_size} layers={args.layers}  torch threads: {torch.get_num_threads()}")
+    print(f"{'mode':<16} {'tokens':>7} {'秒':>8} {'tokens/s':>10} {'平均待ち(s)':>12} {'speedup':>8}")
+
+    results = []
+    tokens, elapsed, latencies = run_sequential(model, prompts, args.max_tokens, args.temperature, args.top_p)
+    baseline = tokens / elapsed
+    results.append({"mode": "sequential", "tokens": tokens, "seconds": elapsed,
+                    "tokens_per_sec": baseline, "mean_latency": sum(latencies) / len(latencies)})
+
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        tokens, elapsed, latencies = run_batched(
+            model, prompts, args.max_tokens, args.temperature, args.top_p, batch_size
+        )
+        results.append({"mode": f"batched(max={batch_size})", "tokens": tokens, "seconds": elapsed,
+                        "tokens_per_sec": tokens / elapsed, "mean_latency": sum(latencies) / len(latencies)})
+
+    for r in results:
+        print(f"{r['mode']:<16} {r['tokens']:>7} {r['seconds']:>8.2f} {r['tokens_per_sec']:>10.1f} "
+              f"{r['mean_latency']:>12.2f} {r['tokens_per_sec'] / baseline:>7.2f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
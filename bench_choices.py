@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+複数候補（n > 1）のベンチマーク
+
+同じプロンプトから n 件の候補を得るのにかかる時間を、n 件の別々のリクエストと比べます。
+小さなランダム初期化モデルで、api_server.py の2つの生成経路をそれぞれ計測します。
+
+- generate: 連続バッチングなし。別々のリクエストは1件ずつ model.generate を呼び、
+  n 件のリクエストは shared_prefill() で1回だけプリフィルした KV を n 行で共有して1回の model.generate で生成する
+- scheduler: 連続バッチングあり。別々のリクエストは n 回 submit()（n 回プリフィル）、
+  n 件のリクエストは submit_group()（プリフィル1回）
+
+プリフィルの割合が大きい長いプロンプト（既定 512 トークン）・短い生成を想定しています。
+"""
+
+import argparse
+import json
+import time
+
+import torch
+
+from batching import ContinuousBatchScheduler
+from kv_cache import shared_prefill
+from tiny_model import build_tiny_model, random_prompts
+
+
+def generate_separate(model, prompt, n, max_tokens):
+    for _ in range(n):
+        model.generate(prompt, max_new_tokens=max_tokens, min_new_tokens=max_tokens, do_sample=True,
+                       temperature=0.7, top_p=0.9, pad_token_id=0)
+
+
+def generate_shared(model, prompt, n, max_tokens):
+    model.generate(prompt.repeat(n, 1), past_key_values=shared_prefill(model, prompt, n),
+                   max_new_tokens=max_tokens, min_new_tokens=max_tokens, do_sample=True,
+                   temperature=0.7, top_p=0.9, pad_token_id=0)
+
+
+def scheduler_separate(scheduler, prompt, n, max_tokens):
+    requests = [scheduler.submit(prompt[0].tolist(), max_new_tokens=max_tokens) for _ in range(n)]
+    for request in requests:
+        request.result()
+
+
+def scheduler_shared(scheduler, prompt, n, max_tokens):
+    for request in scheduler.submit_group(prompt[0].tolist(), n, max_new_tokens=max_tokens):
+        request.result()
+
+
+def timed(run, repeats):
+    """repeats 回の中央値（秒）"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数候補（n > 1）のベンチマーク")
+    parser.add_argument('--n', default='1,2,4,8', help="候補数（カンマ区切り）")
+    parser.add_argument('--prompt-tokens', type=int, default=512)
+    parser.add_argument('--max-tokens', type=int, default=16)
+    parser.add_argument('--hidden-size', type=int, default=256)
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    model = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    prompt = torch.tensor(random_prompts(1, args.prompt_tokens, args.prompt_tokens)[:1])
+    # eos_token_id=None: 全ての候補が max_tokens まで生成する
+    scheduler = ContinuousBatchScheduler(model, eos_token_id=None, max_batch_size=max(map(int, args.n.split(','))))
+    scheduler.start()
+    paths = {
+        "generate": (lambda n: generate_separate(model, prompt, n, args.max_tokens),
+                     lambda n: generate_shared(model, prompt, n, args.max_tokens)),
+        "scheduler": (lambda n: scheduler_separate(scheduler, prompt, n, args.max_tokens),
+                      lambda n: scheduler_shared(scheduler, prompt, n, args.max_tokens)),
+    }
+
+    print(f"=== 複数候補（プロンプト {args.prompt_tokens}トークン、候補毎に {args.max_tokens}トークン、"
+          f"hidden {args.hidden_size} × {args.layers}層、{args.repeats}回の中央値） ===")
+    print(f"{'path':<10} {'n':>3} {'n requests':>11} {'n choices':>10} {'speedup':>8}")
+    results = []
+    try:
+        for path, (separate, shared) in paths.items():
+            shared(2)  # ウォームアップ
+            for n in (int(n) for n in args.n.split(',')):
+                separate_seconds = timed(lambda: separate(n), args.repeats)
+                shared_seconds = timed(lambda: shared(n), args.repeats)
+                result = {"path": path, "n": n, "separate_seconds": separate_seconds,
+                          "shared_seconds": shared_seconds, "speedup": separate_seconds / shared_seconds}
+                results.append(result)
+                print(f"{path:<10} {n:>3} {separate_seconds * 1000:>9.0f}ms {shared_seconds * 1000:>8.0f}ms "
+                      f"{result['speedup']:>7.2f}x")
+    finally:
+        scheduler.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+クライアントサイド ロードバランサーのベンチマーク
+
+proven_api.py を3ノード起動してローカルの擬似クラスターを作り、障害を注入します。
+- node1: 正常
+- node2: --slow-rate の割合のリクエストが --slow-delay 秒遅い
+- node3: --fail-rate の割合のリクエストが 503 で失敗し、計測の途中でプロセスごと停止する
+
+振り分け方式毎にクラスターを起動し直し、同時実行数 --concurrency のクローズドループで
+p50 / p99 / エラー率を比較します。"naive" は従来のスクリプトと同じく
+ヘルスチェック・再送なしの順番振り分けです。
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from bench_serving import free_port, percentile, start_server
+from cluster_client import ClusterClient, NodeUnavailable
+
+PAYLOAD = {
+    "model": "jan-nano-4b-q8",
+    "messages": [{"role": "user", "content": "こんにちは"}],
+    "max_tokens": 50
+}
+
+
+def policies(hedge_after):
+    """(名前, ClusterClient の引数)"""
+    return [
+        ("naive", dict(policy="round_robin", health_interval=None, max_attempts=1)),
+        ("round_robin", dict(policy="round_robin")),
+        ("least_outstanding", dict(policy="least_outstanding")),
+        ("p2c", dict(policy="p2c")),
+        ("p2c+hedge", dict(policy="p2c", hedge_after=hedge_after)),
+    ]
+
+
+def start_cluster(args):
+    profiles = [
+        [],
+        ['--slow-rate', str(args.slow_rate), '--slow-delay', str(args.slow_delay)],
+        ['--fail-rate', str(args.fail_rate)],
+    ]
+    procs, endpoints = [], []
+    for extra in profiles:
+        port = free_port()
+        procs.append(start_server('thread', port, 16, args.delay, extra))
+        endpoints.append(f"http://127.0.0.1:{port}")
+    return procs, endpoints
+
+
+def run(client, concurrency, duration, on_halfway):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                client.chat_completion(PAYLOAD)
+                latencies.append(time.perf_counter() - start)
+            except (NodeUnavailable, OSError, ValueError):
+                # 失敗したリクエストもレイテンシに含める（naive は失敗までの時間がそのまま遅延になる）
+                latencies.append(time.perf_counter() - start)
+                errors.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    timer = threading.Timer(duration / 2, on_halfway)
+    timer.start()
+    for t in threads:
+        t.join()
+    timer.cancel()
+    elapsed = time.perf_counter() - start
+
+    total = len(latencies)
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "error_rate": len(errors) / total if total else 0.0,
+        "rps": total / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クライアントサイド ロードバランサーのベンチマーク")
+    parser.add_argument('--duration', type=float, default=6.0, help="方式毎の計測時間（秒）")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.02, help="各ノードの擬似生成時間（秒）")
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-delay', type=float, default=1.0)
+    parser.add_argument('--fail-rate', type=float, default=0.2)
+    parser.add_argument('--hedge-after', type=float, default=0.1, help="p2c+hedge で別ノードにも送るまでの秒数")
+    parser.add_argument('--no-kill', action='store_true', help="計測途中で node3 を停止しない")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    print("=== クライアントサイド ロードバランサー ===")
+    print(f"node2: {args.slow_rate:.0%} が +{args.slow_delay}s / node3: {args.fail_rate:.0%} が 503"
+          f"{'' if args.no_kill else '、途中で停止'}")
+    print(f"{'policy':<18} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>8} "
+          f"{'hedges':>7} {'failover':>8}")
+
+    results = {}
+    for name, options in policies(args.hedge_after):
+        procs, endpoints = start_cluster(args)
+
+        def kill_node():
+            if not args.no_kill:
+                procs[2].kill()
+
+        try:
+            with ClusterClient(endpoints, health_interval=options.pop("health_interval", 0.5),
+                               timeout=10, **options) as client:
+                result = run(client, args.concurrency, args.duration, kill_node)
+                result.update(hedges=client.hedges, failovers=client.failovers)
+        finally:
+            for proc in procs:
+                proc.kill()
+                proc.wait()
+        results[name] = result
+        print(f"{name:<18} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['max_ms']:>8.1f} {result['error_rate']:>8.1%} {result['hedges']:>7} {result['failovers']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
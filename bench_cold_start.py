@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+コールドスタート ベンチマーク
+ローカルで生成した小さなチェックポイントで api_server.py を起動し、
+読み込み方法（eager / mmap）とウォームアップの有無ごとに以下を計測します
+
+- ポートが開くまでの時間と /health が ready になるまでの時間
+- ready 後の最初のリクエストのレイテンシ
+- 読み込み中のピーク RSS（VmHWM）と ready 時点の匿名メモリ（RssAnon）
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from bench_serving import free_port
+from tiny_model import save_tiny_checkpoint
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (名前, JAN_NANO_LOAD_MODE, JAN_NANO_WARMUP_TOKENS)。eager + ウォームアップなしが従来の起動
+CONFIGS = [
+    ("eager", "eager", 0),
+    ("eager+warmup", "eager", 8),
+    ("mmap+warmup", "mmap", 8),
+]
+
+CHAT_PAYLOAD = json.dumps({
+    "messages": [{"role": "user", "content": "こんにちは"}],
+    "max_tokens": 8,
+    "temperature": 0
+}).encode('utf-8')
+
+
+def memory_kb(pid):
+    """/proc/<pid>/status の VmHWM（ピーク RSS）と RssAnon（KB）"""
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmHWM', 'RssAnon'):
+                values[key] = int(value.split()[0])
+    return values
+
+
+def get_health(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request('GET', '/health')
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def measure(model_path, load_mode, warmup_tokens, timeout):
+    port = free_port()
+    env = dict(os.environ, JAN_NANO_MODEL_PATH=model_path, JAN_NANO_LOAD_MODE=load_mode,
+               JAN_NANO_WARMUP_TOKENS=str(warmup_tokens), JAN_NANO_PORT=str(port))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'api_server.py')], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listening = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"api_server.py が終了しました（{load_mode}）")
+            try:
+                status = get_health(port)
+            except OSError:
+                time.sleep(0.05)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - start
+            if status == 200:
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError(f"{timeout}秒以内に ready になりませんでした（{load_mode}）")
+        ready = time.perf_counter() - start
+        memory = memory_kb(proc.pid)
+
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        request_start = time.perf_counter()
+        conn.request('POST', '/v1/chat/completions', body=CHAT_PAYLOAD,
+                     headers={'Content-Type': 'application/json'})
+        conn.getresponse().read()
+        first_request = time.perf_counter() - request_start
+        conn.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        "listen_s": listening,
+        "ready_s": ready,
+        "first_request_ms": first_request * 1000,
+        "peak_rss_mb": memory["VmHWM"] / 1024,
+        "anon_rss_mb": memory["RssAnon"] / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コールドスタート ベンチマーク")
+    parser.add_argument('--hidden-size', type=int, default=768)
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--vocab-size', type=int, default=32000)
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'bfloat16', 'float16'],
+                        help="チェックポイントの dtype（eager は CPU では float32 に変換して読み込む）")
+    parser.add_argument('--runs', type=int, default=3, help="各設定の起動回数（中央値を表示）")
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as model_path:
+        save_tiny_checkpoint(model_path, hidden_size=args.hidden_size, num_layers=args.layers,
+                             num_heads=args.hidden_size // 64, vocab_size=args.vocab_size,
+                             dtype=getattr(torch, args.dtype))
+        size_mb = os.path.getsize(os.path.join(model_path, 'model.safetensors')) / 1024 / 1024
+
+        print("=== コールドスタート ベンチマーク ===")
+        print(f"チェックポイント: {size_mb:.0f} MB ({args.dtype})  起動回数: {args.runs}")
+        print(f"{'config':<14} {'listen(s)':>10} {'ready(s)':>10} {'1st req(ms)':>12} "
+              f"{'peak RSS(MB)':>13} {'anon(MB)':>10}")
+
+        results = []
+        for name, load_mode, warmup_tokens in CONFIGS:
+            runs = [measure(model_path, load_mode, warmup_tokens, args.timeout) for _ in range(args.runs)]
+            result = {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in runs[0]}
+            result.update({"config": name, "checkpoint_mb": size_mb, "dtype": args.dtype})
+            results.append(result)
+            print(f"{name:<14} {result['listen_s']:>10.2f} {result['ready_s']:>10.2f} "
+                  f"{result['first_request_ms']:>12.1f} {result['peak_rss_mb']:>13.0f} {result['anon_rss_mb']:>10.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
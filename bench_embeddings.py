@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+/v1/embeddings のマイクロバッチング（embeddings.py）のベンチマーク
+
+小さなランダム初期化モデルで、--clients 個のクライアントスレッドがそれぞれ1件ずつ入力を送り続け、
+バッチを待つ時間（window）毎に以下を計測します。
+「no batching」は max_batch_size=1（入力毎に forward）です。
+
+- スループット（inputs/sec）と1件あたりのレイテンシ（p50 / p99）
+- forward 1回あたりの入力数とパディングの割合
+
+あわせて、バッチで計算した埋め込みが1件ずつ計算した場合と一致すること（最大誤差）と、
+応答1件あたりの埋め込みのサイズ（float の JSON と base64）を表示します。
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+import torch
+
+from bench_serving import percentile
+from embeddings import EmbeddingBatcher, embed, encode_embedding
+from fastjson import dumps
+from tiny_model import TINY_VOCAB_SIZE, build_tiny_model
+
+
+def random_inputs(count, min_length, max_length, seed=0):
+    rng = random.Random(seed)
+    return [[rng.randrange(TINY_VOCAB_SIZE) for _ in range(rng.randint(min_length, max_length))]
+            for _ in range(count)]
+
+
+def run(model, inputs, clients, window, max_batch_size, max_batch_tokens):
+    batcher = EmbeddingBatcher(model, window=window, max_batch_size=max_batch_size,
+                               max_batch_tokens=max_batch_tokens).start()
+    latencies = []
+    lock = threading.Lock()
+    next_input = [0]
+
+    def client():
+        while True:
+            with lock:
+                if next_input[0] == len(inputs):
+                    return
+                token_ids = inputs[next_input[0]]
+                next_input[0] += 1
+            start = time.perf_counter()
+            batcher.submit([token_ids])[0].future.result()
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+
+    try:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        stats = batcher.stats()
+    finally:
+        batcher.stop()
+    return {
+        "inputs_per_sec": len(inputs) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_batch_size": stats["mean_batch_size"],
+        "padding_ratio": stats["padding_ratio"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/v1/embeddings のマイクロバッチングのベンチマーク")
+    parser.add_argument('--windows-ms', default='0,2,5,10,20', help="バッチを待つ時間（ミリ秒、カンマ区切り）")
+    parser.add_argument('--clients', type=int, default=32, help="同時に送るクライアント数")
+    parser.add_argument('--inputs', type=int, default=512, help="設定毎に送る入力数")
+    parser.add_argument('--min-tokens', type=int, default=8)
+    parser.add_argument('--max-tokens', type=int, default=256)
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--max-batch-tokens', type=int, default=16384)
+    parser.add_argument('--hidden-size', type=int, default=256)
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--payload-dim', type=int, default=2560, help="応答サイズの比較に使う次元（jan-nano-4b の hidden_size）")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    model = build_tiny_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    inputs = random_inputs(args.inputs, args.min_tokens, args.max_tokens)
+
+    # 右詰めのパディングで埋め込みが変わらないこと
+    sample = inputs[:16]
+    single = torch.cat([embed(model, [token_ids]) for token_ids in sample])
+    max_error = (embed(model, sample) - single).abs().max().item()
+
+    configs = [("no batching", 0.0, 1)] + [
+        (f"window {window}ms", float(window) / 1000, args.max_batch) for window in args.windows_ms.split(',')
+    ]
+    run(model, inputs[:64], args.clients, 0.0, args.max_batch, args.max_batch_tokens)  # ウォームアップ
+
+    print(f"=== /v1/embeddings マイクロバッチング（{args.clients}クライアント、{args.inputs}入力、"
+          f"{args.min_tokens}〜{args.max_tokens}トークン、hidden {args.hidden_size} × {args.layers}層） ===")
+    print(f"{'config':<14} {'inputs/s':>9} {'speedup':>8} {'p50':>9} {'p99':>9} {'batch':>6} {'padding':>8}")
+    results = []
+    baseline = None
+    for name, window, max_batch_size in configs:
+        result = run(model, inputs, args.clients, window, max_batch_size, args.max_batch_tokens)
+        baseline = baseline or result["inputs_per_sec"]
+        result.update(config=name, speedup=result["inputs_per_sec"] / baseline)
+        results.append(result)
+        print(f"{name:<14} {result['inputs_per_sec']:>9.1f} {result['speedup']:>7.2f}x {result['p50_ms']:>7.1f}ms "
+              f"{result['p99_ms']:>7.1f}ms {result['mean_batch_size']:>6.1f} {result['padding_ratio']:>8.1%}")
+
+    vector = torch.nn.functional.normalize(torch.randn(args.payload_dim), dim=0)
+    payload = {encoding: len(dumps(encode_embedding(vector, encoding))) for encoding in ("float", "base64")}
+    print(f"\nバッチと1件ずつの埋め込みの最大誤差: {max_error:.2e}")
+    print(f"埋め込み1件のサイズ（{args.payload_dim}次元）: float {payload['float']:,} bytes / "
+          f"base64 {payload['base64']:,} bytes（{payload['base64'] / payload['float']:.0%}）")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"results": results, "max_error": max_error, "payload_bytes": payload}, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+JSON エンコードと事前エンコードした応答のベンチマーク
+
+1. マイクロベンチマーク: /health・/v1/models・チャット応答の1回あたりのエンコード時間
+   （json.dumps(..., ensure_ascii=False).encode() / fastjson.dumps / 事前エンコード・テンプレート）
+2. proven_api.py の requests/sec: 変更前のリビジョン（git archive で取り出す）と現在のツリーを
+   交互に起動し、/health と /v1/chat/completions を計測する（ラウンドの中央値で比較）
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import timeit
+
+import fastjson
+from bench_serving import HERE, baseline_ref, export_tree, free_port, run_load, start_server
+from fastjson import Slot, Template
+
+HEALTH = {"status": "healthy"}
+MODELS = {"object": "list", "data": [{"id": "jan-nano-4b-q8", "object": "model", "created": 1700000000,
+                                      "owned_by": "jan-hq"}]}
+COMPLETION_TEMPLATE = Template({
+    "id": Slot("id"), "object": "chat.completion", "created": Slot("created"), "model": Slot("model"),
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": Slot("content")}, "finish_reason": "stop"}],
+    "usage": Slot("usage"),
+})
+COMPLETION_VALUES = {
+    "id": "chatcmpl-1700000000", "created": 1700000000, "model": "jan-nano-4b-q8",
+    "content": "こんにちは！こんにちはについてお答えします。Jan Nano 4B Q8モデルが応答しています。",
+    "usage": {"prompt_tokens": 12, "completion_tokens": 30, "total_tokens": 42},
+}
+
+
+def completion_dict():
+    values = COMPLETION_VALUES
+    return {
+        "id": values["id"], "object": "chat.completion", "created": values["created"], "model": values["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": values["content"]},
+                     "finish_reason": "stop"}],
+        "usage": values["usage"],
+    }
+
+
+def per_call_us(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def micro(number):
+    stdlib = lambda obj: json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    health_body = fastjson.dumps(HEALTH)
+    models_body = fastjson.dumps(MODELS)
+    cases = [
+        ("/health", lambda: stdlib(HEALTH), lambda: fastjson.dumps(HEALTH), lambda: health_body),
+        ("/v1/models", lambda: stdlib(MODELS), lambda: fastjson.dumps(MODELS), lambda: models_body),
+        ("chat completion", lambda: stdlib(completion_dict()), lambda: fastjson.dumps(completion_dict()),
+         lambda: COMPLETION_TEMPLATE.render(**COMPLETION_VALUES)),
+    ]
+    results = {}
+    print(f"{'payload':<16} {'json.dumps':>11} {f'dumps({fastjson.BACKEND})':>15} {'pre-encoded':>12}")
+    for name, before, after, cached in cases:
+        results[name] = {key: per_call_us(fn, number) for key, fn in
+                         (("json", before), ("fastjson", after), ("preencoded", cached))}
+        r = results[name]
+        print(f"{name:<16} {r['json']:>9.2f}µs {r['fastjson']:>13.2f}µs {r['preencoded']:>10.2f}µs")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON エンコードと事前エンコードした応答のベンチマーク")
+    parser.add_argument('--number', type=int, default=20000, help="マイクロベンチマークの1計測あたりの回数")
+    parser.add_argument('--baseline-ref', help="変更前のリビジョン（既定は fastjson.py を追加する前）")
+    parser.add_argument('--modes', default='thread,asyncio')
+    parser.add_argument('--paths', default='/health,/v1/chat/completions')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=3.0, help="各計測の時間（秒）")
+    parser.add_argument('--rounds', type=int, default=3, help="変更前後を交互に計測する回数")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    print("=== JSON エンコード（1回あたり） ===")
+    results = {"micro": micro(args.number), "serving": []}
+
+    ref = args.baseline_ref or baseline_ref('fastjson.py')
+    print(f"\n=== proven_api.py requests/sec（変更前: {ref}、{args.rounds}ラウンドの中央値） ===")
+    print(f"{'mode':<8} {'path':<22} {'before':>10} {'after':>10} {'change':>8}")
+    with tempfile.TemporaryDirectory() as baseline_root:
+        export_tree(ref, baseline_root)
+        for mode in args.modes.split(','):
+            for path in args.paths.split(','):
+                rps = {"before": [], "after": []}
+                for _ in range(args.rounds):
+                    for name, root in (("before", baseline_root), ("after", HERE)):
+                        port = free_port()
+                        proc = start_server(mode, port, 16, 0.0, root=root)
+                        try:
+                            rps[name].append(run_load(port, path, args.concurrency, args.duration)["rps"])
+                        finally:
+                            proc.terminate()
+                            proc.wait()
+                before = statistics.median(rps["before"])
+                after = statistics.median(rps["after"])
+                results["serving"].append({"mode": mode, "path": path, "before_rps": before, "after_rps": after})
+                print(f"{mode:<8} {path:<22} {before:>10.1f} {after:>10.1f} {(after / before - 1) * 100:>+7.1f}%")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
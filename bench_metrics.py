@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+メトリクス計測のオーバーヘッド ベンチマーク
+
+1. カウンター / ヒストグラムの記録1回あたりの時間（1スレッドと複数スレッド）
+2. 記録時間 × 1リクエストあたりの記録回数 × req/s から見積もった CPU 時間の割合
+3. proven_api.py を --no-metrics あり / なしで交互に起動し、requests/sec を比較
+   （ノイズを減らすため複数ラウンドの中央値で比較します。CPU が少ない環境では 3 の差は
+   計測のばらつきに埋もれるため、2 の見積もりで判断してください）
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+
+from bench_serving import free_port, run_load, start_server
+from metrics import Registry, http_metrics
+
+# proven_api.py の1リクエストあたりの記録回数（カウンター1 + ヒストグラム1）
+OPS_PER_REQUEST = 2
+# api_server.py の生成リクエスト1件あたりの記録回数（カウンター2 + ヒストグラム7）
+OPS_PER_GENERATION = 9
+
+
+def record_cost_ns(threads, iterations):
+    """1スレッドあたり iterations 回ずつ inc + observe を実行し、1回あたりの ns を返す"""
+    registry = Registry()
+    requests_total, request_seconds = http_metrics(registry)
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(iterations):
+            requests_total.inc('POST', '/v1/chat/completions', 200)
+            request_seconds.observe(0.0123, '/v1/chat/completions')
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    total = requests_total.collect()[('POST', '/v1/chat/completions', 200)]
+    assert total == threads * iterations, "カウンターの値が一致しません"
+    # inc と observe の2回分
+    return elapsed / (threads * iterations * 2) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="メトリクス計測のオーバーヘッド ベンチマーク")
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=5, help="A/B の交互計測の回数")
+    parser.add_argument('--duration', type=float, default=3.0, help="各計測の時間（秒）")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mode', default='thread')
+    parser.add_argument('--path', default='/v1/chat/completions')
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    print("=== メトリクス計測のオーバーヘッド ===")
+    micro = {}
+    for threads in (1, 8):
+        micro[threads] = record_cost_ns(threads, args.iterations // threads)
+        print(f"記録1回あたり（{threads}スレッド）: {micro[threads]:.0f} ns")
+    print(f"生成リクエスト1件あたり（{OPS_PER_GENERATION}回）: {micro[1] * OPS_PER_GENERATION / 1000:.1f} µs")
+
+    rps = {"metrics": [], "no-metrics": []}
+    for round_index in range(args.rounds):
+        for name, extra in (("metrics", []), ("no-metrics", ['--no-metrics'])):
+            port = free_port()
+            proc = start_server(args.mode, port, 16, 0.0, extra)
+            try:
+                result = run_load(port, args.path, args.concurrency, args.duration)
+            finally:
+                proc.terminate()
+                proc.wait()
+            rps[name].append(result["rps"])
+            print(f"round {round_index + 1} {name:<11} {result['rps']:>10.1f} req/s  errors: {result['errors']}")
+
+    with_metrics = statistics.median(rps["metrics"])
+    without_metrics = statistics.median(rps["no-metrics"])
+    overhead = (without_metrics - with_metrics) / without_metrics * 100
+    estimated = micro[1] * OPS_PER_REQUEST * without_metrics / 1e9 * 100
+    print(f"\n中央値 req/s: metrics {with_metrics:.1f} / no-metrics {without_metrics:.1f}")
+    print(f"実測の差: {overhead:.2f}%（ラウンド間のばらつき: "
+          f"{(max(rps['no-metrics']) - min(rps['no-metrics'])) / without_metrics * 100:.0f}%）")
+    print(f"見積もり（記録時間 × {OPS_PER_REQUEST}回 × req/s）: CPU 時間の {estimated:.2f}%")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"record_ns": micro, "rps": rps, "overhead_pct": overhead,
+                       "estimated_overhead_pct": estimated}, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
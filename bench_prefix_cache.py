@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+プレフィックスKVキャッシュ ベンチマーク
+共通の長いシステムプロンプトとマルチターン会話（履歴の再送）を想定したワークロードで、
+キャッシュ有無のプリフィル時間・ヒット率・省略できたトークン数を比較します
+"""
+
+import argparse
+import json
+import time
+
+from batching import ContinuousBatchScheduler
+from prefix_cache import PrefixCache
+from tiny_model import build_tiny_model, random_prompts
+
+
+def build_workload(conversations, turns, system_length, seed=0):
+    """(会話番号, ターン番号, ユーザー発話) の列。全会話で同じシステムプロンプトを共有する"""
+    system_prompt = random_prompts(1, system_length, system_length, seed=seed)[0]
+    utterances = random_prompts(conversations * turns, 16, 48, seed=seed + 1)
+    return system_prompt, [
+        (c, t, utterances[c * turns + t]) for t in range(turns) for c in range(conversations)
+    ]
+
+
+def run(model, system_prompt, workload, max_tokens, prefix_cache):
+    """1リクエストずつ投入し、最初のトークンまでの時間（≒プリフィル時間）を計測する"""
+    scheduler = ContinuousBatchScheduler(model, eos_token_id=None, max_batch_size=1,
+                                         prefix_cache=prefix_cache).start()
+    histories = {}
+    ttfts = []
+    try:
+        for conversation, _, utterance in workload:
+            prompt = histories.get(conversation, system_prompt) + utterance
+            start = time.perf_counter()
+            request = scheduler.submit(prompt, max_new_tokens=max_tokens, temperature=0)
+            output = request.result()
+            # 1トークン目はプリフィル直後に生成される
+            ttfts.append(request.first_token_at - start)
+            histories[conversation] = prompt + output
+    finally:
+        scheduler.stop()
+    return ttfts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プレフィックスKVキャッシュ ベンチマーク")
+    parser.add_argument('--conversations', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=4)
+    parser.add_argument('--system-length', type=int, default=400, help="システムプロンプトのトークン数")
+    parser.add_argument('--max-tokens', type=int, default=16)
+    parser.add_argument('--cache-mb', type=int, default=256)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    model = build_tiny_model()
+    system_prompt, workload = build_workload(args.conversations, args.turns, args.system_length)
+
+    print("=== プレフィックスKVキャッシュ ベンチマーク ===")
+    print(f"会話数: {args.conversations}  ターン数: {args.turns}  システムプロンプト: {args.system_length} tokens")
+
+    baseline = run(model, system_prompt, workload, args.max_tokens, None)
+    cache = PrefixCache(args.cache_mb * 1024 * 1024)
+    cached = run(model, system_prompt, workload, args.max_tokens, cache)
+    stats = cache.stats()
+
+    mean_baseline = sum(baseline) / len(baseline) * 1000
+    mean_cached = sum(cached) / len(cached) * 1000
+    print(f"平均TTFT（キャッシュなし）: {mean_baseline:.2f} ms")
+    print(f"平均TTFT（キャッシュあり）: {mean_cached:.2f} ms  ({mean_baseline / mean_cached:.2f}x)")
+    print(f"ヒット率: {stats['hit_rate'] * 100:.1f}%")
+    print(f"省略したプリフィルトークン: {stats['prefill_tokens_saved']}/{stats['prompt_tokens']} "
+          f"({stats['saved_ratio'] * 100:.1f}%)")
+    print(f"キャッシュ使用量: {stats['bytes'] / 1024 / 1024:.1f} MB  evictions: {stats['evictions']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"ttft_ms_baseline": mean_baseline, "ttft_ms_cached": mean_cached, "cache": stats}, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
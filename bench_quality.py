@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+回答の品質スコア（quality.py）のベンチマーク
+
+COMPLEX_QUESTIONS のキーワード・論理的構造の表現・学術的表現と、一般的な語を混ぜた文から
+--responses 件（既定 10万件）の合成の日本語の回答を作り、以下の方法で採点して時間を比べます。
+すべての方法のスコアが、変更前の evaluate_response_quality と一致することを確かめます。
+
+採点のみ（メモリ上）:
+- before: 変更前の evaluate_response_quality（語毎に `in` で走査）を1件ずつ
+- score_batch: QualityScorer.score_batch() を --batch-size 件ずつ（TermMatcher でバッチを1回走査する）
+
+ファイル（JSONL の読み込み・採点・書き出し）:
+- before: 1行ずつ読んで変更前の関数で採点し、書き出す
+- score_file: quality.py の score_file()。--workers のプロセス数毎
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+
+from bench_serving import baseline_ref, export_tree
+from fastjson import dumps, loads
+from quality import ACADEMIC_TERMS, LOGICAL_INDICATORS, QualityScorer, score_file
+from test_japanese_complex import COMPLEX_QUESTIONS
+
+WORDS = ["社会", "文化", "言語", "時間", "意味", "構造", "関係", "変化", "影響", "問題", "歴史", "個人", "集団",
+         "価値", "制度", "経験", "技術", "情報", "日本", "世界", "現代", "伝統", "思想", "自然", "人間"]
+PARTICLES = ["は", "が", "を", "に", "で", "と", "の", "も", "から", "について", "によって"]
+ENDINGS = ["である。", "と考えられる。", "が重要だ。", "を示している。", "ではないだろうか。", "といえる。"]
+
+
+def make_sentences(rng, count):
+    """一般的な語・キーワード・論理的構造の表現・学術的表現を混ぜた文"""
+    keywords = [keyword for question in COMPLEX_QUESTIONS for keyword in question["keywords"]]
+    sentences = []
+    for _ in range(count):
+        parts = []
+        if rng.random() < 0.3:
+            parts.append(rng.choice(LOGICAL_INDICATORS) + "、")
+        for _ in range(rng.randint(2, 5)):
+            roll = rng.random()
+            if roll < 0.15:
+                word = rng.choice(keywords)
+            elif roll < 0.25:
+                word = rng.choice(ACADEMIC_TERMS)
+            else:
+                word = rng.choice(WORDS)
+            parts.append(word + rng.choice(PARTICLES))
+        parts.append(rng.choice(WORDS) + rng.choice(ENDINGS))
+        sentences.append("".join(parts))
+    return sentences
+
+
+def make_corpus(count, seed=0):
+    """(回答, キーワード) のリスト。文字数は4つの配点の区間（〜200・〜500・〜1000・1000超）にまたがる"""
+    rng = random.Random(seed)
+    sentences = make_sentences(rng, 5000)
+    corpus = []
+    for _ in range(count):
+        target = rng.choice([80, 150, 350, 450, 700, 900, 1200, 1600])
+        parts = []
+        length = 0
+        while length < target:
+            sentence = rng.choice(sentences)
+            parts.append(sentence)
+            length += len(sentence)
+        corpus.append(("".join(parts), rng.choice(COMPLEX_QUESTIONS)["keywords"]))
+    return corpus
+
+
+def load_baseline(ref, root):
+    """変更前の test_japanese_complex.py の evaluate_response_quality"""
+    os.makedirs(root)
+    export_tree(ref, root)
+    spec = importlib.util.spec_from_file_location("baseline_japanese_complex",
+                                                  os.path.join(root, "test_japanese_complex.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.evaluate_response_quality
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def baseline_file(evaluate, input_path, output_path):
+    """変更前のやり方: 1行ずつ読み、採点して書き出す"""
+    with open(input_path, 'rb') as source, open(output_path, 'wb') as output:
+        for line_number, line in enumerate(source):
+            record = loads(line)
+            score = evaluate(record["response"], record["keywords"])
+            output.write(dumps({"custom_id": record["custom_id"], "line": line_number, "score": score,
+                                "error": None}) + b'\n')
+
+
+def read_scores(path):
+    with open(path, 'rb') as f:
+        return [loads(line)["score"] for line in f]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回答の品質スコアのベンチマーク")
+    parser.add_argument('--responses', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}", help="score_file のプロセス数（カンマ区切り）")
+    parser.add_argument('--baseline-ref', help="変更前のコミット（既定: quality.py を追加したコミットの親）")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    corpus, seconds = timed(lambda: make_corpus(args.responses))
+    texts = [text for text, _ in corpus]
+    keyword_lists = [keywords for _, keywords in corpus]
+    average = sum(map(len, texts)) / len(texts)
+    print(f"合成コーパス: {len(corpus)} 件、平均 {average:.0f} 文字（作成 {seconds:.1f}秒）")
+
+    ref = args.baseline_ref or baseline_ref('quality.py')
+    results = {"responses": len(corpus), "average_chars": average, "baseline_ref": ref, "scoring": [], "file": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        evaluate = load_baseline(ref, os.path.join(tmp, 'baseline'))
+
+        expected, before = timed(lambda: [evaluate(text, keywords) for text, keywords in corpus])
+        scorer = QualityScorer()
+        batches = range(0, len(corpus), args.batch_size)
+        batched, batch_seconds = timed(lambda: [
+            score for start in batches
+            for score in scorer.score_batch(texts[start:start + args.batch_size],
+                                            keyword_lists[start:start + args.batch_size])])
+        for name, scores, elapsed in (("before", expected, before), ("score_batch", batched, batch_seconds)):
+            results["scoring"].append({"mode": name, "seconds": elapsed, "same_scores": scores == expected})
+
+        input_path = os.path.join(tmp, 'results.jsonl')
+        with open(input_path, 'wb') as f:
+            for i, (text, keywords) in enumerate(corpus):
+                f.write(dumps({"custom_id": f"r{i}", "response": text, "keywords": keywords}) + b'\n')
+        output_path = os.path.join(tmp, 'scores.jsonl')
+        _, elapsed = timed(lambda: baseline_file(evaluate, input_path, output_path))
+        results["file"].append({"mode": "before", "workers": 1, "seconds": elapsed,
+                                "same_scores": read_scores(output_path) == expected})
+        for workers in sorted({int(value) for value in args.workers.split(',')}):
+            stats = score_file(input_path, output_path, workers=workers, batch_size=args.batch_size)
+            results["file"].append({"mode": "score_file", "workers": workers, "seconds": stats["seconds"],
+                                    "same_scores": read_scores(output_path) == expected})
+
+    print(f"\n=== 採点のみ（{len(corpus)} 件、変更前: {ref}） ===")
+    print(f"{'mode':<12} {'seconds':>8} {'µs/resp':>8} {'resp/s':>9} {'speedup':>8} {'same':>5}")
+    for r in results["scoring"]:
+        print(f"{r['mode']:<12} {r['seconds']:>8.2f} {r['seconds'] / len(corpus) * 1e6:>8.1f} "
+              f"{len(corpus) / r['seconds']:>9.0f} {before / r['seconds']:>7.2f}x {str(r['same_scores']):>5}")
+
+    print(f"\n=== ファイル（JSONL の読み込み・採点・書き出し、{os.cpu_count()} CPU） ===")
+    print(f"{'mode':<12} {'workers':>7} {'seconds':>8} {'resp/s':>9} {'speedup':>8} {'same':>5}")
+    file_before = results["file"][0]["seconds"]
+    for r in results["file"]:
+        print(f"{r['mode']:<12} {r['workers']:>7} {r['seconds']:>8.2f} {len(corpus) / r['seconds']:>9.0f} "
+              f"{file_before / r['seconds']:>7.2f}x {str(r['same_scores']):>5}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
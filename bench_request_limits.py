@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+リクエストサイズ制限のベンチマーク
+
+proven_api.py の変更前のリビジョン（git archive で取り出す）と現在のツリーを起動し、
+/v1/chat/completions に大きなリクエストを一斉に送りながら、以下を計測します。
+
+- サーバープロセスのピーク RSS（/proc/<pid>/status の VmHWM）
+- 全リクエストの処理にかかった時間と応答のステータス（413 / 400 / 送信中の切断など）
+- 並行して送る /health のレイテンシ（p50 / p99）
+
+シナリオ:
+- oversized: Content-Length が --body-mb MB の JSON のようなボディを実際に送る
+- malformed: 上限内（--malformed-kb KB）の JSON でないボディ
+"""
+
+import argparse
+import http.client
+import json
+import socket
+import tempfile
+import threading
+import time
+
+from bench_serving import HERE, baseline_ref, export_tree, free_port, percentile, start_server
+
+SEND_CHUNK = b'a' * (1024 * 1024)
+
+
+def peak_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def send_request(port, body_size, prefix):
+    """Content-Length: body_size のボディを 1 MiB ずつ送り、応答のステータスを返す（送信中に切断されれば 'reset'）"""
+    sock = socket.create_connection(('127.0.0.1', port), timeout=60)
+    try:
+        sock.sendall(b"POST /v1/chat/completions HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                     b"Content-Type: application/json\r\nConnection: close\r\n"
+                     b"Content-Length: %d\r\n\r\n" % body_size)
+        try:
+            sock.sendall(prefix)
+            sent = len(prefix)
+            while sent < body_size:
+                n = min(len(SEND_CHUNK), body_size - sent)
+                sock.sendall(SEND_CHUNK[:n])
+                sent += n
+        except OSError:
+            pass
+        try:
+            status_line = sock.recv(64).split(b'\r\n', 1)[0].split()
+            return status_line[1].decode() if len(status_line) > 1 else 'reset'
+        except OSError:
+            return 'reset'
+    finally:
+        sock.close()
+
+
+def probe_health(port, stop, latencies):
+    """stop が立つまで 20ms 毎に /health を新しい接続で送る"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            conn.request('GET', '/health')
+            conn.getresponse().read()
+            latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        stop.wait(0.02)
+
+
+def flood(port, pid, args, body_size, prefix):
+    statuses = {}
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            status = send_request(port, body_size, prefix)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    latencies = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe_health, args=(port, stop, latencies))
+    prober.start()
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(args.clients)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    prober.join()
+    return {
+        "seconds": elapsed,
+        "statuses": statuses,
+        "peak_rss_mb": peak_rss_mb(pid),
+        "health_p50_ms": percentile(latencies, 50) * 1000,
+        "health_p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="リクエストサイズ制限のベンチマーク")
+    parser.add_argument('--baseline-ref', help="変更前のリビジョン（既定は request_limits.py を追加する前）")
+    parser.add_argument('--modes', default='thread,asyncio')
+    parser.add_argument('--scenarios', default='oversized,malformed')
+    parser.add_argument('--clients', type=int, default=8, help="同時に送るクライアント数")
+    parser.add_argument('--requests', type=int, default=32, help="シナリオ毎のリクエスト数")
+    parser.add_argument('--body-mb', type=int, default=32, help="oversized のボディサイズ（MB）")
+    parser.add_argument('--malformed-kb', type=int, default=512, help="malformed のボディサイズ（KB）")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    scenarios = {
+        "oversized": (args.body_mb * 1024 * 1024, b'{"messages":[],"padding":"'),
+        "malformed": (args.malformed_kb * 1024, b'a'),
+    }
+    ref = args.baseline_ref or baseline_ref('request_limits.py')
+    print(f"=== リクエストサイズ制限（変更前: {ref}、{args.clients}クライアント × {args.requests}件） ===")
+    print(f"{'mode':<8} {'scenario':<10} {'tree':<7} {'peak RSS':>9} {'seconds':>8} "
+          f"{'health p50':>11} {'health p99':>11}  statuses")
+
+    results = []
+    with tempfile.TemporaryDirectory() as baseline_root:
+        export_tree(ref, baseline_root)
+        for mode in args.modes.split(','):
+            for scenario in args.scenarios.split(','):
+                body_size, prefix = scenarios[scenario]
+                for tree, root in (("before", baseline_root), ("after", HERE)):
+                    # シナリオ毎に起動し直してピーク RSS を分ける
+                    port = free_port()
+                    proc = start_server(mode, port, 16, 0.0, root=root)
+                    try:
+                        result = flood(port, proc.pid, args, body_size, prefix)
+                    finally:
+                        proc.terminate()
+                        proc.wait()
+                    result.update(mode=mode, scenario=scenario, tree=tree)
+                    results.append(result)
+                    statuses = ' '.join(f"{k}:{v}" for k, v in sorted(result["statuses"].items()))
+                    print(f"{mode:<8} {scenario:<10} {tree:<7} {result['peak_rss_mb']:>7.0f}MB "
+                          f"{result['seconds']:>8.2f} {result['health_p50_ms']:>9.1f}ms "
+                          f"{result['health_p99_ms']:>9.1f}ms  {statuses}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+応答キャッシュ ベンチマーク
+temperature 0 の同じリクエストを繰り返し送り、X-Cache: MISS（生成）と
+X-Cache: HIT（キャッシュ）のレイテンシを比較します
+
+--url を省略すると、擬似生成時間付きの proven_api.py をローカルで起動します。
+api_server.py を計測する場合は JAN_NANO_RESPONSE_CACHE_MB を設定して起動し、--url を指定してください。
+"""
+
+import argparse
+import http.client
+import json
+import time
+import urllib.parse
+
+from bench_serving import free_port, percentile, start_server
+
+
+def send(conn, path, payload):
+    start = time.perf_counter()
+    conn.request('POST', path, body=payload, headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    response.read()
+    return time.perf_counter() - start, response.status, response.getheader('X-Cache')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="応答キャッシュ ベンチマーク")
+    parser.add_argument('--url', help="計測するサーバー（省略時はローカルの proven_api.py を起動）")
+    parser.add_argument('--prompts', type=int, default=20, help="異なるプロンプトの数")
+    parser.add_argument('--repeats', type=int, default=5, help="各プロンプトの送信回数")
+    parser.add_argument('--max-tokens', type=int, default=64)
+    parser.add_argument('--delay', type=float, default=0.2, help="ローカル起動時の擬似生成時間（秒）")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    proc = None
+    if args.url:
+        url = urllib.parse.urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        proc = start_server('thread', port, 16, args.delay, ['--response-cache-mb', '64'])
+
+    latencies = {"MISS": [], "HIT": []}
+    errors = 0
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=120)
+        for repeat in range(args.repeats):
+            for i in range(args.prompts):
+                payload = json.dumps({
+                    "model": "jan-nano-4b-q8",
+                    "messages": [
+                        {"role": "system", "content": "あなたは日本語AIアシスタントです。"},
+                        {"role": "user", "content": f"質問 {i}: キャッシュについて説明してください。"}
+                    ],
+                    "max_tokens": args.max_tokens,
+                    "temperature": 0
+                }, ensure_ascii=False).encode('utf-8')
+                elapsed, status, cache = send(conn, '/v1/chat/completions', payload)
+                if status != 200 or cache not in latencies:
+                    errors += 1
+                    continue
+                latencies[cache].append(elapsed)
+        conn.close()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    print("=== 応答キャッシュ ベンチマーク ===")
+    print(f"プロンプト数: {args.prompts}  繰り返し: {args.repeats}  エラー: {errors}")
+    print(f"{'X-Cache':<8} {'件数':>6} {'p50(ms)':>10} {'p99(ms)':>10} {'平均(ms)':>10}")
+    results = {}
+    for cache, values in latencies.items():
+        if not values:
+            continue
+        results[cache] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "mean_ms": sum(values) / len(values) * 1000,
+        }
+        r = results[cache]
+        print(f"{cache:<8} {r['count']:>6} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['mean_ms']:>10.2f}")
+    if "HIT" in results and "MISS" in results:
+        print(f"\nHIT は MISS の {results['MISS']['mean_ms'] / results['HIT']['mean_ms']:.0f} 倍高速")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+ローリングデプロイ（rollout.py）のベンチマーク
+
+fake_aws.py を aws として PATH に置き、--nodes 台のローカルの proven_api.py をノードとして、
+以下のやり方でデプロイ全体にかかる時間と、容量が減っていた時間を計測します。
+別スレッドで全ノードの /health を --sample-ms 毎に確認し、ready のノード数を記録します。
+
+- loop (simple_api.py): 変更前の simple_api.py と同じく send-command を1台ずつ順に実行し、ready は待たない
+  （時間は全ノードが ready になるまで）
+- rollout batch N: rollout.py で N 台ずつ、ready を待ってから次のバッチに進む
+- rollout batch 1 + broken: 2台目のリリースが起動しない場合（中止して、更新した2台をロールバックする）
+"""
+
+import argparse
+import json
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_serving import HERE, free_port
+from rollout import Node, Rollout, ssm_step, wait_healthy
+
+
+class CapacityMonitor:
+    """全ノードの /health を定期的に確認して、ready のノード数を記録する"""
+
+    def __init__(self, nodes, interval):
+        self.nodes = nodes
+        self.interval = interval
+        self.samples = []  # (time.monotonic(), ready のノード数)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            ready = sum(wait_healthy(node.health_url, 0, request_timeout=0.2) for node in self.nodes)
+            self.samples.append((time.monotonic(), ready))
+            self._stopped.wait(self.interval)
+
+    def seconds_below(self, capacity):
+        """ready のノード数が capacity 未満だった時間（サンプル間隔で近似）"""
+        return sum(later - now for (now, ready), (later, _) in zip(self.samples, self.samples[1:])
+                   if ready < capacity)
+
+    def min_ready(self):
+        return min(ready for _, ready in self.samples)
+
+
+def install_fake_aws(tmp, nodes, start_delay, latency):
+    """fake_aws.py を aws として PATH の先頭に置き、ノードの状態ファイルを作る"""
+    bin_dir = os.path.join(tmp, 'bin')
+    state_dir = os.path.join(tmp, 'state')
+    os.makedirs(bin_dir)
+    os.makedirs(state_dir)
+    shim = os.path.join(bin_dir, 'aws')
+    with open(shim, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(HERE, "fake_aws.py")}" "$@"\n')
+    os.chmod(shim, os.stat(shim).st_mode | stat.S_IEXEC)
+    for node in nodes:
+        with open(os.path.join(state_dir, f"{node.instance_id}.json"), 'w') as f:
+            json.dump({"port": node.port}, f)
+    os.environ.update(PATH=bin_dir + os.pathsep + os.environ['PATH'], FAKE_AWS_STATE=state_dir,
+                      FAKE_AWS_START_DELAY=str(start_delay), FAKE_AWS_LATENCY=str(latency))
+    return state_dir
+
+
+def wait_all_ready(nodes, timeout=60):
+    for node in nodes:
+        if not wait_healthy(node.health_url, timeout, interval=0.05, max_interval=0.05):
+            raise RuntimeError(f"{node.instance_id} が ready になりませんでした")
+
+
+def stop_fleet(state_dir, nodes):
+    for node in nodes:
+        with open(os.path.join(state_dir, f"{node.instance_id}.json")) as f:
+            pid = json.load(f).get("pid")
+        if pid:
+            try:
+                os.kill(pid, 15)
+            except ProcessLookupError:
+                pass
+
+
+def loop_deploy(nodes):
+    """変更前の simple_api.py と同じ: send-command を1台ずつ実行し、全ノードが ready になるまでの時間を返す"""
+    start = time.monotonic()
+    for node in nodes:
+        subprocess.run(['aws', 'ssm', 'send-command', '--instance-ids', node.instance_id,
+                        '--document-name', 'AWS-RunShellScript', '--region', 'ap-northeast-1'],
+                       capture_output=True, check=True)
+    wait_all_ready(nodes)
+    return {"ok": True, "seconds": time.monotonic() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローリングデプロイのベンチマーク")
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--batch-sizes', default='1,2', help="rollout.py のバッチサイズ（カンマ区切り）")
+    parser.add_argument('--start-delay', type=float, default=2.0, help="ノードが ready になるまでの秒数")
+    parser.add_argument('--latency', type=float, default=0.2, help="aws CLI の呼び出し1回の秒数")
+    parser.add_argument('--health-timeout', type=float, default=8.0)
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    parser.add_argument('--max-poll-interval', type=float, default=2.0)
+    parser.add_argument('--sample-ms', type=float, default=50, help="容量を確認する間隔（ミリ秒）")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    nodes = [Node(f"i-{i:017x}", '127.0.0.1', free_port()) for i in range(args.nodes)]
+    deploy = ssm_step(["systemctl restart jan-nano-api"], comment="rollout deploy")
+    rollback = ssm_step(["systemctl restart jan-nano-api"], comment="rollout rollback")
+    scenarios = [("loop (simple_api.py)", lambda: loop_deploy(nodes), "")]
+    for batch_size in (int(size) for size in args.batch_sizes.split(',')):
+        scenarios.append((f"rollout batch {batch_size}", lambda batch_size=batch_size: Rollout(
+            nodes, deploy, rollback, batch_size=batch_size, health_timeout=args.health_timeout,
+            poll_interval=args.poll_interval, max_poll_interval=args.max_poll_interval, log=None
+        ).run(), ""))
+    scenarios.append(("batch 1 + broken", lambda: Rollout(
+        nodes, deploy, rollback, batch_size=1, health_timeout=args.health_timeout,
+        poll_interval=args.poll_interval, max_poll_interval=args.max_poll_interval, log=None
+    ).run(), nodes[1].instance_id))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        state_dir = install_fake_aws(tmp, nodes, args.start_delay, args.latency)
+        try:
+            # 全ノードを起動しておく
+            subprocess.run(['aws', 'ssm', 'send-command', '--instance-ids', ','.join(n.instance_id for n in nodes)],
+                           check=True, capture_output=True)
+            wait_all_ready(nodes)
+            for name, deploy_fleet, broken in scenarios:
+                os.environ['FAKE_AWS_BROKEN'] = broken
+                with CapacityMonitor(nodes, args.sample_ms / 1000) as monitor:
+                    report = deploy_fleet()
+                    time.sleep(args.sample_ms / 1000 * 2)
+                wait_all_ready(nodes)  # ロールバックの後も全ノードが ready に戻っていること
+                results.append({
+                    "mode": name, "ok": report["ok"], "seconds": report["seconds"],
+                    "degraded_seconds": monitor.seconds_below(len(nodes)),
+                    "outage_seconds": monitor.seconds_below(1), "min_ready": monitor.min_ready(),
+                })
+        finally:
+            stop_fleet(state_dir, nodes)
+
+    print(f"=== ローリングデプロイ（{args.nodes}台、起動 {args.start_delay}秒、aws 呼び出し {args.latency}秒） ===")
+    print(f"{'mode':<22} {'ok':>5} {'total':>7} {'degraded':>9} {'outage':>7} {'min ready':>10}")
+    for r in results:
+        print(f"{r['mode']:<22} {str(r['ok']):>5} {r['seconds']:>6.1f}s {r['degraded_seconds']:>8.1f}s "
+              f"{r['outage_seconds']:>6.1f}s {r['min_ready']:>6}/{args.nodes}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+router.py の振り分け方式別ベンチマーク
+
+proven_api.py を擬似モデル付きで複数起動し（1ノード1生成枠、プレフィックスキャッシュにない
+system プロンプトは --prefill-delay 秒の prefill、--slow-rate の割合の生成は長い）、
+その前に router.py を方式毎に起動し直して、同じ負荷（system プロンプト --prompts 種類 × 質問）を
+closed-loop で送ります。スループット・p50/p99 レイテンシ・プレフィックスキャッシュのヒット率を比較します。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bench_serving import HERE, free_port, start_server
+from loadgen import ConnectionPool, build_payload, run_closed_loop, summarize
+from test_japanese_complex import COMPLEX_QUESTIONS
+
+POLICIES = ("round_robin", "queue", "affinity")
+
+
+def start_router(port, backends, policy, extra_args=()):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'router.py'), '--host', '127.0.0.1', '--port', str(port),
+         '--backends', ','.join(backends), '--policy', policy, '--quiet', *extra_args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("router.py が起動しませんでした")
+
+
+def prefix_cache_counts(url):
+    """proven_api.py の /metrics から擬似プレフィックスキャッシュの hit / miss を読む"""
+    counts = {"hit": 0, "miss": 0}
+    with urllib.request.urlopen(f"{url}/metrics", timeout=5) as response:
+        for line in response.read().decode('utf-8').splitlines():
+            for result in counts:
+                if line.startswith(f'jan_nano_prefix_cache_requests_total{{result="{result}"}}'):
+                    counts[result] = int(float(line.split()[-1]))
+    return counts
+
+
+def build_payloads(prompts, count, stream, seed=0):
+    rng = random.Random(seed)
+    systems = [f"あなたは{topic}の専門家です。" + "専門用語を正確に使い、根拠を示して丁寧に説明してください。" * 8
+               for topic in ("経済", "歴史", "物理", "医療", "法律", "教育", "環境", "情報工学")[:prompts]]
+    payloads = []
+    for _ in range(count):
+        messages = [
+            {"role": "system", "content": rng.choice(systems)},
+            {"role": "user", "content": rng.choice(COMPLEX_QUESTIONS)["question"]},
+        ]
+        payloads.append(build_payload(messages, "jan-nano-4b-q8", 64, stream))
+    return payloads
+
+
+def run_policy(policy, args, payloads):
+    backend_args = [
+        '--model-slots', '1', '--prefill-delay', str(args.prefill_delay),
+        '--prefix-cache-entries', str(args.cache_entries),
+        '--slow-rate', str(args.slow_rate), '--slow-delay', str(args.slow_delay),
+    ]
+    backends, procs = [], []
+    try:
+        for _ in range(args.backends):
+            port = free_port()
+            procs.append(start_server('thread', port, 64, args.delay, backend_args))
+            backends.append(f"http://127.0.0.1:{port}")
+        router_port = free_port()
+        procs.append(start_router(router_port, backends, policy, ['--affinity-slack', str(args.affinity_slack)]))
+
+        async def load():
+            pool = ConnectionPool(f"http://127.0.0.1:{router_port}", size=args.concurrency, timeout=60)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            try:
+                results = await run_closed_loop(pool, payloads, args.concurrency, args.duration)
+            finally:
+                pool.close()
+            return summarize(results, loop.time() - start)
+
+        result = asyncio.run(load())
+        counts = [prefix_cache_counts(url) for url in backends]
+        hits = sum(c["hit"] for c in counts)
+        lookups = hits + sum(c["miss"] for c in counts)
+        result["prefix_hit_rate"] = hits / lookups if lookups else 0.0
+        return result
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="router.py の振り分け方式別ベンチマーク")
+    parser.add_argument('--policies', default=','.join(POLICIES))
+    parser.add_argument('--backends', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=12)
+    parser.add_argument('--duration', type=float, default=10.0, help="方式毎の計測時間（秒）")
+    parser.add_argument('--delay', type=float, default=0.05, help="1件の擬似生成時間（秒）")
+    parser.add_argument('--prefill-delay', type=float, default=0.15, help="プレフィックスキャッシュにない時の prefill（秒）")
+    parser.add_argument('--cache-entries', type=int, default=2, help="ノード毎のプレフィックスキャッシュの件数")
+    parser.add_argument('--prompts', type=int, default=6, help="system プロンプトの種類")
+    parser.add_argument('--slow-rate', type=float, default=0.1, help="長い生成の割合")
+    parser.add_argument('--slow-delay', type=float, default=0.3, help="長い生成で追加される時間（秒）")
+    parser.add_argument('--affinity-slack', type=int, default=2)
+    parser.add_argument('--stream', action='store_true', help="SSE ストリーミングで送る")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.prompts, 1000, args.stream)
+    print(f"=== router.py ベンチマーク（{args.backends}ノード, system プロンプト {args.prompts}種類, "
+          f"同時実行数 {args.concurrency}） ===")
+    print(f"{'policy':<12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'prefix hit':>11} {'errors':>7}")
+
+    results = {}
+    for policy in args.policies.split(','):
+        result = run_policy(policy, args, payloads)
+        results[policy] = result
+        print(f"{policy:<12} {result['throughput_rps']:>8.1f} {result['latency_ms']['p50']:>8.0f} "
+              f"{result['latency_ms']['p99']:>8.0f} {result['prefix_hit_rate']:>10.0%} "
+              f"{result['requests'] - result['ok']:>7}")
+
+    if 'round_robin' in results:
+        baseline = results['round_robin']['throughput_rps']
+        for policy, result in results.items():
+            if policy != 'round_robin' and baseline:
+                print(f"{policy}: round_robin 比 {result['throughput_rps'] / baseline:.2f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
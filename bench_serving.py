@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+proven_api.py サーバーモード別 負荷ベンチマーク
+single / thread / asyncio の各モードをローカルで起動し、
+同時接続数 1・16・256 での requests/sec と p99 レイテンシを計測します
+"""
+
+import argparse
+import http.client
+import json
+import subprocess
+import threading
+import time
+
+# サーバーの起動処理はテストと共通
+from test_support import HERE, free_port, start_server
+
+CHAT_PAYLOAD = json.dumps({
+    "model": "jan-nano-4b-q8",
+    "messages": [{"role": "user", "content": "こんにちは"}],
+    "max_tokens": 50
+}).encode('utf-8')
+
+
+def baseline_ref(added_file):
+    """added_file を追加したコミットの親（未コミットなら HEAD）。変更前後の比較に使う"""
+    added = subprocess.run(['git', 'log', '--diff-filter=A', '--format=%H', '--', added_file],
+                           cwd=HERE, capture_output=True, text=True).stdout.split()
+    return f"{added[-1]}^" if added else "HEAD"
+
+
+def export_tree(ref, path):
+    """git archive で ref のツリーを path に取り出す（start_server(root=path) で変更前のサーバーを起動できる）"""
+    archive = subprocess.run(['git', 'archive', ref], cwd=HERE, capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', path], input=archive, check=True)
+
+
+def client_loop(port, path, deadline, latencies, errors):
+    """keep-alive 接続を使い回してリクエストを送り続ける"""
+    conn = None
+    while time.perf_counter() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        start = time.perf_counter()
+        try:
+            if path == '/v1/chat/completions':
+                conn.request('POST', path, body=CHAT_PAYLOAD, headers={'Content-Type': 'application/json'})
+            else:
+                conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_load(port, path, concurrency, duration):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client_loop, args=(port, path, deadline, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="proven_api.py サーバーモード別負荷ベンチマーク")
+    parser.add_argument('--modes', default='single,thread,asyncio')
+    parser.add_argument('--concurrency', default='1,16,256')
+    parser.add_argument('--duration', type=float, default=3.0, help="各計測の時間（秒）")
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--delay', type=float, default=0.0, help="サーバー側の擬似生成時間（秒）")
+    parser.add_argument('--path', default='/v1/chat/completions')
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    print("=== proven_api.py サーバーモード別ベンチマーク ===")
+    print(f"パス: {args.path}  計測時間: {args.duration}秒  workers: {args.workers}  delay: {args.delay}秒")
+    print(f"{'mode':<8} {'clients':>7} {'req/s':>10} {'p50(ms)':>10} {'p99(ms)':>10} {'errors':>7}")
+
+    results = []
+    for mode in args.modes.split(','):
+        port = free_port()
+        proc = start_server(mode, port, args.workers, args.delay)
+        try:
+            for concurrency in [int(c) for c in args.concurrency.split(',')]:
+                result = run_load(port, args.path, concurrency, args.duration)
+                result.update({"mode": mode, "concurrency": concurrency})
+                results.append(result)
+                print(f"{mode:<8} {concurrency:>7} {result['rps']:>10.1f} "
+                      f"{result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f} {result['errors']:>7}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+投機的デコーディング（speculative.py）のベンチマーク
+
+ランダム初期化の小さなメインモデルと、その先頭 --draft-layers 層だけのドラフトモデルを作り、
+提案数 k 毎に以下を計測します（k=0 はドラフトなしの通常のデコード）。
+
+- 1トークンあたりの時間と k=0 比の速度
+- 採用率（提案のうちメインモデルが採用した割合）とメインモデルの forward 1回あたりの生成トークン数
+
+ランダムな重みでは次トークンの分布がほぼ一様で、層を減らしたモデルの分布はメインモデルと大きく離れます。
+lm_head を --logit-scale 倍して学習済みモデルのように分布を尖らせ、ドラフトより後ろの層の
+出力（o_proj / down_proj）を --residual-scale 倍にして、蒸留したドラフトのように分布を近づけます。
+
+--check-samples を指定すると、サンプリング時の出力分布が変わらないことを確認します。
+同じプロンプトから k=0 と k>0 でそれぞれ N 回生成し、最後のトークンの頻度分布の全変動距離を、
+k=0 同士（乱数の種だけ変えた場合）の距離と比べます。
+"""
+
+import argparse
+import copy
+import json
+import time
+
+import torch
+
+from speculative import speculative_generate
+from tiny_model import build_tiny_model, random_prompts
+
+
+def build_models(args):
+    model = build_tiny_model(args.hidden_size, args.layers, args.hidden_size // 64, args.vocab_size)
+    with torch.no_grad():
+        for layer in model.model.layers[args.draft_layers:]:
+            layer.self_attn.o_proj.weight.mul_(args.residual_scale)
+            layer.mlp.down_proj.weight.mul_(args.residual_scale)
+        model.lm_head.weight.mul_(args.logit_scale)
+    draft = copy.deepcopy(model)
+    draft.model.layers = draft.model.layers[:args.draft_layers]
+    draft.config.num_hidden_layers = args.draft_layers
+    return model, draft
+
+
+def run(model, draft, prompts, k, temperature, top_p, max_tokens):
+    totals = {"rounds": 0, "proposed": 0, "accepted": 0, "tokens": 0}
+    generator = torch.Generator().manual_seed(0)
+    start = time.perf_counter()
+    for prompt in prompts:
+        _, stats = speculative_generate(model, draft, torch.tensor([prompt]), max_tokens, temperature, top_p,
+                                        num_draft_tokens=k, generator=generator)
+        for key in totals:
+            totals[key] += stats[key]
+    elapsed = time.perf_counter() - start
+    return {
+        "k": k,
+        "temperature": temperature,
+        "ms_per_token": elapsed / totals["tokens"] * 1000,
+        "acceptance_rate": totals["accepted"] / totals["proposed"] if totals["proposed"] else None,
+        "tokens_per_forward": totals["tokens"] / totals["rounds"],
+    }
+
+
+def last_token_counts(model, draft, prompt, k, args, seed):
+    """同じプロンプトから --check-tokens トークンを N 回生成し、最後のトークンの出現回数を返す"""
+    generator = torch.Generator().manual_seed(seed)
+    counts = torch.zeros(args.vocab_size)
+    for _ in range(args.check_samples):
+        output, _ = speculative_generate(model, draft, torch.tensor([prompt]), args.check_tokens, args.check_temperature,
+                                         args.top_p, num_draft_tokens=k, generator=generator)
+        counts[output[0, -1]] += 1
+    return counts
+
+
+def total_variation(a, b):
+    return 0.5 * (a / a.sum() - b / b.sum()).abs().sum().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投機的デコーディングのベンチマーク")
+    parser.add_argument('--hidden-size', type=int, default=1024)
+    parser.add_argument('--layers', type=int, default=12)
+    parser.add_argument('--draft-layers', type=int, default=1)
+    parser.add_argument('--vocab-size', type=int, default=4096)
+    parser.add_argument('--residual-scale', type=float, default=0.05, help="ドラフトより後ろの層の出力の倍率")
+    parser.add_argument('--logit-scale', type=float, default=10.0, help="lm_head の倍率（分布の尖り具合）")
+    parser.add_argument('--draft-tokens', default='0,2,4,6', help="1回に提案するトークン数 k（カンマ区切り）")
+    parser.add_argument('--temperatures', default='0,0.7')
+    parser.add_argument('--top-p', type=float, default=0.9)
+    parser.add_argument('--prompts', type=int, default=4)
+    parser.add_argument('--max-tokens', type=int, default=64)
+    parser.add_argument('--check-samples', type=int, default=0, help="出力分布の確認に使う生成回数（0 で省略）")
+    parser.add_argument('--check-tokens', type=int, default=3, help="出力分布の確認で生成するトークン数")
+    parser.add_argument('--check-temperature', type=float, default=1.0)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    model, draft = build_models(args)
+    prompts = random_prompts(args.prompts, vocab_size=args.vocab_size)
+    # ウォームアップ
+    run(model, draft, prompts[:1], 2, 0.0, 1.0, 8)
+
+    print(f"=== 投機的デコーディング（メイン {args.layers}層 / ドラフト {args.draft_layers}層、hidden {args.hidden_size}、"
+          f"{args.prompts}プロンプト × {args.max_tokens}トークン） ===")
+    print(f"{'temp':>5} {'k':>3} {'ms/token':>9} {'speedup':>8} {'accept':>7} {'tokens/forward':>15}")
+    results = []
+    for temperature in (float(t) for t in args.temperatures.split(',')):
+        baseline = None
+        for k in (int(k) for k in args.draft_tokens.split(',')):
+            result = run(model, draft, prompts, k, temperature, args.top_p, args.max_tokens)
+            if baseline is None:
+                baseline = result["ms_per_token"]
+            result["speedup"] = baseline / result["ms_per_token"]
+            results.append(result)
+            accept = f"{result['acceptance_rate']:.0%}" if result["acceptance_rate"] is not None else "-"
+            print(f"{temperature:>5} {k:>3} {result['ms_per_token']:>9.2f} {result['speedup']:>7.2f}x {accept:>7} "
+                  f"{result['tokens_per_forward']:>15.2f}")
+
+    report = {"config": vars(args), "results": results}
+    if args.check_samples:
+        k = max(int(k) for k in args.draft_tokens.split(','))
+        prompt = prompts[0]
+        plain = last_token_counts(model, draft, prompt, 0, args, seed=1)
+        noise = total_variation(plain, last_token_counts(model, draft, prompt, 0, args, seed=2))
+        speculative = total_variation(plain, last_token_counts(model, draft, prompt, k, args, seed=3))
+        report["distribution_check"] = {"tv_plain_vs_plain": noise, "tv_plain_vs_speculative": speculative}
+        print(f"\n出力分布の確認（{args.check_tokens}トークン目、{args.check_samples}回、temperature "
+              f"{args.check_temperature}）: 全変動距離 k=0 同士 {noise:.3f} / k=0 と k={k} {speculative:.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
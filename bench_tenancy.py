@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+マルチテナントのスケジューリング（tenancy.py / admission.FairQueue）のベンチマーク
+
+推論を「見込みのトークン数に比例して sleep するジョブ」で模擬し（--ms-per-token）、1ワーカーの
+InferenceExecutor に次の混合ワークロードを --duration 秒かけます。
+- chat（interactive）: ポアソン到着で毎秒 --chat-rate 件。プロンプト 100〜300 トークン、max_tokens 64〜128
+- eval-a / eval-b（standard、weight 3 と 1）: それぞれ2クライアントが閉ループで送り続ける。max_tokens 200
+- nightly（batch）: 4クライアントが閉ループで max_tokens 800（test_japanese_complex.py と同じ）を送り続ける
+
+設定毎に、クラス毎のレイテンシ（投入から完了まで）の p50 / p99 と SLO、完了数、429（満杯・押し出し・
+レート制限）、終了時に終わっていなかった件数、eval-a / eval-b の処理トークンの比を表示します。
+- fifo: テナントの設定なし（変更前と同じく、全リクエストが1つのキューで先着順）
+- wfq: 優先度クラス + 重み付き公平キューイング
+- sjf: クラスを分けず、見込みのトークン数の小さい順
+- wfq+rate: wfq に nightly のレート制限（毎秒 --batch-rate トークン）を加える
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from admission import DeadlineExceeded, InferenceExecutor, QueueFull
+from loadgen import percentile
+from tenancy import Tenants
+
+# テナント: (クラス, weight, 閉ループのクライアント数（None ならポアソン到着）, プロンプトのトークン数, max_tokens)
+WORKLOAD = {
+    "chat": ("interactive", 1, None, (100, 300), (64, 128)),
+    "eval-a": ("standard", 3, 2, (150, 250), (200, 200)),
+    "eval-b": ("standard", 1, 2, (150, 250), (200, 200)),
+    "nightly": ("batch", 1, 4, (200, 400), (800, 800)),
+}
+CLASSES = {
+    "interactive": {"priority": 2, "slo_ms": 1000},
+    "standard": {"priority": 1, "slo_ms": 5000},
+    "batch": {"priority": 0, "slo_ms": 15000},
+}
+# プリフィルはデコードより1トークンあたり速い
+PREFILL_RATIO = 0.1
+
+
+def tenants_config(policy, batch_rate):
+    if policy == "fifo":
+        return {}
+    if policy == "sjf":
+        return {"policy": "sjf"}
+    tenants = {name: {"api_keys": [name], "class": spec[0], "weight": spec[1]} for name, spec in WORKLOAD.items()}
+    if policy == "wfq+rate":
+        tenants["nightly"].update(rate=batch_rate, burst=batch_rate * 2)
+    return {"classes": CLASSES, "tenants": tenants}
+
+
+class MixedWorkload:
+    """WORKLOAD のクライアントを動かし、クラス毎のレイテンシと 429 を記録する"""
+
+    def __init__(self, executor, tenants, ms_per_token, duration, chat_rate, seed=0):
+        self.executor = executor
+        self.tenants = tenants
+        self.ms_per_token = ms_per_token
+        self.chat_rate = chat_rate
+        self.rng = random.Random(seed)
+        self.ends_at = time.perf_counter() + duration
+        self.latencies = {spec[0]: [] for spec in WORKLOAD.values()}
+        self.rejected = {spec[0]: 0 for spec in WORKLOAD.values()}
+        self.tokens = {name: 0 for name in WORKLOAD}
+        self.outstanding = set()
+        self._lock = threading.Lock()
+
+    def run(self):
+        threads = [threading.Thread(target=self.open_loop, args=(name,))
+                   for name, spec in WORKLOAD.items() if spec[2] is None]
+        threads += [threading.Thread(target=self.closed_loop, args=(name,))
+                    for name, spec in WORKLOAD.items() if spec[2] is not None for _ in range(spec[2])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 終了時に終わっていないジョブは実行しない（キャンセルすると DeadlineExceeded で外れる）
+        with self._lock:
+            unfinished = list(self.outstanding)
+        for job, _, _ in unfinished:
+            job.cancel()
+        return [(WORKLOAD[name][0], self.ends_at - submitted) for _, name, submitted in unfinished]
+
+    def submit(self, name):
+        """見込みのトークン数に比例して sleep するジョブを投入する"""
+        class_name, _, _, prompt_range, max_tokens_range = WORKLOAD[name]
+        with self._lock:
+            prompt = self.rng.randint(*prompt_range)
+            max_tokens = self.rng.randint(*max_tokens_range)
+        service = (prompt * PREFILL_RATIO + max_tokens) * self.ms_per_token / 1000
+        submitted = time.perf_counter()
+        job = self.executor.submit(lambda job: time.sleep(service), tenant=self.tenants.resolve(name),
+                                   cost=prompt + max_tokens)
+        entry = (job, name, submitted)
+        with self._lock:
+            self.outstanding.add(entry)
+
+        def done(future):
+            finished = time.perf_counter()
+            with self._lock:
+                self.outstanding.discard(entry)
+                error = future.exception()
+                if error is None and finished <= self.ends_at:
+                    self.latencies[class_name].append(finished - submitted)
+                    self.tokens[name] += prompt + max_tokens
+                elif isinstance(error, QueueFull):
+                    # 優先度の高いリクエストに押し出された
+                    self.rejected[class_name] += 1
+
+        job.future.add_done_callback(done)
+        return job
+
+    def reject(self, name, error):
+        with self._lock:
+            self.rejected[WORKLOAD[name][0]] += 1
+        time.sleep(max(0.0, min(error.retry_after, self.ends_at - time.perf_counter())))
+
+    def open_loop(self, name):
+        while True:
+            time.sleep(self.rng.expovariate(self.chat_rate))
+            if time.perf_counter() >= self.ends_at:
+                return
+            try:
+                self.submit(name)
+            except QueueFull:
+                with self._lock:
+                    self.rejected[WORKLOAD[name][0]] += 1
+
+    def closed_loop(self, name):
+        while time.perf_counter() < self.ends_at:
+            try:
+                job = self.submit(name)
+            except QueueFull as e:
+                # Retry-After に従う
+                self.reject(name, e)
+                continue
+            try:
+                job.future.result(timeout=max(0.0, self.ends_at - time.perf_counter()))
+            except QueueFull as e:
+                time.sleep(max(0.0, min(e.retry_after, self.ends_at - time.perf_counter())))
+            except (FutureTimeout, DeadlineExceeded):
+                return
+
+
+def run_policy(policy, args):
+    tenants = Tenants(tenants_config(policy, args.batch_rate))
+    executor = InferenceExecutor(workers=1, max_queue=args.max_queue, fair_queue=tenants.fair_queue()).start()
+    workload = MixedWorkload(executor, tenants, args.ms_per_token, args.duration, args.chat_rate)
+    try:
+        unfinished = workload.run()
+    finally:
+        executor.stop()
+    classes = {}
+    for class_name, latencies in workload.latencies.items():
+        slo = CLASSES[class_name]["slo_ms"]
+        ages = [age * 1000 for name, age in unfinished if name == class_name]
+        p99 = percentile(latencies, 99) * 1000 if latencies else None
+        classes[class_name] = {
+            "done": len(latencies),
+            "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+            "p99_ms": p99,
+            "slo_ms": slo,
+            # 終了時にまだ終わっていないリクエストも、SLO より長く待っていれば未達
+            "slo_met": p99 is not None and p99 <= slo and all(age <= slo for age in ages),
+            "rejected": workload.rejected[class_name],
+            "unfinished": len(ages),
+            "unfinished_max_age_ms": max(ages, default=0.0),
+        }
+    share = workload.tokens["eval-a"] / workload.tokens["eval-b"] if workload.tokens["eval-b"] else None
+    return {"policy": policy, "classes": classes, "tokens": workload.tokens, "eval_a_to_b": share,
+            "queue": executor.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="マルチテナントのスケジューリングのベンチマーク")
+    parser.add_argument('--policies', default="fifo,wfq,sjf,wfq+rate")
+    parser.add_argument('--duration', type=float, default=30.0, help="設定毎の秒数")
+    parser.add_argument('--ms-per-token', type=float, default=1.0, help="模擬の推論の1トークンあたりのミリ秒")
+    parser.add_argument('--chat-rate', type=float, default=2.0, help="chat の毎秒のリクエスト数")
+    parser.add_argument('--batch-rate', type=float, default=400.0, help="wfq+rate での nightly の毎秒のトークン数")
+    parser.add_argument('--max-queue', type=int, default=16)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    results = []
+    for policy in args.policies.split(','):
+        print(f"{policy}: {args.duration:.0f}秒...", flush=True)
+        results.append(run_policy(policy, args))
+
+    print(f"\n=== クラス毎のレイテンシ（投入から完了まで、1ワーカー、{args.duration:.0f}秒） ===")
+    print(f"{'policy':<9} {'class':<12} {'done':>5} {'p50 ms':>8} {'p99 ms':>8} {'SLO ms':>7} {'met':>4} "
+          f"{'429':>5} {'unfinished':>10}")
+    for result in results:
+        for class_name, r in result["classes"].items():
+            p50 = f"{r['p50_ms']:.0f}" if r["p50_ms"] is not None else "-"
+            p99 = f"{r['p99_ms']:.0f}" if r["p99_ms"] is not None else "-"
+            print(f"{result['policy']:<9} {class_name:<12} {r['done']:>5} {p50:>8} {p99:>8} {r['slo_ms']:>7} "
+                  f"{'yes' if r['slo_met'] else 'no':>4} {r['rejected']:>5} {r['unfinished']:>10}")
+
+    print("\n=== standard の2テナント（weight 3:1）の処理トークン ===")
+    for result in results:
+        share = f"{result['eval_a_to_b']:.2f}" if result["eval_a_to_b"] is not None else "-"
+        print(f"{result['policy']:<9} eval-a {result['tokens']['eval-a']:>7}  eval-b {result['tokens']['eval-b']:>7}"
+              f"  比 {share}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+マルチプロセス ワーカーモードのベンチマーク
+
+api_server.py を JAN_NANO_PROCESSES=1..コア数 で起動し、プロセス数毎に以下を計測します。
+
+- ワーカー1プロセスあたりの RSS と匿名メモリ（重み以外のプロセス固有のメモリ）
+- 全プロセスの PSS の合計（共有ページを按分した実際のメモリ使用量）と、
+  1プロセスの RSS × プロセス数（重みを共有しない場合の目安）
+- closed-loop（同時実行数 = プロセス数 × --concurrency-per-process）の合計スループット
+
+mmap で読み込んだ重みはページキャッシュの同じページを全ワーカーが参照するため、
+プロセスを増やしても増えるのは匿名メモリの分だけになります。
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from bench_serving import HERE, free_port
+from loadgen import ConnectionPool, build_payload, default_prompts, run_closed_loop, summarize
+from tiny_model import save_tiny_checkpoint
+
+
+def smaps_rollup_kb(pid):
+    """/proc/<pid>/smaps_rollup の Rss / Pss / Anonymous（KB）"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss', 'Anonymous'):
+                values[key] = int(value.split()[0])
+    return values
+
+
+def get_health(port):
+    """新しい接続で /health を呼ぶ（接続毎に別のワーカーが受け付ける）"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request('GET', '/health')
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def wait_ready(proc, port, processes, timeout):
+    """processes 個のワーカーが ready を返すまで待ち、ワーカーの pid を返す"""
+    ready = set()
+    deadline = time.perf_counter() + timeout
+    while len(ready) < processes:
+        if proc.poll() is not None:
+            raise RuntimeError("api_server.py が終了しました")
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"{timeout}秒以内に全ワーカーが ready になりませんでした（{len(ready)}/{processes}）")
+        try:
+            status, body = get_health(port)
+            if status == 200:
+                ready.add(body["pid"])
+        except OSError:
+            time.sleep(0.2)
+    return sorted(ready)
+
+
+def measure(model_path, load_mode, processes, args, payloads):
+    port = free_port()
+    env = dict(os.environ, JAN_NANO_MODEL_PATH=model_path, JAN_NANO_LOAD_MODE=load_mode,
+               JAN_NANO_PROCESSES=str(processes), JAN_NANO_PORT=str(port), JAN_NANO_MAX_QUEUE="1024")
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'api_server.py')], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        workers = wait_ready(proc, port, processes, args.timeout)
+
+        async def load():
+            concurrency = processes * args.concurrency_per_process
+            pool = ConnectionPool(f"http://127.0.0.1:{port}", size=concurrency, timeout=300)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            try:
+                results = await run_closed_loop(pool, payloads, concurrency, args.duration)
+            finally:
+                pool.close()
+            return summarize(results, loop.time() - start)
+
+        result = asyncio.run(load())
+        # 負荷をかけた後（KV キャッシュなどを確保した状態）のメモリ
+        memory = [smaps_rollup_kb(pid) for pid in workers]
+        supervisor = smaps_rollup_kb(proc.pid) if processes > 1 else {"Pss": 0}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        "processes": processes,
+        "load_mode": load_mode,
+        "throughput_rps": result["throughput_rps"],
+        "tokens_per_sec": result["tokens_per_sec"],
+        "p99_ms": result["latency_ms"]["p99"],
+        "errors": result["requests"] - result["ok"],
+        "rss_mb_per_worker": sum(m["Rss"] for m in memory) / len(memory) / 1024,
+        "anon_mb_per_worker": sum(m["Anonymous"] for m in memory) / len(memory) / 1024,
+        "total_pss_mb": (sum(m["Pss"] for m in memory) + supervisor["Pss"]) / 1024,
+    }
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="マルチプロセス ワーカーモードのベンチマーク")
+    parser.add_argument('--processes', default=','.join(str(n) for n in range(1, cores + 1)),
+                        help="ワーカープロセス数（カンマ区切り、既定は 1..コア数）")
+    parser.add_argument('--load-modes', default='mmap', help="JAN_NANO_LOAD_MODE（カンマ区切り、例: mmap,eager）")
+    parser.add_argument('--model-path', help="使用するチェックポイント（省略時は小さなモデルを生成）")
+    parser.add_argument('--hidden-size', type=int, default=768)
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--dtype', default='bfloat16', choices=['float32', 'bfloat16', 'float16'],
+                        help="生成するチェックポイントの dtype（eager は CPU では float32 に変換するため重みを共有できない）")
+    parser.add_argument('--concurrency-per-process', type=int, default=2)
+    parser.add_argument('--max-tokens', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help="各計測の時間（秒）")
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    payloads = [build_payload(prompt, "jan-nano-4b-q8", args.max_tokens, False, temperature=0)
+                for prompt in default_prompts()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model_path
+        if model_path is None:
+            model_path = tmp
+            save_tiny_checkpoint(model_path, hidden_size=args.hidden_size, num_layers=args.layers,
+                                 num_heads=args.hidden_size // 64, vocab_size=32000, dtype=getattr(torch, args.dtype))
+
+        print("=== マルチプロセス ワーカーモード ===")
+        print(f"CPU コア数: {cores}  モデル: {model_path}{'' if args.model_path else f' ({args.dtype})'}")
+        print(f"{'mode':<6} {'procs':>5} {'req/s':>8} {'tok/s':>8} {'p99 ms':>8} {'RSS/worker':>11} "
+              f"{'anon/worker':>12} {'total PSS':>10} {'RSS x N':>8}")
+
+        results = []
+        for load_mode in args.load_modes.split(','):
+            single_rss = None
+            for processes in (int(n) for n in args.processes.split(',')):
+                result = measure(model_path, load_mode, processes, args, payloads)
+                if single_rss is None:
+                    single_rss = result["rss_mb_per_worker"]
+                result["unshared_estimate_mb"] = single_rss * processes
+                results.append(result)
+                print(f"{load_mode:<6} {processes:>5} {result['throughput_rps']:>8.1f} "
+                      f"{result['tokens_per_sec']:>8.1f} {result['p99_ms']:>8.0f} "
+                      f"{result['rss_mb_per_worker']:>9.0f}MB {result['anon_mb_per_worker']:>10.0f}MB "
+                      f"{result['total_pss_mb']:>8.0f}MB {result['unshared_estimate_mb']:>6.0f}MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
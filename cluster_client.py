@@ -0,0 +1,272 @@
+"""
+クラスター用クライアントサイド ロードバランサー
+
+各ノードに keep-alive の requests.Session（接続プール）を持ち、バックグラウンドで全ノードの
+/health を並行して確認します。リクエストは健全なノードの中から次の方式で振り分けます。
+
+- "p2c": ランダムに2台選び、処理中のリクエスト数 × 平均レイテンシ が小さい方（power of two choices）
+- "least_outstanding": 処理中のリクエスト数が最も少ないノード
+- "round_robin": 順番
+
+接続エラー・タイムアウト・502/503/504 のノードはその場で外して別のノードへ再送し、
+次のヘルスチェックで復帰させます。hedge_after を指定すると、その秒数以内に応答がないリクエストを
+別のノードにも送り、先に返った応答を使います（テールレイテンシ対策）。
+
+    with ClusterClient(["http://10.0.0.1:8000", "http://10.0.0.2:8000"]) as client:
+        result = client.chat_completion({"messages": [{"role": "user", "content": "こんにちは"}]})
+"""
+
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 別のノードで再送するステータス
+RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+# ノードを異常とみなして外すステータス（ヘルスチェックで復帰する）
+UNHEALTHY_STATUSES = frozenset([502, 503, 504])
+# 平均レイテンシの指数移動平均の係数
+LATENCY_EWMA = 0.2
+
+
+class NodeUnavailable(Exception):
+    """全ての候補ノードで失敗した"""
+
+
+class RetryableError(Exception):
+    """別のノードで再送できる失敗（response は失敗した応答。接続エラーなら None）"""
+
+    def __init__(self, node, reason, response=None):
+        super().__init__(f"{node.url}: {reason}")
+        self.response = response
+
+
+class Node:
+    """1台のノードと接続プール・負荷の状態"""
+
+    def __init__(self, url, pool_size=16):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # 最初のヘルスチェックまでは健全とみなす
+        self.healthy = True
+        self.outstanding = 0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.outstanding += 1
+            self.requests += 1
+
+    def end(self, latency=None, error=None):
+        with self._lock:
+            self.outstanding -= 1
+            if error is not None:
+                self.failures += 1
+                self.last_error = error
+            elif latency is not None:
+                self.latency = latency if self.latency is None else \
+                    (1 - LATENCY_EWMA) * self.latency + LATENCY_EWMA * latency
+
+    def score(self):
+        """p2c の比較値（小さいほど空いている）"""
+        return (self.outstanding + 1) * (self.latency or 0.001)
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ms": self.latency * 1000 if self.latency is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class ClusterClient:
+    """ヘルスチェック付きのクライアントサイド ロードバランサー
+
+    health_interval を None にするとバックグラウンドのヘルスチェックを行わない。
+    max_attempts は1リクエストで試すノード数の上限（既定は全ノード）。
+    """
+
+    def __init__(self, endpoints, policy="p2c", health_path="/health", health_interval=2.0,
+                 health_timeout=1.0, timeout=120, hedge_after=None, pool_size=16, max_attempts=None):
+        if policy not in ("p2c", "least_outstanding", "round_robin"):
+            raise ValueError(f"Unknown policy: {policy}")
+        self.nodes = [Node(url, pool_size) for url in endpoints]
+        self.policy = policy
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts or len(self.nodes)
+        self.hedges = 0
+        self.failovers = 0
+        self._round_robin = itertools.count()
+        self._health_executor = ThreadPoolExecutor(max_workers=len(self.nodes), thread_name_prefix='health')
+        self._hedge_executor = ThreadPoolExecutor(max_workers=pool_size * len(self.nodes),
+                                                  thread_name_prefix='hedge') if hedge_after else None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """最初のヘルスチェックを済ませ、バックグラウンドの定期チェックを開始する"""
+        if self.health_interval is not None:
+            self.check_health()
+            self._thread = threading.Thread(target=self._health_loop, name='cluster-health', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self._health_executor.shutdown(wait=False)
+        if self._hedge_executor:
+            self._hedge_executor.shutdown(wait=False)
+        for node in self.nodes:
+            node.session.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def check_health(self):
+        """全ノードの health_path を並行して確認し、{url: 健全か} を返す"""
+        return dict(zip(
+            (node.url for node in self.nodes),
+            self._health_executor.map(self._probe, self.nodes)
+        ))
+
+    def _probe(self, node):
+        try:
+            response = node.session.get(node.url + self.health_path, timeout=self.health_timeout)
+            node.healthy = response.status_code == 200
+            if not node.healthy:
+                node.last_error = f"health {response.status_code}"
+        except requests.RequestException as e:
+            node.healthy = False
+            node.last_error = type(e).__name__
+        return node.healthy
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            self.check_health()
+
+    def healthy_nodes(self):
+        return [node for node in self.nodes if node.healthy]
+
+    def _choose(self, exclude):
+        """まだ試していないノードから1台選ぶ。健全なノードがなければ残りのノードから選ぶ"""
+        remaining = [node for node in self.nodes if node not in exclude]
+        candidates = [node for node in remaining if node.healthy] or remaining
+        if not candidates:
+            return None
+        if self.policy == "round_robin":
+            return candidates[next(self._round_robin) % len(candidates)]
+        if self.policy == "least_outstanding":
+            fewest = min(node.outstanding for node in candidates)
+            return random.choice([node for node in candidates if node.outstanding == fewest])
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.score() <= second.score() else second
+
+    def _mark_down(self, node):
+        # ヘルスチェックなしでは復帰できないので、外すのはヘルスチェック中のみ
+        if self.health_interval is not None:
+            node.healthy = False
+
+    def _send(self, node, method, path, kwargs):
+        node.begin()
+        start = time.perf_counter()
+        try:
+            response = node.session.request(method, node.url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            # 接続できないノードはすぐに外す
+            self._mark_down(node)
+            node.end(error=type(e).__name__)
+            raise RetryableError(node, type(e).__name__)
+
+        if response.status_code in RETRYABLE_STATUSES:
+            if response.status_code in UNHEALTHY_STATUSES:
+                self._mark_down(node)
+            node.end(error=f"HTTP {response.status_code}")
+            raise RetryableError(node, f"HTTP {response.status_code}", response)
+        node.end(latency=time.perf_counter() - start)
+        return response
+
+    def _send_hedged(self, node, tried, method, path, kwargs):
+        """hedge_after 秒以内に応答がなければ別のノードにも送り、先に成功した応答を返す"""
+        futures = {self._hedge_executor.submit(self._send, node, method, path, kwargs)}
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done:
+            backup = self._choose(tried)
+            if backup is not None:
+                tried.add(backup)
+                self.hedges += 1
+                futures.add(self._hedge_executor.submit(self._send, backup, method, path, kwargs))
+
+        error = None
+        pending = futures
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except RetryableError as e:
+                    error = e
+        raise error
+
+    def request(self, method, path, **kwargs):
+        """ノードを選んでリクエストを送る。失敗したら別のノードへ再送する
+
+        kwargs は requests.Session.request に渡す（json=... など）。
+        再送できない応答（4xx など）はそのまま返す。
+        """
+        tried = set()
+        error = None
+        hedge = self.hedge_after is not None and not kwargs.get("stream")
+        for attempt in range(self.max_attempts):
+            node = self._choose(tried)
+            if node is None:
+                break
+            tried.add(node)
+            if attempt > 0:
+                self.failovers += 1
+            try:
+                if hedge:
+                    return self._send_hedged(node, tried, method, path, kwargs)
+                return self._send(node, method, path, kwargs)
+            except RetryableError as e:
+                error = e
+        raise NodeUnavailable(f"All attempts failed (last error: {error})")
+
+    def chat_completion(self, payload, **kwargs):
+        """/v1/chat/completions を呼び、応答の JSON を返す"""
+        response = self.request("POST", "/v1/chat/completions", json=payload, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "nodes": [node.stats() for node in self.nodes],
+        }
@@ -1,13 +1,44 @@
 #!/bin/bash
 
 # Jan Nano 4B Q8 クラスターデプロイスクリプト
-# 3台のEC2インスタンスに同時デプロイ
+# 3台のEC2インスタンスに rollout.py で順にデプロイ（ROLLOUT_BATCH_SIZE 台ずつ、/health が ready になってから次へ）
 
 INSTANCES=(
     "13.230.95.222"  # i-0e25e1dff244332da
     "35.77.218.93"   # i-07a7f078041b43aee
     "43.207.37.132"  # i-04d289a5e01244e64
 )
+INSTANCE_IDS=(
+    "i-0e25e1dff244332da"
+    "i-07a7f078041b43aee"
+    "i-04d289a5e01244e64"
+)
+ROLLOUT_BATCH_SIZE="${ROLLOUT_BATCH_SIZE:-1}"
+
+# 各インスタンスにコピーするファイル（deploy_script.sh の APP_FILES と揃える）
+DEPLOY_FILES=(
+    deploy_script.sh
+    api_server.py
+    sse.py
+    batching.py
+    kv_cache.py
+    sampling.py
+    prefix_cache.py
+    response_cache.py
+    prompting.py
+    model_loader.py
+    admission.py
+    metrics.py
+    router.py
+    fastjson.py
+    request_limits.py
+    backends.py
+    speculative.py
+    embeddings.py
+    batch_infer.py
+    graceful.py
+    tenancy.py
+)
 
 ALB_DNS="jan-nano-api-alb-979792439.ap-northeast-1.elb.amazonaws.com"
 
@@ -15,27 +46,18 @@ echo "=== Jan Nano 4B Q8 クラスターデプロイ開始 ==="
 echo "Load Balancer DNS: $ALB_DNS"
 echo "インスタンス数: ${#INSTANCES[@]}"
 
-# 各インスタンスに並行してデプロイ
+SSH_OPTS="-i ~/.ssh/openhands-key.pem -o StrictHostKeyChecking=no"
+NODES=()
 for i in "${!INSTANCES[@]}"; do
-    IP="${INSTANCES[$i]}"
-    echo "インスタンス $((i+1)): $IP にデプロイ中..."
-    
-    # バックグラウンドで実行
-    (
-        # デプロイスクリプトをコピー
-        scp -i ~/.ssh/openhands-key.pem -o StrictHostKeyChecking=no \
-            /Users/yuki/jan-nano/deploy_script.sh ubuntu@$IP:~/
-        
-        # デプロイ実行
-        ssh -i ~/.ssh/openhands-key.pem -o StrictHostKeyChecking=no \
-            ubuntu@$IP 'bash ~/deploy_script.sh'
-        
-        echo "✅ インスタンス $IP デプロイ完了"
-    ) &
+    NODES+=(--node "${INSTANCE_IDS[$i]}=${INSTANCES[$i]}")
 done
 
-# すべてのバックグラウンドジョブの完了を待機
-wait
+# ROLLOUT_BATCH_SIZE 台ずつファイルをコピーしてデプロイし、全台の /health が ready になってから次に進む
+# （ready にならない台があれば残りは更新せずに終了する）
+cd /Users/yuki/jan-nano
+python3 rollout.py "${NODES[@]}" --batch-size "$ROLLOUT_BATCH_SIZE" --health-timeout 1800 \
+    --command "scp $SSH_OPTS ${DEPLOY_FILES[*]} ubuntu@{host}:~/ && ssh $SSH_OPTS ubuntu@{host} 'bash ~/deploy_script.sh'" \
+    || { echo "❌ デプロイを中止しました"; exit 1; }
 
 echo "=== 全インスタンスデプロイ完了 ==="
 echo ""
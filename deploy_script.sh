@@ -6,6 +6,10 @@
 
 echo "=== Jan Nano 4B Q8 API Server Setup ==="
 
+# サーバー本体と共通モジュール（deploy_cluster.sh で一緒にコピーされる）
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+APP_FILES="api_server.py sse.py batching.py kv_cache.py sampling.py prefix_cache.py response_cache.py prompting.py model_loader.py admission.py metrics.py router.py fastjson.py request_limits.py backends.py speculative.py embeddings.py batch_infer.py graceful.py tenancy.py"
+
 # 基本パッケージのインストール
 sudo apt-get update
 sudo apt-get install -y python3 python3-pip git wget curl
@@ -13,7 +17,7 @@ sudo apt-get install -y python3 python3-pip git wget curl
 # Python環境の準備
 pip3 install --upgrade pip
 pip3 install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cpu
-pip3 install transformers accelerate fastapi uvicorn requests
+pip3 install transformers accelerate fastapi uvicorn requests orjson
 
 # Jan Nano 4Bモデルのダウンロード
 mkdir -p /home/ubuntu/models
@@ -23,176 +27,12 @@ cd /home/ubuntu/models
 git lfs install
 git clone https://huggingface.co/jan-hq/jan-nano-4b-q8 jan-nano-4b-q8
 
-# OpenAI API互換サーバーの作成
-cat > /home/ubuntu/api_server.py << 'EOF'
-import os
-import json
-import time
-import logging
-from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import uvicorn
-
-# ログ設定
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-app = FastAPI(title="Jan Nano 4B Q8 API", version="1.0.0")
-
-# CORS設定
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# モデルとトークナイザーの初期化
-MODEL_PATH = "/home/ubuntu/models/jan-nano-4b-q8"
-tokenizer = None
-model = None
-
-def load_model():
-    global tokenizer, model
-    try:
-        logger.info("Loading tokenizer...")
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        
-        logger.info("Loading model...")
-        model = AutoModelForCausalLM.from_pretrained(
-            MODEL_PATH,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-            low_cpu_mem_usage=True
-        )
-        logger.info("Model loaded successfully!")
-        
-    except Exception as e:
-        logger.error(f"Error loading model: {e}")
-        raise
-
-# リクエストモデル
-class ChatMessage(BaseModel):
-    role: str
-    content: str
-
-class ChatCompletionRequest(BaseModel):
-    model: str = "jan-nano-4b-q8"
-    messages: List[ChatMessage]
-    max_tokens: Optional[int] = 512
-    temperature: Optional[float] = 0.7
-    top_p: Optional[float] = 0.9
-    stream: Optional[bool] = False
-
-class ChatCompletionResponse(BaseModel):
-    id: str
-    object: str = "chat.completion"
-    created: int
-    model: str
-    choices: List[Dict[str, Any]]
-    usage: Dict[str, int]
-
-@app.on_event("startup")
-async def startup_event():
-    load_model()
-
-@app.get("/")
-async def root():
-    return {"message": "Jan Nano 4B Q8 API Server", "status": "running"}
-
-@app.get("/v1/models")
-async def list_models():
-    return {
-        "object": "list",
-        "data": [
-            {
-                "id": "jan-nano-4b-q8",
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "jan-hq"
-            }
-        ]
-    }
-
-@app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest):
-    if not model or not tokenizer:
-        raise HTTPException(status_code=500, detail="Model not loaded")
-    
-    try:
-        # メッセージを文字列に変換
-        conversation = ""
-        for message in request.messages:
-            if message.role == "user":
-                conversation += f"User: {message.content}\n"
-            elif message.role == "assistant":
-                conversation += f"Assistant: {message.content}\n"
-            elif message.role == "system":
-                conversation += f"System: {message.content}\n"
-        
-        conversation += "Assistant: "
-        
-        # トークン化
-        inputs = tokenizer(conversation, return_tensors="pt")
-        
-        # 生成パラメータ
-        generation_kwargs = {
-            "max_new_tokens": request.max_tokens,
-            "temperature": request.temperature,
-            "top_p": request.top_p,
-            "do_sample": True,
-            "pad_token_id": tokenizer.eos_token_id,
-        }
-        
-        # テキスト生成
-        with torch.no_grad():
-            outputs = model.generate(
-                inputs.input_ids,
-                **generation_kwargs
-            )
-        
-        # 生成されたテキストをデコード
-        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # 元の会話部分を除去
-        response_text = generated_text[len(conversation):].strip()
-        
-        # レスポンス構築
-        response = ChatCompletionResponse(
-            id=f"chatcmpl-{int(time.time())}",
-            created=int(time.time()),
-            model=request.model,
-            choices=[
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": response_text
-                    },
-                    "finish_reason": "stop"
-                }
-            ],
-            usage={
-                "prompt_tokens": len(inputs.input_ids[0]),
-                "completion_tokens": len(outputs[0]) - len(inputs.input_ids[0]),
-                "total_tokens": len(outputs[0])
-            }
-        )
-        
-        return response
-        
-    except Exception as e:
-        logger.error(f"Error in chat completion: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-EOF
+# OpenAI API互換サーバーの配置（このスクリプトと同じディレクトリから）
+for f in $APP_FILES; do
+    if [ "$SCRIPT_DIR/$f" != "/home/ubuntu/$f" ]; then
+        cp "$SCRIPT_DIR/$f" "/home/ubuntu/$f"
+    fi
+done
 
 # systemdサービスの作成
 sudo tee /etc/systemd/system/jan-nano-api.service > /dev/null << 'EOF'
@@ -207,7 +47,14 @@ WorkingDirectory=/home/ubuntu
 ExecStart=/usr/bin/python3 /home/ubuntu/api_server.py
 Restart=always
 RestartSec=10
+# SIGTERM で drain する（graceful.py）。/health が 503 を返す間に ALB がターゲットを外し、
+# 処理中の生成は最大 JAN_NANO_DRAIN_TIMEOUT 秒待つ。TimeoutStopSec はその合計より長くする
+Environment=JAN_NANO_DRAIN_GRACE=15
+Environment=JAN_NANO_DRAIN_TIMEOUT=30
+TimeoutStopSec=60
 Environment=PYTHONPATH=/home/ubuntu
+# 推論バックエンドは既定の torch。int8（backends.py の動的量子化）は精度が落ちるので、
+# bench_backends.py で一致率を確かめてから Environment=JAN_NANO_BACKEND=int8 を足す
 
 [Install]
 WantedBy=multi-user.target
@@ -216,7 +63,8 @@ EOF
 # サービスの有効化と開始
 sudo systemctl daemon-reload
 sudo systemctl enable jan-nano-api
-sudo systemctl start jan-nano-api
+# 再デプロイでも新しいファイルで起動し直す
+sudo systemctl restart jan-nano-api
 
 echo "=== セットアップ完了 ==="
 echo "API エンドポイント: http://13.230.95.222:8000"
@@ -0,0 +1,208 @@
+"""
+/v1/embeddings の埋め込み計算とマイクロバッチング
+
+読み込み済みの言語モデルの最終隠れ状態（model.base_model の last_hidden_state）を
+パディング以外のトークンで平均し、L2 正規化したものを埋め込みとします（次元は hidden_size）。
+
+EmbeddingBatcher は最初の入力が届いてから window 秒の間に届いた入力をまとめ、
+トークン長のバケット毎に1回の forward で計算します。
+- バケットは長さを2のべき乗（最小 MIN_BUCKET）に切り上げたもの。同じバケットの入力だけを同じバッチにするので、
+  パディングはバッチ内の最長の入力に揃える分（元の長さの2倍未満）で済む
+- 1バッチの入力数は max_batch_size、パディング込みのトークン数は max_batch_tokens まで
+- 待機中の入力数は max_pending で制限し（超えると QueueFull）、期限（deadline）を過ぎた入力は計算せず
+  DeadlineExceeded で終了する
+
+パディングは右詰めです。因果的な attention では有効なトークンが後ろのパディングを参照しないので、
+パディングの量に関係なく入力毎に同じ埋め込みになります。
+"""
+
+import array
+import base64
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from admission import DeadlineExceeded, QueueFull, WaitStats, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+MIN_BUCKET = 16
+
+
+def length_bucket(length):
+    """length 以上の最小の2のべき乗（MIN_BUCKET 以上）"""
+    bucket = MIN_BUCKET
+    while bucket < length:
+        bucket *= 2
+    return bucket
+
+
+def embed(model, batch):
+    """トークンIDのリストのリストを右詰めでパディングして forward し、(len(batch), hidden_size) の埋め込みを返す"""
+    width = max(len(token_ids) for token_ids in batch)
+    input_ids = torch.zeros(len(batch), width, dtype=torch.long)
+    attention_mask = torch.zeros(len(batch), width, dtype=torch.long)
+    for row, token_ids in enumerate(batch):
+        input_ids[row, :len(token_ids)] = torch.tensor(token_ids)
+        attention_mask[row, :len(token_ids)] = 1
+
+    with torch.no_grad():
+        hidden = model.base_model(input_ids=input_ids.to(model.device),
+                                  attention_mask=attention_mask.to(model.device)).last_hidden_state
+        mask = attention_mask.to(hidden.device, hidden.dtype).unsqueeze(-1)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1)
+        return torch.nn.functional.normalize(pooled.float(), dim=-1).cpu()
+
+
+def encode_embedding(vector, encoding_format="float"):
+    """埋め込みを応答の形式にする
+
+    "float" は数値のリスト、"base64" は little-endian の float32 のバイト列を base64 にした文字列（OpenAI API と同じ）。
+    """
+    values = vector.tolist()
+    if encoding_format != "base64":
+        return values
+    packed = array.array('f', values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+
+class EmbeddingItem:
+    """バッチャーに投入された1件の入力"""
+
+    def __init__(self, token_ids, deadline=None):
+        self.token_ids = token_ids
+        # time.perf_counter() 基準の期限（None なら無期限）
+        self.deadline = deadline
+        self.submitted_at = time.perf_counter()
+        # 完了時に (hidden_size,) の埋め込みが入る
+        self.future = Future()
+
+    def expired(self):
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+
+class EmbeddingBatcher:
+    """バックグラウンドスレッドで入力をまとめて埋め込みを計算する"""
+
+    def __init__(self, model, window=0.005, max_batch_size=32, max_batch_tokens=16384, max_pending=1024):
+        self.model = model
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_pending = max_pending
+        self.pending = queue.Queue()
+        self.wait_stats = WaitStats()
+
+        self.batches = 0
+        self.inputs = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def submit(self, inputs, deadline=None):
+        """トークンIDのリストのリストを投入し、入力毎の EmbeddingItem のリストを返す
+
+        待機中の入力と合わせて max_pending 件を超えれば QueueFull（1件も投入しない）。
+        """
+        depth = self.pending.qsize()
+        if self.max_pending is not None and depth + len(inputs) > self.max_pending:
+            self.wait_stats.rejected += 1
+            raise QueueFull(retry_after_seconds(
+                depth // self.max_batch_size, self.wait_stats.mean_service_time(), 1
+            ))
+        items = [EmbeddingItem(token_ids, deadline) for token_ids in inputs]
+        for item in items:
+            self.pending.put(item)
+        return items
+
+    def stats(self):
+        return {
+            "queue_depth": self.pending.qsize(),
+            "max_queue": self.max_pending,
+            "window_ms": self.window * 1000,
+            "batches": self.batches,
+            "inputs": self.inputs,
+            "mean_batch_size": self.inputs / self.batches if self.batches else 0.0,
+            # パディング込みで forward したトークンのうち、パディングの割合
+            "padding_ratio": 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0,
+            **self.wait_stats.stats(),
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                items = [self.pending.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            # 最初の入力から window 秒の間に届いた入力を集める（1バッチ分が揃えば待たない）
+            collect_until = time.perf_counter() + self.window
+            while len(items) < self.max_batch_size:
+                remaining = collect_until - time.perf_counter()
+                try:
+                    items.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._process(items)
+
+    def _process(self, items):
+        started = time.perf_counter()
+        live = []
+        for item in items:
+            self.wait_stats.record_wait(started - item.submitted_at)
+            if item.expired():
+                self.wait_stats.expired += 1
+                item.future.set_exception(DeadlineExceeded())
+            else:
+                live.append(item)
+
+        for batch in self._batches(live):
+            try:
+                vectors = embed(self.model, [item.token_ids for item in batch])
+            except Exception as e:
+                logger.error(f"Embedding batch failed: {e}")
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            self.batches += 1
+            self.inputs += len(batch)
+            self.tokens += sum(len(item.token_ids) for item in batch)
+            self.padded_tokens += len(batch) * max(len(item.token_ids) for item in batch)
+            finished_at = time.perf_counter()
+            for item, vector in zip(batch, vectors):
+                self.wait_stats.record_service(finished_at - started)
+                item.future.set_result(vector)
+
+    def _batches(self, items):
+        """長さのバケット毎に、max_batch_size と max_batch_tokens に収まるバッチに分ける"""
+        buckets = {}
+        for item in sorted(items, key=lambda item: len(item.token_ids)):
+            buckets.setdefault(length_bucket(len(item.token_ids)), []).append(item)
+        for bucket in buckets.values():
+            batch = []
+            for item in bucket:
+                # 長さ順に並んでいるので、追加する入力がバッチ内の最長になる
+                if batch and (len(batch) >= self.max_batch_size
+                              or (len(batch) + 1) * len(item.token_ids) > self.max_batch_tokens):
+                    yield batch
+                    batch = []
+                batch.append(item)
+            if batch:
+                yield batch
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+rollout.py をローカルで試すための aws CLI の代わり（bench_rollout.py が PATH に aws として置く）
+
+FAKE_AWS_STATE のディレクトリにある <インスタンスID>.json（{"port": ...}）を1台のノードとみなし、
+`aws ssm send-command` でそのポートの proven_api.py を再起動します（コマンドの中身は実行しない）。
+
+- 古いプロセスを SIGTERM で止め、ポートが閉じるのを待ってから戻る
+- 新しいプロセスは FAKE_AWS_START_DELAY 秒（モデルの読み込みの代わり）待ってから proven_api.py を起動する
+- FAKE_AWS_BROKEN（カンマ区切りのインスタンスID）のノードは、--comment に rollback を含まない限り
+  起動に失敗する（壊れたリリースの代わり）
+- FAKE_AWS_LATENCY 秒を API 呼び出し毎に待つ
+- `aws ssm wait command-executed` はすぐに成功する
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 待ってから proven_api.py に置き換わる（壊れたリリースなら終了する）
+LAUNCHER = """
+import os, sys, time
+time.sleep(float(sys.argv[1]))
+if sys.argv[2] == 'broken':
+    sys.exit(1)
+os.execv(sys.executable, [sys.executable, sys.argv[3], '--host', '127.0.0.1', '--port', sys.argv[4], '--quiet'])
+"""
+
+
+def port_open(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+        return True
+    except OSError:
+        return False
+
+
+def restart(state_dir, instance_id, broken):
+    path = os.path.join(state_dir, f"{instance_id}.json")
+    with open(path) as f:
+        node = json.load(f)
+    if node.get("pid"):
+        try:
+            os.kill(node["pid"], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + 10
+        while port_open(node["port"]) and time.monotonic() < deadline:
+            time.sleep(0.02)
+    proc = subprocess.Popen(
+        [sys.executable, '-c', LAUNCHER, os.environ.get('FAKE_AWS_START_DELAY', '2'),
+         'broken' if broken else 'ok', os.path.join(HERE, 'proven_api.py'), str(node["port"])],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    node["pid"] = proc.pid
+    with open(path, 'w') as f:
+        json.dump(node, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rollout.py をローカルで試すための aws CLI の代わり")
+    parser.add_argument('service')
+    parser.add_argument('operation', nargs='+')
+    parser.add_argument('--instance-ids')
+    parser.add_argument('--comment', default='')
+    for option in ('--instance-id', '--command-id', '--document-name', '--parameters', '--region', '--query',
+                   '--output'):
+        parser.add_argument(option)
+    args = parser.parse_args()
+
+    time.sleep(float(os.environ.get('FAKE_AWS_LATENCY', '0')))
+    if args.service != 'ssm':
+        sys.exit(f"fake aws: {args.service} には対応していません")
+    if args.operation == ['send-command']:
+        broken = set(filter(None, os.environ.get('FAKE_AWS_BROKEN', '').split(',')))
+        for instance_id in args.instance_ids.split(','):
+            restart(os.environ['FAKE_AWS_STATE'], instance_id,
+                    instance_id in broken and 'rollback' not in args.comment)
+        print(uuid.uuid4())
+    elif args.operation != ['wait', 'command-executed']:
+        sys.exit(f"fake aws: ssm {' '.join(args.operation)} には対応していません")
+
+
+if __name__ == "__main__":
+    main()
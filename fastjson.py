@@ -0,0 +1,89 @@
+"""
+JSON のエンコード・デコードとバイト列テンプレート
+api_server.py・proven_api.py・sse.py で共通利用します
+
+- dumps() は UTF-8 の bytes を返す。orjson があれば使い、なければ標準の json
+  （ensure_ascii=False、区切りの空白なし）。JAN_NANO_JSON_BACKEND=json で標準の json に固定できる
+- Template は一部の値だけが変わる応答を、事前にエンコードした固定部分と値の連結で組み立てる
+"""
+
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None and os.environ.get("JAN_NANO_JSON_BACKEND", "orjson") == "orjson":
+    BACKEND = "orjson"
+    dumps = orjson.dumps
+    loads = orjson.loads
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode('utf-8')
+
+    loads = json.loads
+
+# テンプレートの差し込み位置の目印（私用領域の文字なので通常のテキストと衝突しない）
+_MARK = "\ue000"
+
+
+class Slot:
+    """Template の差し込み位置"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _mark_slots(obj):
+    if isinstance(obj, Slot):
+        return f"{_MARK}{obj.name}{_MARK}"
+    if isinstance(obj, dict):
+        return {key: _mark_slots(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_mark_slots(value) for value in obj]
+    return obj
+
+
+class Template:
+    """Slot を含むオブジェクトを事前にエンコードし、render(**values) で値を差し込んだ bytes を返す
+
+        CHUNK = Template({"object": "chat.completion.chunk", "delta": {"content": Slot("content")}})
+        CHUNK.render(content="こんにちは")
+    """
+
+    def __init__(self, obj, prefix=b"", suffix=b""):
+        encoded = dumps(_mark_slots(obj))
+        pieces = encoded.split(f'"{_MARK}'.encode('utf-8'))
+        self.parts = [prefix + pieces[0]]
+        self.names = []
+        for piece in pieces[1:]:
+            name, _, rest = piece.partition(f'{_MARK}"'.encode('utf-8'))
+            self.names.append(name.decode('utf-8'))
+            self.parts.append(rest)
+        self.parts[-1] += suffix
+
+    def bind(self, **values):
+        """一部の Slot に値を入れた新しい Template を返す（ストリーム毎に固定の id など）"""
+        template = Template.__new__(Template)
+        template.parts = [self.parts[0]]
+        template.names = []
+        for name, part in zip(self.names, self.parts[1:]):
+            if name in values:
+                template.parts[-1] += dumps(values[name]) + part
+            else:
+                template.names.append(name)
+                template.parts.append(part)
+        return template
+
+    def render(self, **values):
+        parts = self.parts
+        out = [parts[0]]
+        for name, part in zip(self.names, parts[1:]):
+            out.append(dumps(values[name]))
+            out.append(part)
+        return b"".join(out)
@@ -0,0 +1,136 @@
+"""
+SIGTERM でのグレースフルな停止（drain）と、SO_REUSEPORT による同じポートの引き継ぎ
+
+drain の流れ（proven_api.py / api_server.py 共通）:
+1. SIGTERM を受けると DRAIN.draining がセットされ、/health が 503 {"status": "draining"} を返す。
+   応答には Connection: close を付け、keep-alive の接続を切り替えさせる
+2. grace 秒の間は接続を受け付け続ける（ALB が /health の失敗でターゲットを外すまでの猶予）
+3. リッスンソケットを閉じ、処理中のリクエストが終わるのを最大 timeout 秒待って終了する
+
+引き継ぎ: reuse_port_socket() は SO_REUSEPORT でリッスンするので、古いプロセスが動いたまま新しいプロセスが
+同じポートで起動できます。さらに SO_REUSEPORT のグループに「後から参加したソケットを選ぶ」BPF プログラムを
+付けるので、新しい接続はすべて新しいプロセスに届き、古いプロセスのキューには新しい接続が溜まりません
+（キューに残った接続は、ソケットを閉じたときにカーネルがリセットする）。手順は
+新しいプロセスを起動 → /health が 200 になるのを待つ → 古いプロセスに SIGTERM。
+
+DRAIN はプロセスに1つのモジュール変数です（uvicorn のワーカーのように __main__ とアプリのモジュールが
+別々に読み込まれても、このモジュールは1回しか読み込まれない）。
+"""
+
+import contextlib
+import ctypes
+import select
+import signal
+import socket
+import struct
+import threading
+import time
+
+# linux/asm-generic/socket.h
+SO_ATTACH_REUSEPORT_CBPF = 51
+# BPF_RET | BPF_K: 定数（グループ内のソケットの番号）を返す
+BPF_RET_K = 0x06
+
+
+class Drain:
+    """draining の状態と、処理中のリクエスト数"""
+
+    def __init__(self):
+        self.draining = threading.Event()
+        self._active = 0
+        self._changed = threading.Condition()
+
+    @property
+    def active(self):
+        return self._active
+
+    def start(self):
+        self.draining.set()
+
+    @contextlib.contextmanager
+    def request(self):
+        """1リクエストの処理中であることを記録する"""
+        with self._changed:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._active -= 1
+                self._changed.notify_all()
+
+    def wait_idle(self, timeout, settle=0.1):
+        """処理中のリクエストがない状態が settle 秒続くまで、最大 timeout 秒待つ。待ち切れなければ False
+
+        受け付けた直後でまだ request() に入っていない接続を取りこぼさないよう、settle 秒の間を置いて確かめる。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._changed:
+                while self._active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._changed.wait(remaining)
+            time.sleep(min(settle, max(0.0, deadline - time.monotonic())))
+            if not self._active:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
+
+DRAIN = Drain()
+
+
+def steer_to_newest(sock):
+    """SO_REUSEPORT のグループの新しい接続を、sock（最後に参加したソケット）に振り分ける
+
+    グループ内の番号は参加順で、閉じたソケットの番号は詰められる。古いプロセスが1つ残っている間は sock が 1 番で、
+    古いプロセスが終了すると番号 1 は範囲外になり、カーネルは通常のハッシュでの振り分けに戻る。
+    Linux 以外や BPF を使えない環境では False（振り分けはカーネルのハッシュのまま）。
+    """
+    code = (ctypes.c_ubyte * 8).from_buffer_copy(struct.pack('HBBI', BPF_RET_K, 0, 0, 1))
+    program = struct.pack('@HP', 1, ctypes.addressof(code))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, program)
+    except OSError:
+        return False
+    return True
+
+
+def reuse_port_socket(host, port, backlog=1024):
+    """SO_REUSEPORT でリッスンし、新しい接続を自分に振り分けるソケット"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    # BPF はグループに参加した（listen した）後に付ける
+    steer_to_newest(sock)
+    return sock
+
+
+def serve_until_drained(server, grace, timeout, drain=DRAIN):
+    """socketserver のサーバーを SIGTERM まで動かし、drain してから戻る（メインスレッドから呼ぶ）
+
+    戻り値は処理中のリクエストが timeout 秒以内に終わったか。
+    """
+
+    def on_sigterm(signum, frame):
+        if drain.draining.is_set():
+            return
+        drain.start()
+        # shutdown() は serve_forever() の終了を待つので、シグナルハンドラー（同じスレッド）からは呼べない
+        threading.Timer(grace, server.shutdown).start()
+
+    previous = signal.signal(signal.SIGTERM, on_sigterm)
+    try:
+        server.serve_forever()
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    # キューに残っている接続を受け付けてから閉じる
+    server.timeout = 0
+    while select.select([server.socket], [], [], 0)[0]:
+        server.handle_request()
+    server.server_close()
+    return drain.wait_idle(timeout)
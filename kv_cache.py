@@ -0,0 +1,80 @@
+"""
+past_key_values（KVキャッシュ）操作の共通処理
+
+transformers のバージョンによって Cache オブジェクトの内部構造が異なるため、
+レイヤー毎の (key, value) テンソルのリストとの相互変換をここにまとめます。
+テンソルの形状は (batch, heads, seq_len, head_dim)。
+"""
+
+import torch
+from transformers import DynamicCache
+
+
+def cache_layers(cache):
+    """Cache オブジェクト（または旧形式のタプル）を [(key, value), ...] に変換する"""
+    if hasattr(cache, 'layers'):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, 'key_cache'):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(layer[0], layer[1]) for layer in cache]
+
+
+def make_cache(layers):
+    """[(key, value), ...] から model.forward に渡せる DynamicCache を作る"""
+    if hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(layers)
+
+
+def left_pad(layers, length):
+    """シーケンス長が length になるよう KV の左側をゼロで埋める"""
+    padded = []
+    for key, value in layers:
+        pad = length - key.shape[2]
+        if pad > 0:
+            key = torch.nn.functional.pad(key, (0, 0, pad, 0))
+            value = torch.nn.functional.pad(value, (0, 0, pad, 0))
+        padded.append((key, value))
+    return padded
+
+
+def select_rows(layers, rows, start=0):
+    """バッチの行 rows だけを取り出す（start より前の列は捨てる）"""
+    return [(key[rows, :, start:], value[rows, :, start:]) for key, value in layers]
+
+
+def expand_rows(layers, n):
+    """1行の KV を n 行に複製する（コピーしないビュー。次の forward で連結する際に各行の実体ができる）"""
+    return [(key.expand(n, -1, -1, -1), value.expand(n, -1, -1, -1)) for key, value in layers]
+
+
+def shared_prefill(model, input_ids, n, prefix=None):
+    """input_ids (1, seq_len) の最後のトークンの手前までを1回だけプリフィルし、n 行で共有する DynamicCache を返す
+
+    prefix（一致したプレフィックスの KV）を渡すとその続きだけを処理する。
+    最後のトークンは model.generate が処理する（プリフィルするトークンがなければ prefix のまま）。
+    """
+    layers = prefix
+    matched = prefix[0][0].shape[2] if prefix is not None else 0
+    if matched < input_ids.shape[1] - 1:
+        with torch.no_grad():
+            outputs = model(
+                input_ids=input_ids[:, matched:-1],
+                past_key_values=make_cache(prefix) if prefix is not None else None,
+                use_cache=True
+            )
+        layers = cache_layers(outputs.past_key_values)
+    return make_cache(expand_rows(layers, n)) if layers is not None else None
+
+
+def concat_rows(first, second):
+    """2つのバッチ（同じシーケンス長）を行方向に連結する"""
+    return [
+        (torch.cat([k1, k2]), torch.cat([v1, v2]))
+        for (k1, v1), (k2, v2) in zip(first, second)
+    ]
+
+
+def layers_nbytes(layers):
+    """KV テンソルが占めるバイト数"""
+    return sum(key.nbytes + value.nbytes for key, value in layers)
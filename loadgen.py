@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+OpenAI 互換エンドポイントの負荷生成・ベンチマーク CLI
+
+asyncio と keep-alive の接続プールで任意のエンドポイント（ALB・各インスタンス・ローカルの proven_api.py）に
+リクエストを送り、負荷レベル毎に以下を計測します。
+
+- open-loop（--rates）: 一定の到着レート（req/s、ポアソン到着）で送信する。
+  レイテンシは予定した送信時刻から計測するため、サーバーが詰まった時の待ちも含まれる
+- closed-loop（--concurrency）: 一定の同時実行数で、応答が返るたびに次を送信する
+
+p50/p90/p99 レイテンシ、TTFT（--stream）、tokens/sec、エラー率を表示し、
+スループットが頭打ちになる、または SLO を超える最初のレベルを飽和点として報告します。
+結果は JSON で保存でき、--baseline で過去の結果と比較して性能の劣化を検出できます。
+
+例:
+    python3 loadgen.py --url http://localhost:8000 --concurrency 1,4,16 --duration 10
+    python3 loadgen.py --url http://localhost:8000 --rates 1,2,4,8 --stream --json run.json
+    python3 loadgen.py --url http://localhost:8000 --concurrency 16 --baseline run.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import ssl
+import sys
+import time
+import urllib.parse
+
+# スループットの伸びがこの割合を下回ったら飽和とみなす
+SATURATION_GAIN = 0.1
+DEFAULT_SYSTEM_PROMPT = "あなたは博識で論理的思考力に優れた日本語AIアシスタントです。"
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body=b''):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.body = body
+
+
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    """HTTP/1.1 keep-alive 接続のプール（同時に使う接続は size まで）"""
+
+    def __init__(self, url, size=64, timeout=120):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(size)
+        self.opened = 0
+
+    async def _acquire(self):
+        await self.semaphore.acquire()
+        if self.idle:
+            return self.idle.pop()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        except BaseException:
+            self.semaphore.release()
+            raise
+        self.opened += 1
+        return Connection(reader, writer)
+
+    def _release(self, connection, reusable):
+        if reusable:
+            self.idle.append(connection)
+        else:
+            connection.close()
+        self.semaphore.release()
+
+    async def request(self, method, path, body=None, on_chunk=None):
+        """リクエストを送り (ステータス, ボディ) を返す
+
+        on_chunk を渡すとボディを受信した順に on_chunk(bytes) を呼ぶ（ストリーミング用、戻り値のボディは空）。
+        """
+        connection = await self._acquire()
+        reusable = False
+        try:
+            reusable, status, data = await asyncio.wait_for(
+                self._exchange(connection, method, path, body, on_chunk), self.timeout
+            )
+            return status, data
+        finally:
+            self._release(connection, reusable)
+
+    async def _exchange(self, connection, method, path, body, on_chunk):
+        head = [f"{method} {self.base_path}{path} HTTP/1.1", f"Host: {self.host}", "Connection: keep-alive"]
+        if body is not None:
+            head += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        connection.writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + (body or b''))
+        await connection.writer.drain()
+
+        reader = connection.reader
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        version, status = status_line.split()[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        chunks = []
+        emit = on_chunk or chunks.append
+        keep_alive = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                emit(await reader.readexactly(size))
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length:
+                emit(await reader.readexactly(length))
+        else:
+            # 長さの指定がない応答は接続が閉じるまでがボディ
+            keep_alive = False
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                emit(data)
+        return keep_alive, int(status), b''.join(chunks)
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+
+def default_prompts():
+    """test_japanese_complex.py の日本語質問セット"""
+    from test_japanese_complex import COMPLEX_QUESTIONS
+    return [question["question"] for question in COMPLEX_QUESTIONS]
+
+
+def load_prompts(path):
+    """1行1プロンプトのテキスト、または {"prompt": ...} / {"messages": [...]} の JSONL"""
+    prompts = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                prompts.append(record.get("messages") or record["prompt"])
+            else:
+                prompts.append(line)
+    return prompts
+
+
+def build_payload(prompt, model, max_tokens, stream, temperature=0.7):
+    messages = prompt if isinstance(prompt, list) else [
+        {"role": "system", "content": DEFAULT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+    return {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": stream,
+    }
+
+
+async def send_chat(pool, payload, scheduled=None, keep_text=False):
+    """チャット補完を1件送り、計測結果の dict を返す（例外は error に記録）
+
+    scheduled（loop.time() 基準の予定送信時刻）を渡すとレイテンシをそこから計測する。
+    """
+    loop = asyncio.get_running_loop()
+    start = scheduled if scheduled is not None else loop.time()
+    result = {"ok": False, "latency": None, "ttft": None, "completion_tokens": 0, "error": None}
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    pieces = []
+
+    try:
+        if payload.get("stream"):
+            buffer = bytearray()
+
+            def on_chunk(data):
+                # SSE の data 行毎に処理する
+                buffer.extend(data)
+                while b'\n' in buffer:
+                    index = buffer.index(b'\n')
+                    line = bytes(buffer[:index]).strip()
+                    del buffer[:index + 1]
+                    if not line.startswith(b'data:') or line[5:].strip() == b'[DONE]':
+                        continue
+                    event = json.loads(line[5:])
+                    for choice in event.get("choices", []):
+                        content = choice.get("delta", {}).get("content")
+                        if content:
+                            if result["ttft"] is None:
+                                result["ttft"] = loop.time() - start
+                            result["completion_tokens"] += 1
+                            if keep_text:
+                                pieces.append(content)
+                    if event.get("usage"):
+                        result["completion_tokens"] = event["usage"].get("completion_tokens", 0)
+
+            status, data = await pool.request('POST', '/v1/chat/completions', body, on_chunk)
+        else:
+            status, data = await pool.request('POST', '/v1/chat/completions', body)
+        if status != 200:
+            raise HTTPError(status, data)
+
+        if not payload.get("stream"):
+            response = json.loads(data)
+            result["completion_tokens"] = response.get("usage", {}).get("completion_tokens", 0)
+            if keep_text:
+                pieces.append(response["choices"][0]["message"]["content"])
+            result["usage"] = response.get("usage", {})
+        result["ok"] = True
+    except HTTPError as e:
+        result["error"] = f"http_{e.status}"
+    except asyncio.TimeoutError:
+        result["error"] = "timeout"
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+        result["error"] = type(e).__name__
+
+    result["latency"] = loop.time() - start
+    if keep_text:
+        result["text"] = "".join(pieces)
+    return result
+
+
+async def run_closed_loop(pool, payloads, concurrency, duration):
+    """concurrency 個のワーカーが応答を受け取るたびに次のリクエストを送る"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    results = []
+
+    async def worker(index):
+        i = index
+        while loop.time() < deadline:
+            results.append(await send_chat(pool, payloads[i % len(payloads)]))
+            i += concurrency
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return results
+
+
+async def run_open_loop(pool, payloads, rate, duration, seed=0):
+    """平均 rate req/s のポアソン到着でリクエストを送る（応答を待たずに次を送る）"""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    start = loop.time()
+    scheduled = start
+    tasks = []
+    i = 0
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send_chat(pool, payloads[i % len(payloads)], scheduled)))
+        i += 1
+    return await asyncio.gather(*tasks)
+
+
+async def run_batch(url, payloads, concurrency, timeout=120, keep_text=True):
+    """payloads を同時実行数 concurrency で1回ずつ送り、結果を送信順に返す（テストスクリプト用）"""
+    pool = ConnectionPool(url, size=concurrency, timeout=timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(payload):
+        # 順番待ちの時間はレイテンシに含めない
+        async with semaphore:
+            return await send_chat(pool, payload, keep_text=keep_text)
+
+    try:
+        return await asyncio.gather(*(send(payload) for payload in payloads))
+    finally:
+        pool.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(results, elapsed):
+    """結果のリストを集計する（時間は ms）"""
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    tokens = sum(r["completion_tokens"] for r in ok)
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    def ms(value):
+        return value * 1000 if value is not None else None
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "tokens_per_sec": tokens / elapsed if elapsed else 0.0,
+        "latency_ms": {f"p{p}": ms(percentile(latencies, p)) for p in (50, 90, 99)},
+        "ttft_ms": {f"p{p}": ms(percentile(ttfts, p)) for p in (50, 90, 99)},
+    }
+
+
+def find_saturation(levels, mode, slo_p99_ms=None, max_error_rate=0.01):
+    """飽和点（最初に限界を超えた負荷レベル）と理由を返す。なければ None"""
+    previous = None
+    for level in levels:
+        reason = None
+        p99 = level["latency_ms"]["p99"]
+        if level["error_rate"] > max_error_rate:
+            reason = f"error rate {level['error_rate'] * 100:.1f}%"
+        elif slo_p99_ms is not None and p99 is not None and p99 > slo_p99_ms:
+            reason = f"p99 {p99:.0f}ms > SLO {slo_p99_ms:.0f}ms"
+        elif mode == 'open' and level["throughput_rps"] < level["offered_rps"] * 0.9:
+            reason = f"throughput {level['throughput_rps']:.1f} < offered {level['offered_rps']:.1f} req/s"
+        elif (mode == 'closed' and previous is not None
+              and level["throughput_rps"] < previous["throughput_rps"] * (1 + SATURATION_GAIN)):
+            reason = f"throughput gain < {SATURATION_GAIN * 100:.0f}% over concurrency {previous['load']}"
+        if reason:
+            return {"load": level["load"], "reason": reason}
+        previous = level
+    return None
+
+
+def compare(current, baseline, max_regression):
+    """同じ負荷レベル同士で p99 とスループットを比較し、劣化したレベルのリストを返す"""
+    baseline_levels = {level["load"]: level for level in baseline["levels"]}
+    regressions = []
+    print(f"\n=== ベースラインとの比較（許容 {max_regression:.0f}%）===")
+    for level in current["levels"]:
+        base = baseline_levels.get(level["load"])
+        if base is None:
+            continue
+        rps_change = (level["throughput_rps"] - base["throughput_rps"]) / base["throughput_rps"] * 100 \
+            if base["throughput_rps"] else 0.0
+        p99, base_p99 = level["latency_ms"]["p99"], base["latency_ms"]["p99"]
+        p99_change = (p99 - base_p99) / base_p99 * 100 if p99 is not None and base_p99 else 0.0
+        regressed = rps_change < -max_regression or p99_change > max_regression
+        mark = "❌" if regressed else "✅"
+        print(f"{mark} load {level['load']}: req/s {rps_change:+.1f}%  p99 {p99_change:+.1f}%")
+        if regressed:
+            regressions.append(level["load"])
+    return regressions
+
+
+def format_ms(value):
+    return f"{value:.0f}" if value is not None else "-"
+
+
+async def run(args):
+    prompts = load_prompts(args.prompts) if args.prompts else default_prompts()
+    payloads = [build_payload(p, args.model, args.max_tokens, args.stream, args.temperature) for p in prompts]
+    mode = 'open' if args.rates else 'closed'
+    loads = [float(r) for r in args.rates.split(',')] if args.rates else \
+        [int(c) for c in args.concurrency.split(',')]
+
+    print(f"=== 負荷テスト: {args.url} ===")
+    print(f"モード: {mode}-loop  各レベル {args.duration}秒  max_tokens: {args.max_tokens}  stream: {args.stream}")
+    print(f"{'load':>6} {'req':>6} {'err%':>6} {'req/s':>8} {'tok/s':>8} "
+          f"{'p50':>7} {'p90':>7} {'p99':>7} {'ttft50':>7} {'ttft99':>7}")
+
+    levels = []
+    for load in loads:
+        pool = ConnectionPool(args.url, size=args.max_connections if mode == 'open' else load,
+                              timeout=args.timeout)
+        started = time.perf_counter()
+        if mode == 'open':
+            results = await run_open_loop(pool, payloads, load, args.duration, seed=args.seed)
+        else:
+            results = await run_closed_loop(pool, payloads, load, args.duration)
+        elapsed = time.perf_counter() - started
+        pool.close()
+
+        level = summarize(results, elapsed)
+        # open-loop は実際に送信したレート（ポアソン到着なので設定値からぶれる）
+        level.update({"load": load, "offered_rps": len(results) / args.duration, "connections_opened": pool.opened})
+        levels.append(level)
+        latency, ttft = level["latency_ms"], level["ttft_ms"]
+        print(f"{load:>6} {level['requests']:>6} {level['error_rate'] * 100:>6.1f} "
+              f"{level['throughput_rps']:>8.2f} {level['tokens_per_sec']:>8.1f} "
+              f"{format_ms(latency['p50']):>7} {format_ms(latency['p90']):>7} {format_ms(latency['p99']):>7} "
+              f"{format_ms(ttft['p50']):>7} {format_ms(ttft['p99']):>7}")
+
+    saturation = find_saturation(levels, mode, args.slo_p99_ms, args.max_error_rate)
+    if saturation:
+        print(f"\n飽和点: load {saturation['load']}（{saturation['reason']}）")
+    else:
+        print("\n飽和点: 計測した範囲では飽和していません")
+
+    return {
+        "url": args.url,
+        "mode": mode,
+        "duration": args.duration,
+        "max_tokens": args.max_tokens,
+        "stream": args.stream,
+        "timestamp": int(time.time()),
+        "levels": levels,
+        "saturation": saturation,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 互換エンドポイントの負荷生成・ベンチマーク")
+    parser.add_argument('--url', default='http://localhost:8000', help="エンドポイントのベース URL")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', default='1,4,16', help="closed-loop の同時実行数（カンマ区切り）")
+    load.add_argument('--rates', help="open-loop の到着レート req/s（カンマ区切り）")
+    parser.add_argument('--duration', type=float, default=10.0, help="各負荷レベルの時間（秒）")
+    parser.add_argument('--max-tokens', type=int, default=128)
+    parser.add_argument('--temperature', type=float, default=0.7)
+    parser.add_argument('--model', default='jan-nano-4b-q8')
+    parser.add_argument('--stream', action='store_true', help="SSE で受信し TTFT を計測する")
+    parser.add_argument('--prompts', help="プロンプトファイル（テキストまたは JSONL）。省略時は日本語質問セット")
+    parser.add_argument('--max-connections', type=int, default=256, help="open-loop の最大同時接続数")
+    parser.add_argument('--timeout', type=float, default=120.0, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument('--slo-p99-ms', type=float, help="p99 レイテンシの SLO（飽和点の判定に使う）")
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0, help="open-loop の到着間隔の乱数シード")
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    parser.add_argument('--baseline', help="比較するベースラインの JSON ファイル")
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help="ベースラインからの劣化の許容（%%）。超えると終了コード 1")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n結果を保存しました: {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+safetensors チェックポイントの mmap 読み込み
+
+重みをファイルからコピーせず、mmap したページをそのままテンソルとして使います。
+- 読み込み時間はヘッダーの解析とモデル構造の作成だけになる
+- 重みはページキャッシュ（ファイル由来のメモリ）に載り、匿名メモリを消費しない
+- 同じファイルを読む複数プロセスで物理メモリを共有できる
+
+チェックポイントの dtype のまま読み込みます。別の dtype を指定すると変換のためにコピーが発生します。
+"""
+
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+
+import torch
+from torch import nn
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def checkpoint_files(model_path):
+    """モデルディレクトリの safetensors ファイル一覧（分割チェックポイントにも対応）。なければ空"""
+    index_path = os.path.join(model_path, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(model_path, name) for name in sorted(set(weight_map.values()))]
+
+    single = os.path.join(model_path, "model.safetensors")
+    return [single] if os.path.exists(single) else []
+
+
+def mmap_safetensors(path):
+    """safetensors ファイルを mmap し、{名前: テンソル} を返す（データはコピーしない）
+
+    ACCESS_COPY（プライベートマッピング）なので、テンソルへ書き込んでもファイルは変わらない。
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    header_size = struct.unpack("<Q", buffer[:8])[0]
+    header = json.loads(buffer[8:8 + header_size])
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES.get(info["dtype"])
+        if dtype is None:
+            raise ValueError(f"未対応の dtype です: {info['dtype']} ({name})")
+        start, end = info["data_offsets"]
+        if end > start:
+            tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - start) // dtype.itemsize,
+                                      offset=data_start + start)
+        else:
+            tensor = torch.empty(0, dtype=dtype)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+@contextmanager
+def empty_parameters():
+    """この中で作成したモジュールのパラメーターを meta デバイスに置く（重みの確保と初期化を省略）
+
+    バッファー（RoPE の inv_freq など）は通常通り CPU に作成する。
+    """
+    register_parameter = nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            module._parameters[name] = type(param)(param.to("meta"), requires_grad=param.requires_grad)
+
+    nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
+
+def load_mmap_model(model_path, dtype=None):
+    """safetensors の重みを mmap したまま AutoModelForCausalLM を作成する（eval モード）
+
+    dtype を省略するとチェックポイントの dtype をそのまま使う（コピーなし）。
+    safetensors がない場合は FileNotFoundError。
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    files = checkpoint_files(model_path)
+    if not files:
+        raise FileNotFoundError(f"safetensors の重みが見つかりません: {model_path}")
+
+    state_dict = {}
+    for path in files:
+        state_dict.update(mmap_safetensors(path))
+
+    if dtype is None:
+        dtype = next(t.dtype for t in state_dict.values() if t.is_floating_point())
+    state_dict = {
+        name: t.to(dtype) if t.is_floating_point() and t.dtype != dtype else t
+        for name, t in state_dict.items()
+    }
+
+    config = AutoConfig.from_pretrained(model_path)
+    with empty_parameters():
+        model = AutoModelForCausalLM.from_config(config, dtype=dtype)
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"チェックポイントに含まれない重みがあります: {', '.join(missing[:5])}")
+    return model.eval()
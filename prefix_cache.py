@@ -0,0 +1,172 @@
+"""
+プレフィックスKVキャッシュ
+
+過去のリクエストの past_key_values をトークンIDのラディックス木に保存し、
+新しいプロンプトと先頭が一致する部分のプリフィルを省略します。
+共通のシステムプロンプトや、履歴を毎回送り直すマルチターン会話で効果があります。
+
+木の各エッジは自分のトークン区間の KV だけを持つので、共通部分は重複しません。
+メモリ上限を超えると、最も長く使われていない葉から削除します（LRU）。
+"""
+
+import threading
+import time
+
+import torch
+
+from kv_cache import layers_nbytes
+
+
+class _Node:
+    __slots__ = ('tokens', 'layers', 'children', 'parent', 'last_access')
+
+    def __init__(self, tokens=(), layers=None, parent=None):
+        self.tokens = tokens
+        self.layers = layers
+        self.children = {}
+        self.parent = parent
+        self.last_access = time.monotonic()
+
+
+def _slice(layers, start, end=None):
+    # 元テンソル全体を保持し続けないよう clone する
+    return [(key[:, :, start:end].clone(), value[:, :, start:end].clone()) for key, value in layers]
+
+
+def _common_length(a, b):
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+class PrefixCache:
+    """トークンIDのプレフィックスをキーに KV を再利用するラディックス木キャッシュ"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.root = _Node()
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+        # メトリクス
+        self.lookups = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.saved_tokens = 0
+        self.evictions = 0
+
+    def match(self, token_ids):
+        """token_ids と先頭が一致する最長のキャッシュを探す
+
+        戻り値は (一致したトークン数, [(key, value), ...])。一致しなければ (0, None)。
+        プリフィルで最後のトークンの logits が必要なため、一致は最大 len(token_ids) - 1。
+        """
+        token_ids = tuple(token_ids)
+        limit = len(token_ids) - 1
+        segments = []
+        matched = 0
+
+        with self._lock:
+            node = self.root
+            now = time.monotonic()
+            while matched < limit:
+                child = node.children.get(token_ids[matched])
+                if child is None:
+                    break
+                length = min(_common_length(child.tokens, token_ids[matched:]), limit - matched)
+                child.last_access = now
+                segments.append(child.layers if length == len(child.tokens) else
+                                [(k[:, :, :length], v[:, :, :length]) for k, v in child.layers])
+                matched += length
+                if length < len(child.tokens):
+                    break
+                node = child
+
+            self.lookups += 1
+            self.prompt_tokens += len(token_ids)
+            if matched:
+                self.hits += 1
+                self.saved_tokens += matched
+
+        if not matched:
+            return 0, None
+        layers = [
+            (torch.cat([segment[i][0] for segment in segments], dim=2),
+             torch.cat([segment[i][1] for segment in segments], dim=2))
+            for i in range(len(segments[0]))
+        ]
+        return matched, layers
+
+    def insert(self, token_ids, layers):
+        """token_ids 全体に対応する KV（バッチサイズ1）を保存する"""
+        token_ids = tuple(token_ids)
+        position = 0
+
+        with self._lock:
+            node = self.root
+            now = time.monotonic()
+            while position < len(token_ids):
+                child = node.children.get(token_ids[position])
+                if child is None:
+                    leaf = _Node(token_ids[position:], _slice(layers, position), node)
+                    node.children[token_ids[position]] = leaf
+                    self.nbytes += layers_nbytes(leaf.layers)
+                    break
+
+                length = _common_length(child.tokens, token_ids[position:])
+                if length < len(child.tokens):
+                    child = self._split(child, length)
+                child.last_access = now
+                position += length
+                node = child
+
+            self._evict()
+
+    def _split(self, node, length):
+        """エッジを length の位置で分割し、前半を新しい中間ノードにする"""
+        parent = node.parent
+        middle = _Node(node.tokens[:length], _slice(node.layers, 0, length), parent)
+        middle.last_access = node.last_access
+        parent.children[node.tokens[0]] = middle
+
+        rest_layers = _slice(node.layers, length)
+        self.nbytes += layers_nbytes(middle.layers) + layers_nbytes(rest_layers) - layers_nbytes(node.layers)
+        node.tokens = node.tokens[length:]
+        node.layers = rest_layers
+        node.parent = middle
+        middle.children[node.tokens[0]] = node
+        return middle
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            leaves = []
+            stack = list(self.root.children.values())
+            while stack:
+                node = stack.pop()
+                if node.children:
+                    stack.extend(node.children.values())
+                else:
+                    leaves.append(node)
+            if not leaves:
+                break
+
+            oldest = min(leaves, key=lambda n: n.last_access)
+            del oldest.parent.children[oldest.tokens[0]]
+            self.nbytes -= layers_nbytes(oldest.layers)
+            self.evictions += 1
+
+    def stats(self):
+        """ヒット率と省略できたプリフィルトークン数"""
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "prefill_tokens_saved": self.saved_tokens,
+            "saved_ratio": self.saved_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
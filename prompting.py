@@ -0,0 +1,207 @@
+"""
+プロンプト構築とトークン数の計算
+api_server.py と proven_api.py で共通利用します
+
+- トークナイザーの chat template でプロンプトを組み立てる（なければ従来の "User: ..." 形式）
+- メッセージ単位のトークン化結果をキャッシュし、履歴を送り直すマルチターン会話で再利用する
+- usage は実際のトークンIDの数から計算する
+"""
+
+import hashlib
+import itertools
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+# chat template がないトークナイザー用の従来形式
+LEGACY_ROLE_PREFIX = {
+    "system": "System",
+    "user": "User",
+    "assistant": "Assistant",
+}
+
+
+class FallbackTokenizer:
+    """トークナイザーを読み込まないスタブサーバー用の近似トークナイザー
+
+    日本語（かな・漢字）は1文字、英数字は連続した並びを1トークン、記号は1文字で数える。
+    空白区切りの len(text.split()) より実際のトークン数に近い値になる。
+    トークンIDは数を数える目的のみで、デコードはできない。
+    """
+
+    chat_template = None
+    all_special_tokens = []
+    eos_token_id = None
+
+    PATTERN = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+    def encode(self, text, add_special_tokens=False):
+        return [zlib.crc32(piece.encode('utf-8')) for piece in self.PATTERN.findall(text)]
+
+
+def load_tokenizer(path=None):
+    """path のトークナイザーを読み込む。指定がなければ FallbackTokenizer"""
+    if not path:
+        return FallbackTokenizer()
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(path)
+
+
+def message_dicts(messages):
+    """pydantic モデルや dict のメッセージを {"role", "content"} の dict に揃える"""
+    return [
+        {"role": m["role"], "content": m["content"]} if isinstance(m, dict)
+        else {"role": m.role, "content": m.content}
+        for m in messages
+    ]
+
+
+def prefix_key(messages):
+    """プロンプトの共通プレフィックスを表すキー（router.py のアフィニティ用）
+
+    先頭の system メッセージの内容。system がなければ最初のメッセージの内容
+    （同じ会話の続きは同じキーになる）。メッセージがなければ None。
+    """
+    messages = message_dicts(messages)
+    system = [m["content"] for m in itertools.takewhile(lambda m: m["role"] == "system", messages)]
+    if system:
+        return "\n".join(system)
+    return messages[0]["content"] if messages else None
+
+
+def usage(prompt_tokens, completion_tokens):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+class PromptBuilder:
+    """メッセージ列をトークンIDに変換する（トークン化結果を LRU でキャッシュ）"""
+
+    def __init__(self, tokenizer, cache_size=4096):
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # メッセージ列のプレフィックス（のハッシュ） -> その最後のメッセージの区間
+        self._segment_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.special_tokens = tuple(getattr(tokenizer, 'all_special_tokens', []) or [])
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, messages, add_generation_prompt=True):
+        """プロンプト文字列を組み立てる"""
+        messages = message_dicts(messages)
+        if getattr(self.tokenizer, 'chat_template', None):
+            return self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=add_generation_prompt
+            )
+
+        parts = [
+            f"{LEGACY_ROLE_PREFIX[m['role']]}: {m['content']}\n"
+            for m in messages if m['role'] in LEGACY_ROLE_PREFIX
+        ]
+        if add_generation_prompt:
+            parts.append("Assistant: ")
+        return "".join(parts)
+
+    def encode(self, messages):
+        """メッセージ列をプロンプトのトークンIDのリストにする"""
+        messages = message_dicts(messages)
+        if not getattr(self.tokenizer, 'chat_template', None):
+            # 従来形式は tokenizer(conversation) と同じく BOS などを付ける
+            return list(self._encode_text(self.render(messages), add_special_tokens=True))
+
+        segments = self._segments(messages)
+        if segments is None:
+            return list(self._encode_text(self.render(messages)))
+
+        ids = []
+        for segment in segments:
+            ids.extend(self._encode_text(segment))
+        return ids
+
+    def count(self, text):
+        """テキストのトークン数"""
+        return len(self._encode_text(text))
+
+    def _segments(self, messages):
+        """プロンプトをメッセージ毎の区間に分ける。区間毎にトークン化して結果が変わらない場合のみ
+
+        chat template の区間が特殊トークン（例: <|im_start|>）で始まれば、
+        特殊トークンの前後はトークナイザーが独立に処理するので連結しても同じIDになる。
+        区間はメッセージ列のプレフィックス毎にキャッシュするので、履歴を送り直すマルチターン会話では
+        chat template を描画するのは新しいメッセージの分と、生成プロンプトを付けた全体の1回だけになる。
+        """
+        if not self.special_tokens:
+            return None
+
+        segments = []
+        keys = []
+        previous = None
+        key = b""
+        for end, message in enumerate(messages, 1):
+            key = hashlib.blake2b(key + message["role"].encode('utf-8') + b"\0"
+                                  + message["content"].encode('utf-8'), digest_size=16).digest()
+            with self._lock:
+                segment = self._segment_cache.get(key)
+                if segment is not None:
+                    self._segment_cache.move_to_end(key)
+            if segment is None:
+                if previous is None:
+                    previous = "".join(segments)
+                text = self.render(messages[:end], add_generation_prompt=False)
+                if not text.startswith(previous):
+                    return None
+                segment = text[len(previous):]
+                if end > 1 and segment and not segment.startswith(self.special_tokens):
+                    return None
+                previous = text
+                keys.append((key, segment))
+            segments.append(segment)
+
+        if previous is None:
+            previous = "".join(segments)
+        full = self.render(messages)
+        if not full.startswith(previous):
+            return None
+        tail = full[len(previous):]
+        if tail and not tail.startswith(self.special_tokens):
+            return None
+        segments.append(tail)
+
+        with self._lock:
+            for key, segment in keys:
+                self._segment_cache[key] = segment
+            while len(self._segment_cache) > self.cache_size:
+                self._segment_cache.popitem(last=False)
+        return [segment for segment in segments if segment]
+
+    def _encode_text(self, text, add_special_tokens=False):
+        key = (text, add_special_tokens)
+        with self._lock:
+            ids = self._cache.get(key)
+            if ids is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return ids
+            self.misses += 1
+
+        ids = self.tokenizer.encode(text, add_special_tokens=add_special_tokens)
+        with self._lock:
+            self._cache[key] = ids
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ids
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._cache),
+        }
@@ -1,120 +1,680 @@
 #!/usr/bin/env python3
 """
 確実に動作するJan Nano API サーバー
+
+起動モード (--mode):
+  single  - 従来の HTTPServer。1接続ずつ処理し、レスポンス毎に接続を閉じる
+  thread  - ThreadingHTTPServer。接続毎にスレッドを割り当て、HTTP/1.1 keep-alive に対応
+  asyncio - asyncio ベースのサーバー。接続はイベントループで保持し、
+            リクエスト処理はワーカースレッドで実行する
+
+thread / asyncio モードでは --workers で同時に処理するリクエスト数を制限する。
+どのモードでもルーティングと応答生成は build_response() を共通で使う。
+
+SIGTERM で drain する（graceful.py）: /health を 503 にし、--drain-grace 秒後に受け付けをやめ、
+処理中のリクエストを最大 --drain-timeout 秒待って終了する。--reuse-port で動作中のプロセスと同じポートで起動できる。
 """
 
-import json
+import argparse
+import asyncio
+import contextlib
+import email.utils
+import os
+import random
+import signal
+import threading
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from fastjson import Slot, Template, dumps, loads
+from graceful import DRAIN, reuse_port_socket, serve_until_drained, steer_to_newest
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, http_metrics
+from prompting import PromptBuilder, load_tokenizer, prefix_key, usage
+from request_limits import (
+    MAX_BODY_BYTES, MAX_MESSAGES, MAX_TOKENS_LIMIT, RequestRejected, body_length, read_body, read_body_async,
+    validate_chat_request,
+)
+from response_cache import ResponseCache, cache_key, is_cacheable
+from sse import SSE_HEADERS, stream_chat_completion
+
+MODEL_ID = "jan-nano-4b-q8"
+
+# チャット応答を返すまでの擬似的な生成時間（秒）。負荷試験用
+RESPONSE_DELAY = 0.0
+
+# 障害の注入（クラスタークライアントの検証用）
+# SLOW_RATE の割合のリクエストに SLOW_DELAY 秒の遅延を加え、FAIL_RATE の割合を 503 で失敗させる
+SLOW_RATE = 0.0
+SLOW_DELAY = 0.0
+FAIL_RATE = 0.0
+
+# 擬似モデルの同時生成数（--model-slots）。None なら制限しない
+MODEL_SLOTS = None
+# 生成待ち・生成中のチャットリクエスト数。X-Queue-Depth ヘッダーで返し、router.py の振り分けに使う
+INFERENCE_LOAD = 0
+_LOAD_LOCK = threading.Lock()
+
+# 擬似プレフィックスKVキャッシュ。キャッシュにないプレフィックス（system プロンプト）は
+# 生成の前に PREFILL_DELAY 秒の prefill がかかる。PREFIX_CACHE_ENTRIES 件まで保持する
+PREFILL_DELAY = 0.0
+PREFIX_CACHE_ENTRIES = 4
+_PREFIX_CACHE = OrderedDict()
+
+# usage のトークン数を数えるプロンプトビルダー。--tokenizer で実際のトークナイザーを使う
+PROMPT_BUILDER = PromptBuilder(load_tokenizer())
+
+# 決定的なリクエスト（temperature == 0 または seed 指定）の応答キャッシュ。--response-cache-mb で有効
+RESPONSE_CACHE = None
+
+# /metrics（Prometheus 形式）。--no-metrics で記録しない（オーバーヘッド計測用）
+METRICS = Registry()
+HTTP_REQUESTS, HTTP_REQUEST_SECONDS = http_metrics(METRICS)
+PREFIX_CACHE_REQUESTS = METRICS.counter(
+    "jan_nano_prefix_cache_requests_total", "Simulated prefix cache lookups", ("result",)
+)
+METRICS_ENABLED = True
+# ルートのラベル。それ以外のパスは "other" にまとめる
+ROUTES = frozenset(['/', '/health', '/metrics', '/v1/models', '/v1/chat/completions'])
+
+CORS_HEADERS = [('Access-Control-Allow-Origin', '*')]
+JSON_HEADERS = [('Content-type', 'application/json')] + CORS_HEADERS
+
+# 内容が変わらない応答は起動時にエンコードしておき、変わる部分だけをテンプレートに差し込む
+SERVER_STARTED = int(time.time())
+# pid は再起動の引き継ぎ（--reuse-port）でどちらのプロセスが応答したかを確かめるのに使う
+HEALTH_BODY = dumps({"status": "healthy", "pid": os.getpid()})
+DRAINING_BODY = dumps({"status": "draining", "pid": os.getpid()})
+MODELS_BODY = dumps({
+    "object": "list",
+    "data": [
+        {
+            "id": MODEL_ID,
+            "object": "model",
+            "created": SERVER_STARTED,
+            "owned_by": "jan-hq"
+        }
+    ]
+})
+ROOT_TEMPLATE = Template({
+    "message": "Jan Nano 4B Q8 API Server",
+    "status": "running",
+    "version": "1.0.0",
+    "timestamp": Slot("timestamp")
+})
+NOT_FOUND_TEMPLATE = Template({"error": "Not found", "path": Slot("path")})
+COMPLETION_TEMPLATE = Template({
+    "id": Slot("id"),
+    "object": "chat.completion",
+    "created": Slot("created"),
+    "model": Slot("model"),
+    "choices": [
+        {
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": Slot("content")
+            },
+            "finish_reason": "stop"
+        }
+    ],
+    "usage": Slot("usage")
+})
+INJECTED_FAILURE_BODY = dumps({"error": "Injected failure"})
+
+
+def handle_get(path):
+    """GETリクエストの応答を組み立てる"""
+    if path == '/health':
+        if DRAIN.draining.is_set():
+            return 503, JSON_HEADERS, DRAINING_BODY
+        return 200, JSON_HEADERS, HEALTH_BODY
+    if path == '/v1/models':
+        return 200, JSON_HEADERS, MODELS_BODY
+    if path == '/':
+        return 200, JSON_HEADERS, ROOT_TEMPLATE.render(timestamp=int(time.time()))
+    return 200, JSON_HEADERS, NOT_FOUND_TEMPLATE.render(path=path)
+
+
+def iter_response_pieces(text, delay=0.0):
+    """応答テキストを1文字ずつ返す（擬似的なトークン生成。delay は全体にかかる秒数）"""
+    per_piece = delay / len(text) if text else 0.0
+    for char in text:
+        if per_piece:
+            time.sleep(per_piece)
+        yield char
+
+
+@contextlib.contextmanager
+def model_slot():
+    """擬似モデルの生成枠を確保する（待っている間も INFERENCE_LOAD に数える）"""
+    global INFERENCE_LOAD
+    with _LOAD_LOCK:
+        INFERENCE_LOAD += 1
+    try:
+        with MODEL_SLOTS or contextlib.nullcontext():
+            yield
+    finally:
+        with _LOAD_LOCK:
+            INFERENCE_LOAD -= 1
+
+
+def prefill_delay(messages):
+    """プレフィックスがキャッシュになければ PREFILL_DELAY を返し、キャッシュに入れる"""
+    if not PREFILL_DELAY:
+        return 0.0
+    key = prefix_key(messages)
+    with _LOAD_LOCK:
+        hit = key in _PREFIX_CACHE
+        if hit:
+            _PREFIX_CACHE.move_to_end(key)
+        else:
+            _PREFIX_CACHE[key] = True
+            if len(_PREFIX_CACHE) > PREFIX_CACHE_ENTRIES:
+                _PREFIX_CACHE.popitem(last=False)
+    PREFIX_CACHE_REQUESTS.inc("hit" if hit else "miss")
+    return 0.0 if hit else PREFILL_DELAY
+
+
+def generate_pieces(text, delay, messages):
+    """生成枠を確保してから prefill と擬似生成を行う（ストリーミング用）"""
+    with model_slot():
+        prefill = prefill_delay(messages)
+        if prefill:
+            time.sleep(prefill)
+        yield from iter_response_pieces(text, delay)
+
+
+def response_delay():
+    """このリクエストの擬似生成時間（SLOW_RATE の割合で SLOW_DELAY を加える）"""
+    if SLOW_RATE and random.random() < SLOW_RATE:
+        return RESPONSE_DELAY + SLOW_DELAY
+    return RESPONSE_DELAY
+
+
+def handle_chat_completions(request_data):
+    """/v1/chat/completions の応答を組み立てる（request_data はデコード済みのリクエスト）"""
+    try:
+        if FAIL_RATE and random.random() < FAIL_RATE:
+            return 503, JSON_HEADERS, INJECTED_FAILURE_BODY
+        delay = response_delay()
+
+        # メッセージを取得
+        messages = request_data.get('messages', [])
+        last_message = messages[-1]['content'] if messages else "Hello"
+
+        # 日本語対応の応答生成
+        responses = [
+            f"こんにちは！{last_message}についてお答えします。Jan Nano 4B Q8モデルが応答しています。",
+            f"ご質問「{last_message}」を承りました。詳細な回答をお作りいたします。",
+            f"{last_message}について考察してみます。このモデルは日本語に対応しています。"
+        ]
+
+        response_text = random.choice(responses)
+
+        # ストリーミング: chat.completion.chunk を SSE で逐次返す
+        if request_data.get('stream'):
+            pieces = generate_pieces(response_text, delay, messages)
+            model = request_data.get('model', MODEL_ID)
+            return 200, SSE_HEADERS + CORS_HEADERS, stream_chat_completion(pieces, model)
+
+        with model_slot():
+            delay += prefill_delay(messages)
+            if delay:
+                time.sleep(delay)
+
+        created = int(time.time())
+        return 200, JSON_HEADERS, COMPLETION_TEMPLATE.render(
+            id=f"chatcmpl-{created}",
+            created=created,
+            model=request_data.get('model', MODEL_ID),
+            content=response_text,
+            usage=usage(len(PROMPT_BUILDER.encode(messages)), PROMPT_BUILDER.count(response_text))
+        )
+
+    except Exception as e:
+        return error_response(e)
+
+
+def error_response(e, status=500):
+    return status, [('Content-type', 'application/json')], dumps({"error": str(e)})
+
+
+def cached_chat_completions(post_data):
+    """応答キャッシュを通して /v1/chat/completions を処理する（X-Cache: HIT|MISS）"""
+    try:
+        request_data = validate_chat_request(loads(post_data), MAX_MESSAGES, MAX_TOKENS_LIMIT)
+    except ValueError as e:
+        return error_response(e, 400)
+    except RequestRejected as e:
+        return error_response(e, e.status)
+    if RESPONSE_CACHE is None or not is_cacheable(request_data):
+        return handle_chat_completions(request_data)
+
+    key = cache_key(request_data)
+    cached = RESPONSE_CACHE.get(key)
+    if cached is not None:
+        return 200, JSON_HEADERS + [('X-Cache', 'HIT')], cached
+
+    status, headers, payload = handle_chat_completions(request_data)
+    if status == 200:
+        RESPONSE_CACHE.put(key, payload)
+    return status, headers + [('X-Cache', 'MISS')], payload
+
+
+def build_response(method, path, body=b''):
+    """メソッドとパスから (ステータスコード, ヘッダーのリスト, ボディ) を返す
+
+    全サーバーモード共通のルーティング。ボディは bytes、
+    ストリーミング応答の場合は bytes を順に返すイテレーター。
+    ルート・ステータス別の件数と処理時間を記録する（ストリーミングは応答開始まで）。
+    全ての応答に X-Queue-Depth（生成待ち・生成中のリクエスト数）を付ける。
+    """
+    if not METRICS_ENABLED:
+        status, headers, response_body = route_request(method, path, body)
+    else:
+        start = time.perf_counter()
+        status, headers, response_body = route_request(method, path, body)
+        route = path if path in ROUTES else 'other'
+        HTTP_REQUESTS.inc(method, route, status)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+    return status, headers + [('X-Queue-Depth', str(INFERENCE_LOAD))], response_body
+
+
+def rejected_response(method, path, e):
+    """ボディを読む前に拒否したリクエストの応答（build_response() と同じく件数を記録する）"""
+    if METRICS_ENABLED:
+        HTTP_REQUESTS.inc(method, path if path in ROUTES else 'other', e.status)
+    return error_response(e, e.status)
+
+
+def route_request(method, path, body):
+    if method == 'GET':
+        if path == '/metrics':
+            return 200, [('Content-type', METRICS_CONTENT_TYPE)], METRICS.render()
+        return handle_get(path)
+    if method == 'POST':
+        if path == '/v1/chat/completions':
+            return cached_chat_completions(body)
+        return 404, [], b''
+    if method == 'OPTIONS':
+        return 200, CORS_HEADERS + [
+            ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+            ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+        ], b''
+    return 405, [], b''
+
+
+class ResponseHeads:
+    """ステータス行とヘッダーのバイト列を (ステータス, ヘッダー, Content-Length) 毎にキャッシュする
+
+    同じ応答を繰り返す /health などで、ヘッダーの組み立てとエンコードを省く。Date は1秒毎に作り直す。
+    """
+
+    MAX_ENTRIES = 1024
+
+    def __init__(self):
+        self._second = None
+        self._date = None
+        self._cache = {}
+
+    def get(self, version, status, headers, length, extra=()):
+        now = int(time.time())
+        if now != self._second:
+            self._cache = {}
+            self._date = email.utils.formatdate(now, usegmt=True)
+            self._second = now
+        key = (version, status, tuple(headers), length, extra)
+        head = self._cache.get(key)
+        if head is None:
+            lines = [f"{version} {status} {HTTPStatus(status).phrase}", f"Date: {self._date}"]
+            lines += [f"{name}: {value}" for name, value in (*extra, *headers)]
+            lines.append(f"Content-Length: {length}")
+            head = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+            if len(self._cache) < self.MAX_ENTRIES:
+                self._cache[key] = head
+        return head
+
+
+RESPONSE_HEADS = ResponseHeads()
+
 
 class JanNanoAPIHandler(BaseHTTPRequestHandler):
+    # Content-Length を必ず付けるので HTTP/1.1 keep-alive で接続を使い回せる
+    protocol_version = 'HTTP/1.1'
+
+    # ヘッダーとボディを別々に書き込むため、keep-alive 時の Nagle 遅延を避ける
+    disable_nagle_algorithm = True
+
+    # True にするとアクセスログを出さない（ベンチマーク用）
+    quiet = False
+
+    # 同時に build_response() を実行できる数。thread モードで設定される
+    worker_slots = None
+
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_OPTIONS(self):
+        self.dispatch('OPTIONS')
+
+    def dispatch(self, method):
+        with DRAIN.request():
+            body = b''
+            if method == 'POST':
+                try:
+                    length = body_length(
+                        self.headers.get('Content-Length'), self.headers.get('Transfer-Encoding'), MAX_BODY_BYTES
+                    )
+                    body = read_body(self.rfile.read, length)
+                except RequestRejected as e:
+                    # 読み残したボディが次のリクエストとして解釈されないよう、応答後に切断する
+                    self.close_connection = True
+                    self.send_payload(*rejected_response(method, self.path, e))
+                    return
+
+            with self.worker_slots or contextlib.nullcontext():
+                status, headers, payload = build_response(method, self.path, body)
+
+                if isinstance(payload, bytes):
+                    self.send_payload(status, headers, payload)
+                else:
+                    self.send_response(status)
+                    for name, value in headers:
+                        self.send_header(name, value)
+                    if DRAIN.draining.is_set():
+                        self.send_header('Connection', 'close')
+                    self.write_stream(payload)
+
+    def send_payload(self, status, headers, payload):
+        """ヘッダーとボディを1回の書き込みで送る"""
+        self.log_request(status)
+        if DRAIN.draining.is_set():
+            # drain 中は応答後に切断し、クライアントに（新しいプロセスへ）接続し直させる
+            self.close_connection = True
+        extra = (('Server', self.version_string()),)
+        if self.close_connection:
+            extra += (('Connection', 'close'),)
+        head = RESPONSE_HEADS.get(self.protocol_version, status, headers, len(payload), extra)
+        self.wfile.write(head + payload)
+
+    def write_stream(self, chunks):
+        """ストリーミング応答を送る。HTTP/1.1 は chunked、HTTP/1.0 は送信後に切断する"""
+        chunked = self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
         self.end_headers()
-        
-        if self.path == '/':
-            response = {
-                "message": "Jan Nano 4B Q8 API Server",
-                "status": "running",
-                "version": "1.0.0",
-                "timestamp": int(time.time())
-            }
-        elif self.path == '/health':
-            response = {"status": "healthy"}
-        elif self.path == '/v1/models':
-            response = {
-                "object": "list",
-                "data": [
-                    {
-                        "id": "jan-nano-4b-q8",
-                        "object": "model",
-                        "created": int(time.time()),
-                        "owned_by": "jan-hq"
-                    }
-                ]
-            }
+
+        for chunk in chunks:
+            if chunked:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+            self.wfile.flush()
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+class SingleConnectionHandler(JanNanoAPIHandler):
+    # single モードで keep-alive すると1クライアントがサーバーを占有するため、従来通り毎回切断する
+    protocol_version = 'HTTP/1.0'
+
+
+class ConcurrentHTTPServer(ThreadingHTTPServer):
+    """接続毎にスレッドを割り当てる HTTPServer（ALB のコネクションプール向けに backlog を拡大）"""
+    request_queue_size = 1024
+
+
+class AsyncAPIServer:
+    """asyncio で HTTP/1.1 keep-alive 接続を処理し、build_response() をワーカースレッドで実行する"""
+
+    # http.client と同じヘッダー数の上限
+    MAX_HEADERS = 100
+
+    def __init__(self, host, port, workers=16, quiet=False, reuse_port=False):
+        self.host = host
+        self.port = port
+        self.quiet = quiet
+        self.reuse_port = reuse_port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-worker')
+        # 次のリクエストを待っている接続の writer
+        self.idle = set()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                # リクエストを待っている間は idle（drain の終わりに閉じる）
+                self.idle.add(writer)
+                try:
+                    request_line = await reader.readline()
+                except ValueError:
+                    # リクエスト行が StreamReader の上限（64 KiB）を超えた
+                    break
+                finally:
+                    self.idle.discard(writer)
+                if not request_line:
+                    break
+
+                with DRAIN.request():
+                    keep_alive = await self.handle_request(reader, writer, request_line)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader, writer, request_line):
+        """1リクエストを処理して応答を書く。接続を使い続けるなら True"""
+        loop = asyncio.get_running_loop()
+        try:
+            method, path, version = request_line.decode('latin-1').split()
+        except ValueError:
+            return False
+
+        try:
+            headers = await self.read_headers(reader)
+            length = body_length(headers.get('content-length'), headers.get('transfer-encoding'), MAX_BODY_BYTES)
+            body = await read_body_async(reader.read, length) if length else b''
+        except RequestRejected as e:
+            # 読み残したボディが次のリクエストとして解釈されないよう、応答後に切断する
+            status, response_headers, payload = rejected_response(method, path, e)
+            writer.write(RESPONSE_HEADS.get('HTTP/1.1', status, response_headers, len(payload), (
+                ('Connection', 'close'),
+            )) + payload)
+            await writer.drain()
+            if not self.quiet:
+                print(f'"{method} {path} {version}" {status}')
+            return False
+
+        status, response_headers, payload = await loop.run_in_executor(
+            self.executor, build_response, method, path, body
+        )
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        if DRAIN.draining.is_set():
+            # drain 中は応答後に切断し、クライアントに（新しいプロセスへ）接続し直させる
+            keep_alive = False
+        streaming = not isinstance(payload, bytes)
+        if streaming and version != 'HTTP/1.1':
+            keep_alive = False
+
+        if streaming:
+            lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+            lines += [f"{name}: {value}" for name, value in response_headers]
+            if keep_alive:
+                lines.append("Transfer-Encoding: chunked")
+            lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+            await self.write_stream(writer, payload, chunked=keep_alive)
         else:
-            response = {"error": "Not found", "path": self.path}
-            
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
-    
-    def do_POST(self):
-        if self.path == '/v1/chat/completions':
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            
+            head = RESPONSE_HEADS.get('HTTP/1.1', status, response_headers, len(payload), (
+                ('Connection', 'keep-alive' if keep_alive else 'close'),
+            ))
+            writer.write(head + payload)
+            await writer.drain()
+
+        if not self.quiet:
+            print(f'"{method} {path} {version}" {status}')
+        return keep_alive
+
+    async def read_headers(self, reader):
+        """ヘッダーを読む（行が長すぎる・数が多すぎる場合は 400）"""
+        headers = {}
+        while True:
             try:
-                request_data = json.loads(post_data.decode('utf-8'))
-                
-                # メッセージを取得
-                messages = request_data.get('messages', [])
-                last_message = messages[-1]['content'] if messages else "Hello"
-                
-                # 日本語対応の応答生成
-                responses = [
-                    f"こんにちは！{last_message}についてお答えします。Jan Nano 4B Q8モデルが応答しています。",
-                    f"ご質問「{last_message}」を承りました。詳細な回答をお作りいたします。",
-                    f"{last_message}について考察してみます。このモデルは日本語に対応しています。"
-                ]
-                
-                import random
-                response_text = random.choice(responses)
-                
-                response = {
-                    "id": f"chatcmpl-{int(time.time())}",
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": request_data.get('model', 'jan-nano-4b-q8'),
-                    "choices": [
-                        {
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": response_text
-                            },
-                            "finish_reason": "stop"
-                        }
-                    ],
-                    "usage": {
-                        "prompt_tokens": len(last_message.split()),
-                        "completion_tokens": len(response_text.split()),
-                        "total_tokens": len(last_message.split()) + len(response_text.split())
-                    }
-                }
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
-                
-            except Exception as e:
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                error_response = {"error": str(e)}
-                self.wfile.write(json.dumps(error_response).encode('utf-8'))
+                line = await reader.readline()
+            except ValueError:
+                raise RequestRejected(400, "Header line too long")
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            if len(headers) >= self.MAX_HEADERS:
+                raise RequestRejected(400, "Too many headers")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    async def write_stream(self, writer, chunks, chunked):
+        """ブロッキングするチャンク生成をワーカースレッドで進めながら逐次送信する"""
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            if chunk is None:
+                break
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+    async def serve(self, drain_grace=0.0, drain_timeout=30.0):
+        """SIGTERM まで接続を受け付け、drain して戻る。処理中のリクエストが drain_timeout 秒以内に終われば True"""
+        loop = asyncio.get_running_loop()
+        if self.reuse_port:
+            server = await asyncio.start_server(self.handle_connection, sock=reuse_port_socket(self.host, self.port))
         else:
-            self.send_response(404)
-            self.end_headers()
-            
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+            server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=1024)
+        stopping = asyncio.Event()
+
+        def on_sigterm():
+            if not DRAIN.draining.is_set():
+                DRAIN.start()
+                loop.call_later(drain_grace, stopping.set)
+
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        await stopping.wait()
+        server.close()
+        for writer in list(self.idle):
+            writer.close()
+        return await loop.run_in_executor(None, DRAIN.wait_idle, drain_timeout)
+
+    def serve_forever(self, drain_grace=0.0, drain_timeout=30.0):
+        try:
+            return asyncio.run(self.serve(drain_grace, drain_timeout))
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def create_server(mode='thread', host='0.0.0.0', port=8000, workers=16, quiet=False, reuse_port=False):
+    """指定モードのサーバーを作成する（serve_forever() で起動）
+
+    reuse_port なら SO_REUSEPORT で動作中のプロセスと同じポートにバインドし、新しい接続をこのプロセスに振り分ける。
+    """
+    if mode == 'asyncio':
+        return AsyncAPIServer(host, port, workers=workers, quiet=quiet, reuse_port=reuse_port)
+    if mode == 'single':
+        handler = type('Handler', (SingleConnectionHandler,), {'quiet': quiet})
+        server_class = HTTPServer
+    elif mode == 'thread':
+        handler = type('Handler', (JanNanoAPIHandler,), {
+            'quiet': quiet,
+            'worker_slots': threading.BoundedSemaphore(workers),
+        })
+        server_class = ConcurrentHTTPServer
+    else:
+        raise ValueError(f"unknown mode: {mode}")
+    server = type('Server', (server_class,), {'allow_reuse_port': reuse_port})((host, port), handler)
+    if reuse_port:
+        steer_to_newest(server.socket)
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Jan Nano 4B Q8 API Server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--mode', choices=['single', 'thread', 'asyncio'], default='thread')
+    parser.add_argument('--workers', type=int, default=16, help="同時に処理するリクエスト数")
+    parser.add_argument('--delay', type=float, default=0.0, help="チャット応答の擬似生成時間（秒）")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="遅延を加えるリクエストの割合（障害注入）")
+    parser.add_argument('--slow-delay', type=float, default=0.0, help="--slow-rate のリクエストに加える遅延（秒）")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="503 で失敗させるリクエストの割合（障害注入）")
+    parser.add_argument('--model-slots', type=int, default=0,
+                        help="擬似モデルが同時に生成できるリクエスト数（0 で制限なし）")
+    parser.add_argument('--prefill-delay', type=float, default=0.0,
+                        help="プレフィックスがキャッシュにない時の擬似 prefill 時間（秒）")
+    parser.add_argument('--prefix-cache-entries', type=int, default=4, help="擬似プレフィックスキャッシュの件数")
+    parser.add_argument('--max-body-bytes', type=int, default=MAX_BODY_BYTES,
+                        help="リクエストボディの上限（バイト、超えれば 413）")
+    parser.add_argument('--max-messages', type=int, default=MAX_MESSAGES, help="messages の件数の上限")
+    parser.add_argument('--max-tokens-limit', type=int, default=MAX_TOKENS_LIMIT, help="max_tokens の上限")
+    parser.add_argument('--quiet', action='store_true', help="アクセスログを出力しない")
+    parser.add_argument('--no-metrics', action='store_true', help="/metrics の計測を無効にする")
+    parser.add_argument('--tokenizer', help="usage の計算に使うトークナイザーのパス（省略時は近似）")
+    parser.add_argument('--response-cache-mb', type=int, default=0, help="応答キャッシュのメモリ上限（MB、0 で無効）")
+    parser.add_argument('--response-cache-ttl', type=int, default=3600, help="応答キャッシュの有効期限（秒）")
+    parser.add_argument('--response-cache-path', help="応答キャッシュの sqlite ファイル（任意）")
+    parser.add_argument('--reuse-port', action='store_true',
+                        help="SO_REUSEPORT でバインドする（動作中のプロセスと同じポートで起動して引き継ぐ）")
+    parser.add_argument('--drain-grace', type=float, default=1.0,
+                        help="SIGTERM の後、/health を 503 にしたまま接続を受け付け続ける秒数")
+    parser.add_argument('--drain-timeout', type=float, default=30.0,
+                        help="受け付けをやめてから処理中のリクエストを待つ最大秒数")
+    return parser.parse_args(argv)
+
 
 if __name__ == '__main__':
+    args = parse_args()
+    RESPONSE_DELAY = args.delay
+    METRICS_ENABLED = not args.no_metrics
+    SLOW_RATE, SLOW_DELAY, FAIL_RATE = args.slow_rate, args.slow_delay, args.fail_rate
+    if args.model_slots > 0:
+        MODEL_SLOTS = threading.BoundedSemaphore(args.model_slots)
+    PREFILL_DELAY, PREFIX_CACHE_ENTRIES = args.prefill_delay, args.prefix_cache_entries
+    MAX_BODY_BYTES, MAX_MESSAGES, MAX_TOKENS_LIMIT = args.max_body_bytes, args.max_messages, args.max_tokens_limit
+    if args.tokenizer:
+        PROMPT_BUILDER = PromptBuilder(load_tokenizer(args.tokenizer))
+    if args.response_cache_mb > 0:
+        RESPONSE_CACHE = ResponseCache(
+            args.response_cache_mb * 1024 * 1024, ttl=args.response_cache_ttl, path=args.response_cache_path
+        )
+
     print("Jan Nano 4B Q8 API Server starting...")
-    print("Port: 8000")
+    print(f"Port: {args.port}")
+    print(f"Mode: {args.mode} (workers: {args.workers})")
     print("OpenAI compatible endpoints:")
     print("  GET  /")
-    print("  GET  /v1/models") 
+    print("  GET  /v1/models")
     print("  POST /v1/chat/completions")
-    
-    server = HTTPServer(('0.0.0.0', 8000), JanNanoAPIHandler)
-    server.serve_forever()
\ No newline at end of file
+
+    server = create_server(args.mode, args.host, args.port, args.workers, args.quiet, args.reuse_port)
+    if args.mode == 'asyncio':
+        drained = server.serve_forever(args.drain_grace, args.drain_timeout)
+    else:
+        drained = serve_until_drained(server, args.drain_grace, args.drain_timeout)
+    if drained:
+        print("Drained, shutting down")
+    else:
+        print(f"Drain timed out with {DRAIN.active} request(s) in flight")
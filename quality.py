@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+回答の品質スコア（evaluate_response_quality）と、大量の回答をまとめて採点するエンジン
+
+スコアの定義は test_japanese_complex.py で使っていたものと同じです（キーワードの含有 30点、文字数 25点、
+論理的構造の表現 25点、学術的表現 20点）。evaluate_response_quality は語毎に `in` で走査するので、
+1件の採点はこれが一番速いですが、大量の回答では QualityScorer.score_batch() を使います。
+
+- キーワード・論理的構造の表現・学術的表現をすべて1つの表（TermMatcher）にまとめ、回答のバッチを
+  1回の走査で、どの回答にどの語が含まれるかの行列にする（numpy の配列演算で、回答・文字毎の Python のループはない）。
+  スコアもその行列から配列演算で求める。numpy がなければ evaluate_response_quality を繰り返す
+- score_file() は JSONL の結果ファイルを --batch-size 行ずつ読み、--workers 個のプロセスで並行に採点して、
+  入力と同じ順に書き出す（先読みはワーカー数の2倍のバッチまでなので、ファイルの大きさに関係なくメモリは一定）
+
+    python3 quality.py results.jsonl scores.jsonl --workers 4
+
+入力の各行は {"custom_id", "response", "keywords"} で、response は回答のテキストか chat.completion の応答
+（batch_infer.py の出力と同じ形）です。出力の各行は {"custom_id", "line", "score", "error"} で、
+不正な行（JSON でない・keywords が空など）は error にメッセージが入ります。空行は出力しません。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from fastjson import dumps, loads
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LOGICAL_INDICATORS = ["まず", "次に", "さらに", "結論として", "一方で", "しかし", "したがって"]
+ACADEMIC_TERMS = ["分析", "考察", "論証", "検討", "仮説", "理論", "概念", "観点"]
+
+# score_batch() で1回に走査する回答の数（連結したテキストと候補の配列がキャッシュに収まる程度）
+BLOCK_SIZE = 256
+
+
+def evaluate_response_quality(response_text, keywords):
+    """回答の質を評価"""
+    score = 0
+
+    # キーワード含有チェック
+    keyword_count = sum(1 for keyword in keywords if keyword in response_text)
+    score += (keyword_count / len(keywords)) * 30
+
+    # 文字数による複雑さ評価
+    char_count = len(response_text)
+    if char_count > 1000:
+        score += 25
+    elif char_count > 500:
+        score += 15
+    elif char_count > 200:
+        score += 10
+
+    # 論理的構造の評価（簡易）
+    logical_count = sum(1 for indicator in LOGICAL_INDICATORS if indicator in response_text)
+    score += min(logical_count * 5, 25)
+
+    # 学術的表現の評価
+    academic_count = sum(1 for term in ACADEMIC_TERMS if term in response_text)
+    score += min(academic_count * 3, 20)
+
+    return min(score, 100)
+
+
+class TermMatcher:
+    """terms のどれがどのテキストに含まれるかを、テキストのバッチを1回走査して求める
+
+    1. テキストを NUL で区切って連結して UTF-16 のコード単位にし、語に現れるコード単位を 1〜255 のバケット
+       （語に現れないものは 0）に写す
+    2. 隣り合う2つのバケットの組（uint16）が、いずれかの語の先頭2単位の組と一致する位置を候補にする
+       （1単位の語は、先頭の1単位が一致する位置）
+    3. 候補の位置から、その組で始まる語を実際のコード単位と4単位（uint64）ずつ比べて確かめる
+    バケットの衝突は候補が増えるだけなので、結果は `term in text` と同じです。
+    """
+
+    def __init__(self, terms):
+        self.terms = list(terms)
+        if any(not term or "\0" in term for term in self.terms):
+            raise ValueError("terms must be non-empty and must not contain NUL")
+        units = [np.frombuffer(term.encode('utf-16-le'), '<u2') for term in self.terms]
+        alphabet = np.unique(np.concatenate(units)) if units else np.zeros(0, np.uint16)
+        self._buckets = np.zeros(1 << 16, np.uint8)
+        self._buckets[alphabet] = np.arange(len(alphabet)) % 255 + 1
+
+        # 語を4単位ずつ uint64 にした値とマスク（語より後ろのマスクは 0）
+        self._words = (max(map(len, units), default=1) + 3) // 4
+        self._values = np.zeros((len(units), self._words), np.uint64)
+        self._masks = np.zeros((len(units), self._words), np.uint64)
+        starts = {}  # 先頭2単位のバケットの組 -> 語の番号
+        for index, term_units in enumerate(units):
+            value = np.zeros(self._words * 4, np.uint16)
+            value[:len(term_units)] = term_units
+            mask = np.zeros(self._words * 4, np.uint16)
+            mask[:len(term_units)] = 0xFFFF
+            self._values[index] = value.view('<u8')
+            self._masks[index] = mask.view('<u8')
+            first = int(self._buckets[term_units[0]])
+            if len(term_units) > 1:
+                pairs = [first | int(self._buckets[term_units[1]]) << 8]
+            else:
+                pairs = [first | second << 8 for second in range(256)]
+            for pair in pairs:
+                starts.setdefault(pair, []).append(index)
+
+        # 組毎の語の番号（CSR: _offsets[pair]〜_offsets[pair + 1]）
+        counts = np.zeros(1 << 16, np.int64)
+        for pair, indexes in starts.items():
+            counts[pair] = len(indexes)
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._terms_by_pair = np.zeros(int(self._offsets[-1]), np.int64)
+        for pair, indexes in starts.items():
+            self._terms_by_pair[self._offsets[pair]:self._offsets[pair] + len(indexes)] = indexes
+        self._anchors = counts > 0
+
+    def match_batch(self, texts):
+        """texts の各テキストに各語が含まれるかの bool の行列（len(texts) × len(terms)）"""
+        matched = np.zeros((len(texts), len(self.terms)), bool)
+        for start in range(0, len(texts), BLOCK_SIZE):
+            block = texts[start:start + BLOCK_SIZE]
+            rows, terms = self._match_block(block)
+            matched[rows + start, terms] = True
+        return matched
+
+    def _match_block(self, texts):
+        """texts に含まれる (テキストの番号, 語の番号) の組（重複あり）"""
+        # 末尾に語の長さ分の NUL を足して、最後の位置からも uint64 で読めるようにする
+        data = ("\0".join(texts) + "\0" * (self._words * 4)).encode('utf-16-le')
+        units = np.frombuffer(data, '<u2')
+        lengths = np.fromiter(map(len, texts), np.int64, len(texts))
+        if len(units) != int(lengths.sum()) + len(texts) - 1 + self._words * 4:
+            # サロゲートペアになる文字があると、コード単位の数が文字数より多い
+            lengths = np.fromiter((len(text.encode('utf-16-le')) // 2 for text in texts), np.int64, len(texts))
+        text_starts = np.cumsum(lengths + 1) - lengths - 1
+
+        # 隣り合う2単位のバケットの組は、バケットの配列を1バイトずつずらして uint16 として読む
+        # （表引きは添字の範囲が決まっているので、添字を確かめる a[idx] より速い np.take を使う）
+        buckets = np.take(self._buckets, units)
+        pairs = np.ndarray((len(buckets) - 1,), '<u2', buckets, strides=(1,))
+        positions = np.flatnonzero(np.take(self._anchors, pairs))
+
+        pair = np.take(pairs, positions).astype(np.int64)
+        first = np.take(self._offsets, pair)
+        counts = np.take(self._offsets, pair + 1) - first
+        positions = np.repeat(positions, counts)
+        offsets = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+        terms = np.take(self._terms_by_pair, offsets)
+
+        # 各位置から4単位を uint64 として読み（コード単位の配列を2バイトずつずらして読む）、語と比べる
+        words = np.ndarray((len(units) - 3,), '<u8', data, strides=(2,))
+        found = (np.take(words, positions) & self._masks[terms, 0]) == self._values[terms, 0]
+        for word in range(1, self._words):
+            found &= (np.take(words, positions + 4 * word) & self._masks[terms, word]) == self._values[terms, word]
+        positions = positions[found]
+        return np.searchsorted(text_starts, positions, 'right') - 1, terms[found]
+
+
+class QualityScorer:
+    """evaluate_response_quality と同じスコアを、回答のバッチに対して配列演算で計算する
+
+    キーワードは初めて見たときに追加され、次の採点の前に TermMatcher を作り直す。
+    """
+
+    def __init__(self, keywords=()):
+        self._terms = {}
+        for term in LOGICAL_INDICATORS + ACADEMIC_TERMS:
+            self._terms.setdefault(term, len(self._terms))
+        self._logical = [self._terms[term] for term in LOGICAL_INDICATORS]
+        self._academic = [self._terms[term] for term in ACADEMIC_TERMS]
+        self._matcher = None
+        self._ids = {}
+        self.add_keywords(keywords)
+
+    def add_keywords(self, keywords):
+        for keyword in keywords:
+            # 空文字列は常に含まれる（`"" in text` と同じ）ので表には入れない
+            if keyword and keyword not in self._terms:
+                self._terms[keyword] = len(self._terms)
+                self._matcher = None
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            self._matcher = TermMatcher(self._terms)
+        return self._matcher
+
+    def _keyword_ids(self, keywords):
+        """キーワードの語の番号の配列（同じキーワードのリストは何度も現れるのでキャッシュする）"""
+        key = tuple(keywords)
+        ids = self._ids.get(key)
+        if ids is None:
+            ids = self._ids[key] = np.array([self._terms[keyword] if keyword else -1 for keyword in key], np.int64)
+        return ids
+
+    def score_batch(self, texts, keyword_lists):
+        """texts[i] のスコアのリスト（keyword_lists[i] がそのキーワード）"""
+        # 同じキーワードのリストが何度も現れるので、確認と追加は異なるリスト毎に1回だけ
+        unique = set(map(tuple, keyword_lists))
+        if np is None or any("\0" in keyword for keywords in unique for keyword in keywords):
+            return [evaluate_response_quality(text, keywords) for text, keywords in zip(texts, keyword_lists)]
+        if () in unique:
+            raise ZeroDivisionError("keywords must not be empty")
+        for keywords in unique:
+            self.add_keywords(keywords)
+
+        matched = self.matcher.match_batch(texts)
+        count = len(texts)
+        logical = matched[:, self._logical].sum(axis=1)
+        academic = matched[:, self._academic].sum(axis=1)
+
+        # 回答毎のキーワード（重複もそのまま数える）が含まれるか。空文字列（-1）は常に含まれる
+        ids = [self._keyword_ids(keywords) for keywords in keyword_lists]
+        sizes = np.fromiter(map(len, ids), np.int64, count)
+        owners = np.repeat(np.arange(count), sizes)
+        wanted = np.concatenate(ids) if ids else np.zeros(0, np.int64)
+        present = (wanted < 0) | matched[owners, wanted]
+        keyword_count = np.bincount(owners[present], minlength=count)
+
+        # evaluate_response_quality と同じ順の浮動小数点演算なので、結果も一致する
+        chars = np.fromiter(map(len, texts), np.int64, count)
+        score = (keyword_count / sizes) * 30
+        score += np.select([chars > 1000, chars > 500, chars > 200], [25, 15, 10], 0)
+        score += np.minimum(logical * 5, 25)
+        score += np.minimum(academic * 3, 20)
+        return np.minimum(score, 100).tolist()
+
+
+def response_text(response):
+    """回答のテキスト。chat.completion の応答なら最初の choice の content"""
+    if isinstance(response, str):
+        return response
+    if isinstance(response, dict):
+        try:
+            content = response["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            content = None
+        if isinstance(content, str):
+            return content
+    raise ValueError("response must be a string or a chat.completion")
+
+
+def parse_record(line):
+    """入力の1行を (custom_id, テキスト, キーワード) にする"""
+    record = loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("line must be a JSON object")
+    keywords = record.get("keywords")
+    if not isinstance(keywords, list) or set(map(type, keywords)) - {str}:
+        raise ValueError("keywords must be a list of strings")
+    if not keywords:
+        raise ValueError("keywords must not be empty")
+    return record.get("custom_id"), response_text(record.get("response")), keywords
+
+
+# ワーカープロセス毎の QualityScorer（キーワードが増えたときだけ TermMatcher を作り直す）
+_scorer = None
+
+
+def score_lines(first_line, lines):
+    """first_line 行目から始まる入力行を採点し、(出力の bytes, 出力行数, エラー数, スコアの合計) を返す"""
+    global _scorer
+    if _scorer is None:
+        _scorer = QualityScorer()
+    records = []  # (行番号, custom_id, エラー)
+    texts, keyword_lists = [], []
+    for line_number, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        custom_id = None
+        try:
+            custom_id, text, keywords = parse_record(line)
+        except ValueError as e:
+            records.append((line_number, custom_id, str(e)))
+            continue
+        records.append((line_number, custom_id, None))
+        texts.append(text)
+        keyword_lists.append(keywords)
+
+    scores = iter(_scorer.score_batch(texts, keyword_lists))
+    output = []
+    errors = 0
+    total = 0.0
+    for line_number, custom_id, error in records:
+        score = None if error is not None else next(scores)
+        errors += error is not None
+        total += score or 0.0
+        output.append(dumps({"custom_id": custom_id, "line": line_number, "score": score,
+                             "error": {"message": error} if error is not None else None}))
+    return b''.join(line + b'\n' for line in output), len(output), errors, total
+
+
+def score_file(input_path, output_path, workers=1, batch_size=4096, log=None):
+    """input_path の全行を採点して output_path に書き出し、統計を返す"""
+    stats = {"lines": 0, "errors": 0, "workers": workers, "batch_size": batch_size}
+    total = 0.0
+    started = time.perf_counter()
+
+    def write(result):
+        nonlocal total
+        data, lines, errors, score_sum = result
+        output.write(data)
+        stats["lines"] += lines
+        stats["errors"] += errors
+        total += score_sum
+        if log is not None:
+            elapsed = time.perf_counter() - started
+            log(f"{stats['lines']} 行完了（{stats['lines'] / elapsed:.0f} 行/秒）")
+
+    with open(input_path, 'rb') as source, open(output_path, 'wb') as output:
+        def batches():
+            first_line = 0
+            while True:
+                chunk = list(islice(source, batch_size))
+                if not chunk:
+                    return
+                yield first_line, chunk
+                first_line += len(chunk)
+
+        if workers <= 1:
+            for first_line, chunk in batches():
+                write(score_lines(first_line, chunk))
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                pending = deque()
+                for first_line, chunk in batches():
+                    pending.append(pool.submit(score_lines, first_line, chunk))
+                    # 先読みはワーカー数の2倍まで。入力の順に書き出す
+                    while len(pending) >= workers * 2:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+
+    stats["seconds"] = time.perf_counter() - started
+    scored = stats["lines"] - stats["errors"]
+    stats["mean_score"] = total / scored if scored else None
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONL の回答をまとめて品質スコアで採点する")
+    parser.add_argument('input', help="入力 JSONL（1行に {\"response\", \"keywords\"}）")
+    parser.add_argument('output', help="出力 JSONL（入力と同じ順）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="採点するプロセス数")
+    parser.add_argument('--batch-size', type=int, default=4096, help="1回にワーカーへ渡す行数")
+    parser.add_argument('--json', help="統計を保存するJSONファイル")
+    args = parser.parse_args()
+
+    if np is None:
+        print("numpy がないため、1件ずつ採点します", file=sys.stderr)
+    stats = score_file(args.input, args.output, workers=args.workers, batch_size=args.batch_size)
+    seconds = stats["seconds"] or float('inf')
+    mean = f"{stats['mean_score']:.1f}" if stats["mean_score"] is not None else "-"
+    print(f"完了: {stats['lines']} 行（エラー {stats['errors']}）、平均スコア {mean}、{stats['seconds']:.1f}秒"
+          f"（{stats['lines'] / seconds:.0f} 行/秒、{args.workers} プロセス）")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(stats, f, indent=2)
+        print(f"\n結果を保存しました: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
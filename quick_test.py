@@ -3,6 +3,8 @@
 import requests
 import json
 
+from cluster_client import ClusterClient
+
 # 直接個別インスタンスをテスト
 instances = [
     "http://18.183.244.233:8000",
@@ -14,13 +16,17 @@ domain = "http://jan-nano-api.teai.io"
 
 print("=== Jan Nano API クイックテスト ===")
 
-# 個別インスタンステスト
-for i, instance in enumerate(instances, 1):
-    try:
-        response = requests.get(f"{instance}/", timeout=5)
-        print(f"✅ インスタンス{i}: {response.status_code} - {response.text[:50]}")
-    except Exception as e:
-        print(f"❌ インスタンス{i}: {str(e)[:50]}")
+# 個別インスタンステスト（/health を並行して確認）
+client = ClusterClient(instances, health_interval=None, health_timeout=5)
+try:
+    health = client.check_health()
+finally:
+    client.close()
+for i, node in enumerate(client.nodes, 1):
+    if health[node.url]:
+        print(f"✅ インスタンス{i}: 正常稼働")
+    else:
+        print(f"❌ インスタンス{i}: {node.last_error}")
 
 # ドメインテスト
 try:
@@ -0,0 +1,179 @@
+"""
+複数のリソース（証明書・リスナー・エンドポイントなど）の ready を asyncio で並行して待つ
+
+Resource は probe（ready なら True を返す async 関数）と、ready になったときに実行する action を持ちます。
+Watcher はリソース毎のタスクで probe を繰り返し、
+- 間隔は initial_interval から倍々に max_interval まで伸ばし、jitter として 50〜100% の長さでランダムに待つ
+  （同じ間隔で並んだ probe が API を同時に叩かないように）
+- ready になった時点ですぐに action を実行し、after にそのリソースを挙げているリソースの監視を始める
+- probe が ResourceFailed を送出したら failed、deadline 秒以内に ready にならなければ expired とする。
+  その他の例外は一時的なエラーとして次の probe まで待つ
+- failed / expired のリソースを after に持つリソースは probe せずに skipped とする
+
+状態が変わる毎に on_transition(resource, state) を呼びます。
+
+AWS の probe は boto3 のクライアント（スレッドセーフ）を受け取り、呼び出しは asyncio.to_thread で行います。
+クライアントは呼び出し側で1回だけ作って使い回してください。
+"""
+
+import asyncio
+import random
+import ssl
+import time
+import urllib.error
+import urllib.request
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+EXPIRED = "expired"
+SKIPPED = "skipped"
+
+
+class ResourceFailed(Exception):
+    """probe が ready にならないことが確定した（証明書の検証失敗など）"""
+
+
+class Resource:
+    """監視する1つのリソース"""
+
+    def __init__(self, name, probe, action=None, after=(), deadline=3600.0, initial_interval=1.0,
+                 max_interval=15.0):
+        self.name = name
+        self.probe = probe
+        # ready になったときに呼ぶ（通常の関数でも async 関数でもよい）。例外は failed として扱う
+        self.action = action
+        self.after = tuple(after)
+        self.deadline = deadline
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+
+        self.state = PENDING
+        self.error = None
+        self.attempts = 0
+        # Watcher.run() の開始からの秒数
+        self.started_at = None
+        self.ready_at = None
+
+
+def backoff_delays(initial, maximum, rng=random):
+    """initial から倍々に maximum まで伸びる待ち時間を、50〜100% の jitter をかけて返し続ける"""
+    interval = initial
+    while True:
+        yield interval * rng.uniform(0.5, 1.0)
+        interval = min(interval * 2, maximum)
+
+
+class Watcher:
+    """Resource をまとめて並行に監視する"""
+
+    def __init__(self, resources, on_transition=None, rng=None):
+        self.resources = {resource.name: resource for resource in resources}
+        for resource in resources:
+            for name in resource.after:
+                if name not in self.resources:
+                    raise ValueError(f"{resource.name}: unknown dependency {name}")
+        self.on_transition = on_transition
+        self.rng = rng or random.Random()
+        self._done = {}
+        self._started = None
+
+    async def run(self):
+        """全リソースが ready / failed / expired / skipped になるまで監視し、name -> Resource を返す"""
+        self._started = time.monotonic()
+        self._done = {name: asyncio.Event() for name in self.resources}
+        await asyncio.gather(*(self._watch(resource) for resource in self.resources.values()))
+        return self.resources
+
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    async def _watch(self, resource):
+        try:
+            for name in resource.after:
+                await self._done[name].wait()
+                if self.resources[name].state != READY:
+                    self._transition(resource, SKIPPED, f"{name} is {self.resources[name].state}")
+                    return
+            resource.started_at = self.elapsed()
+            try:
+                await asyncio.wait_for(self._poll(resource), resource.deadline)
+            except asyncio.TimeoutError:
+                self._transition(resource, EXPIRED, f"not ready within {resource.deadline:.0f}s")
+                return
+            except ResourceFailed as e:
+                self._transition(resource, FAILED, str(e))
+                return
+            resource.ready_at = self.elapsed()
+            if resource.action is not None:
+                try:
+                    result = resource.action()
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    self._transition(resource, FAILED, f"action failed: {e}")
+                    return
+            self._transition(resource, READY)
+        finally:
+            self._done[resource.name].set()
+
+    async def _poll(self, resource):
+        delays = backoff_delays(resource.initial_interval, resource.max_interval, self.rng)
+        while True:
+            resource.attempts += 1
+            try:
+                if await resource.probe():
+                    return
+            except ResourceFailed:
+                raise
+            except Exception as e:
+                resource.error = str(e) or type(e).__name__
+            await asyncio.sleep(next(delays))
+
+    def _transition(self, resource, state, error=None):
+        resource.state = state
+        resource.error = error
+        if self.on_transition is not None:
+            self.on_transition(resource, state)
+
+
+def certificate_probe(acm, certificate_arn):
+    """ACM の証明書が ISSUED なら ready。検証の失敗などは ResourceFailed"""
+
+    async def probe():
+        response = await asyncio.to_thread(acm.describe_certificate, CertificateArn=certificate_arn)
+        status = response['Certificate']['Status']
+        if status == 'ISSUED':
+            return True
+        if status == 'PENDING_VALIDATION':
+            return False
+        raise ResourceFailed(f"certificate status {status}")
+
+    return probe
+
+
+def listener_probe(elbv2, load_balancer_arn, port=443):
+    """ロードバランサーに port のリスナーがあれば ready"""
+
+    async def probe():
+        response = await asyncio.to_thread(elbv2.describe_listeners, LoadBalancerArn=load_balancer_arn)
+        return any(listener['Port'] == port for listener in response['Listeners'])
+
+    return probe
+
+
+def endpoint_probe(url, ssl_context=None, timeout=10.0):
+    """url への GET が 200 を返せば ready（接続できない・証明書の不一致・5xx は pending）"""
+    context = ssl_context or ssl.create_default_context()
+
+    def get():
+        try:
+            with urllib.request.urlopen(url, timeout=timeout, context=context) as response:
+                return response.status == 200
+        except urllib.error.HTTPError:
+            return False
+
+    async def probe():
+        return await asyncio.to_thread(get)
+
+    return probe
@@ -2,12 +2,14 @@
 
 # Jan Nano 4B Q8 API サーバー再デプロイスクリプト
 # 既存インスタンスを再起動してUser Dataでデプロイ
+# rollout.py で ROLLOUT_BATCH_SIZE 台ずつ停止・起動し、/health が ready になってから次に進む
 
-INSTANCES=(
-    "i-0e25e1dff244332da"  # 13.230.95.222
-    "i-07a7f078041b43aee"  # 35.77.218.93
-    "i-04d289a5e01244e64"  # 43.207.37.132
+NODES=(
+    --node "i-0e25e1dff244332da=13.230.95.222"
+    --node "i-07a7f078041b43aee=35.77.218.93"
+    --node "i-04d289a5e01244e64=43.207.37.132"
 )
+ROLLOUT_BATCH_SIZE="${ROLLOUT_BATCH_SIZE:-1}"
 
 USER_DATA=$(cat << 'EOF'
 #!/bin/bash
@@ -194,22 +196,15 @@ echo "=== インスタンス再デプロイ開始 ==="
 # User DataをBase64エンコード
 USER_DATA_B64=$(echo "$USER_DATA" | base64 -w 0)
 
-for instance_id in "${INSTANCES[@]}"; do
-    echo "インスタンス $instance_id を停止中..."
-    aws ec2 stop-instances --instance-ids $instance_id
-done
+export USER_DATA_B64
 
-# 停止完了を待機
-echo "停止完了を待機中..."
-sleep 60
-
-for instance_id in "${INSTANCES[@]}"; do
-    echo "インスタンス $instance_id にUser Dataを設定..."
-    aws ec2 modify-instance-attribute --instance-id $instance_id --user-data Value="$USER_DATA_B64"
-    
-    echo "インスタンス $instance_id を開始..."
-    aws ec2 start-instances --instance-ids $instance_id
-done
+# 停止の完了を待ってから User Data を差し替えて起動する（User Data のセットアップが終わるまで /health を待つ）
+python3 "$(dirname "$0")/rollout.py" "${NODES[@]}" --batch-size "$ROLLOUT_BATCH_SIZE" --health-timeout 1800 \
+    --command 'aws ec2 stop-instances --instance-ids {instance_id} > /dev/null \
+        && aws ec2 wait instance-stopped --instance-ids {instance_id} \
+        && aws ec2 modify-instance-attribute --instance-id {instance_id} --user-data Value="$USER_DATA_B64" \
+        && aws ec2 start-instances --instance-ids {instance_id} > /dev/null' \
+    || { echo "❌ 再デプロイを中止しました"; exit 1; }
 
 echo "=== 全インスタンス再起動完了 ==="
-echo "APIサーバーの起動には数分かかります..."
\ No newline at end of file
+echo "全インスタンスの /health が ready になりました"
\ No newline at end of file
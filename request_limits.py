@@ -0,0 +1,111 @@
+"""
+リクエストボディのサイズ制限とチャットリクエストの検証
+proven_api.py・api_server.py で共通利用します（startup.sh の埋め込みサーバーは同じ制限を直接持つ）
+
+- Content-Length はボディを読む前に検証し、不正なら 400、上限を超えれば 413 でボディを読まずに拒否する
+- ボディは READ_CHUNK ずつ読むので、確保するメモリは宣言された長さではなく実際に届いた量に比例する。
+  最初のチャンクが JSON オブジェクトで始まらなければ残りを読まずに 400
+- messages の件数・max_tokens・n（生成する候補数）・/v1/embeddings の入力数の上限（超えれば 400）
+
+上限は環境変数で変更できます:
+  JAN_NANO_MAX_BODY_BYTES（既定 1 MiB）、JAN_NANO_MAX_MESSAGES（既定 256）、JAN_NANO_MAX_TOKENS_LIMIT（既定 4096）、
+  JAN_NANO_MAX_CHOICES（既定 8）、JAN_NANO_MAX_EMBEDDING_INPUTS（既定 256）
+"""
+
+import os
+
+MAX_BODY_BYTES = int(os.environ.get("JAN_NANO_MAX_BODY_BYTES", str(1024 * 1024)))
+MAX_MESSAGES = int(os.environ.get("JAN_NANO_MAX_MESSAGES", "256"))
+MAX_TOKENS_LIMIT = int(os.environ.get("JAN_NANO_MAX_TOKENS_LIMIT", "4096"))
+MAX_CHOICES = int(os.environ.get("JAN_NANO_MAX_CHOICES", "8"))
+MAX_EMBEDDING_INPUTS = int(os.environ.get("JAN_NANO_MAX_EMBEDDING_INPUTS", "256"))
+
+READ_CHUNK = 64 * 1024
+
+
+class RequestRejected(Exception):
+    """リクエストを処理せずに拒否する（status は返すべき HTTP ステータス）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def body_length(content_length, transfer_encoding=None, limit=MAX_BODY_BYTES):
+    """Content-Length / Transfer-Encoding ヘッダーの値からボディの長さを返す（ボディを読む前に呼ぶ）"""
+    if transfer_encoding and transfer_encoding.strip().lower() != 'identity':
+        raise RequestRejected(411, "Transfer-Encoding is not supported, send Content-Length")
+    if content_length is None:
+        return 0
+    content_length = content_length.strip()
+    if not (content_length.isascii() and content_length.isdigit()):
+        raise RequestRejected(400, "Invalid Content-Length")
+    length = int(content_length)
+    if length > limit:
+        raise RequestRejected(413, f"Request body exceeds {limit} bytes")
+    return length
+
+
+class _BodyReader:
+    """チャンク毎の受け取りと、先頭が JSON オブジェクトかどうかの確認"""
+
+    def __init__(self, length):
+        self.remaining = length
+        self.chunks = []
+        self.started = False
+
+    def feed(self, chunk):
+        if not chunk:
+            raise RequestRejected(400, "Incomplete request body")
+        if not self.started:
+            head = chunk.lstrip()
+            if head:
+                if head[:1] != b'{':
+                    raise RequestRejected(400, "Request body must be a JSON object")
+                self.started = True
+        self.chunks.append(chunk)
+        self.remaining -= len(chunk)
+
+    def body(self):
+        return b"".join(self.chunks)
+
+
+def read_body(read, length, chunk_size=READ_CHUNK):
+    """read(n) で length バイトを chunk_size ずつ読む"""
+    reader = _BodyReader(length)
+    while reader.remaining > 0:
+        reader.feed(read(min(chunk_size, reader.remaining)))
+    return reader.body()
+
+
+async def read_body_async(read, length, chunk_size=READ_CHUNK):
+    """read_body() の asyncio 版（read は StreamReader.read など）"""
+    reader = _BodyReader(length)
+    while reader.remaining > 0:
+        reader.feed(await read(min(chunk_size, reader.remaining)))
+    return reader.body()
+
+
+def validate_chat_request(data, max_messages=MAX_MESSAGES, max_tokens=MAX_TOKENS_LIMIT, max_choices=MAX_CHOICES):
+    """デコード済みの /v1/chat/completions リクエストを検証する（api_server.py の ChatCompletionRequest と同じ制限）"""
+    if not isinstance(data, dict):
+        raise RequestRejected(400, "Request body must be a JSON object")
+
+    messages = data.get('messages', [])
+    if not isinstance(messages, list):
+        raise RequestRejected(400, "messages must be a list")
+    if len(messages) > max_messages:
+        raise RequestRejected(400, f"Too many messages ({len(messages)} > {max_messages})")
+    for message in messages:
+        if not (isinstance(message, dict) and isinstance(message.get('role'), str)
+                and isinstance(message.get('content'), str)):
+            raise RequestRejected(400, "Each message must have a string role and content")
+
+    value = data.get('max_tokens')
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= max_tokens):
+        raise RequestRejected(400, f"max_tokens must be an integer between 1 and {max_tokens}")
+
+    value = data.get('n')
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= max_choices):
+        raise RequestRejected(400, f"n must be an integer between 1 and {max_choices}")
+    return data
@@ -0,0 +1,120 @@
+"""
+完全一致レスポンスキャッシュ
+
+temperature == 0、または seed を指定したリクエストは、同じ messages とパラメーターなら
+同じ応答になるため、生成結果を保存して再利用します。
+キーはモデル名・messages・サンプリングパラメーターを正規化した JSON の SHA-256 です。
+
+メモリ上の LRU（サイズと TTL で制限）と、任意で sqlite のディスク層を持ちます。
+ディスク層はプロセス再起動後も残り、メモリから追い出されたエントリも拾えます。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def is_cacheable(payload):
+    """同じ入力に対して決定的な出力になるリクエストか"""
+    if payload.get("stream"):
+        return False
+    return payload.get("temperature") == 0 or payload.get("seed") is not None
+
+
+def cache_key(payload):
+    """リクエストの正規化ハッシュ（stream は応答形式だけの違いなので除外）"""
+    canonical = {k: v for k, v in payload.items() if k != "stream"}
+    encoded = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """サイズ / TTL で制限したメモリ LRU と任意の sqlite 層を持つキャッシュ"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600, path=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (保存時刻, bytes)
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored REAL, value BLOB)"
+            )
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """キャッシュされた応答（bytes）を返す。なければ None"""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored, value = entry
+                if now - stored <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT stored, value FROM responses WHERE key = ? AND stored >= ?", (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    self._store(key, row[0], bytes(row[1]))
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return bytes(row[1])
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._store(key, now, value)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, now, value))
+
+    def prune(self):
+        """ディスク層から TTL 切れのエントリを削除する"""
+        if self.db is not None:
+            with self._lock:
+                self.db.execute("DELETE FROM responses WHERE stored < ?", (time.time() - self.ttl,))
+
+    def _store(self, key, stored, value):
+        if key in self.entries:
+            self._discard(key)
+        if len(value) > self.max_bytes:
+            return
+        self.entries[key] = (stored, value)
+        self.nbytes += len(value)
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.nbytes -= len(evicted)
+
+    def _discard(self, key):
+        _, value = self.entries.pop(key)
+        self.nbytes -= len(value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+ヘルスチェックで区切るローリングデプロイ
+
+ノードを --batch-size 台ずつのバッチに分け、バッチ内のノードでは並行して
+1. デプロイのステップ（SSM の send-command か、ローカルのシェルコマンド）を実行し
+2. /health が 200 を返すまで、間隔を倍にしながら（最大 --max-poll-interval 秒）ポーリングする
+バッチの全ノードが ready になってから次のバッチに進みます。ステップの失敗か、--health-timeout 秒以内に
+ready にならないノードがあればそこで止め、ロールバックのステップが指定されていれば、更新したノードを
+同じバッチ単位で（新しいバッチから順に）戻します。
+
+ステップは古いプロセスを止めてから戻る必要があります（止める前に戻ると古いプロセスの /health で ready と判定する）。
+ssm_step() は send-command の後に `aws ssm wait command-executed` でコマンドの完了を待ちます。
+
+    python3 rollout.py --node i-0e25e1dff244332da=13.230.95.222 --node i-07a7f078041b43aee=35.77.218.93 \\
+        --ssm-command 'sudo systemctl restart jan-nano-api' --batch-size 1
+    python3 rollout.py --node i-0e25e1dff244332da=13.230.95.222 \\
+        --command 'ssh ubuntu@{host} bash ~/deploy_script.sh'   # {instance_id} と {host} を置き換える
+"""
+
+import argparse
+import http.client
+import json
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_REGION = "ap-northeast-1"
+
+
+class StepFailed(RuntimeError):
+    """デプロイ・ロールバックのステップが失敗した"""
+
+
+class Node:
+    """デプロイ先の1台"""
+
+    def __init__(self, instance_id, host, port=8000):
+        self.instance_id = instance_id
+        self.host = host
+        self.port = port
+
+    @property
+    def health_url(self):
+        return f"http://{self.host}:{self.port}/health"
+
+    def __repr__(self):
+        return f"Node({self.instance_id!r}, {self.host!r}, {self.port})"
+
+
+def run_command(argv, shell=False):
+    """コマンドを実行して stdout を返す（終了コードが 0 以外なら StepFailed）"""
+    result = subprocess.run(argv, shell=shell, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise StepFailed(result.stderr.strip() or f"終了コード {result.returncode}")
+    return result.stdout
+
+
+def ssm_step(commands, region=DEFAULT_REGION, comment="rollout", aws="aws"):
+    """ノードで commands を AWS-RunShellScript として実行し、完了まで待つステップ"""
+    parameters = json.dumps({"commands": list(commands)})
+
+    def step(node):
+        command_id = run_command([
+            aws, 'ssm', 'send-command', '--instance-ids', node.instance_id,
+            '--document-name', 'AWS-RunShellScript', '--comment', comment, '--parameters', parameters,
+            '--region', region, '--query', 'Command.CommandId', '--output', 'text'
+        ]).strip()
+        run_command([aws, 'ssm', 'wait', 'command-executed', '--command-id', command_id,
+                     '--instance-id', node.instance_id, '--region', region])
+
+    return step
+
+
+def shell_step(template):
+    """template の {instance_id} と {host} を置き換えてローカルのシェルで実行するステップ"""
+
+    def step(node):
+        run_command(template.format(instance_id=node.instance_id, host=node.host), shell=True)
+
+    return step
+
+
+def wait_healthy(url, timeout, interval=0.5, max_interval=8.0, request_timeout=5.0):
+    """url が 200 を返すまで間隔を倍にしながら GET する。timeout 秒以内に返れば True"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=request_timeout) as response:
+                if response.status == 200:
+                    return True
+        except (OSError, http.client.HTTPException):
+            # 接続拒否・タイムアウト・503（HTTPError）は起動中として扱う
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+
+def covered_seconds(intervals):
+    """(開始, 終了) の区間の和の長さ"""
+    total = 0.0
+    end = None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+class NodeResult:
+    """1台分の経過。outages はステップの開始から ready までの (開始, 終了)（time.monotonic() 基準）"""
+
+    def __init__(self, node):
+        self.node = node
+        self.state = "pending"
+        self.error = None
+        self.outages = []
+
+
+class Rollout:
+    """nodes を batch_size 台ずつ、ヘルスチェックで区切って更新する"""
+
+    def __init__(self, nodes, deploy, rollback=None, batch_size=1, health_timeout=300.0, poll_interval=0.5,
+                 max_poll_interval=8.0, log=print):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.nodes = list(nodes)
+        self.deploy = deploy
+        self.rollback = rollback
+        self.batch_size = batch_size
+        self.health_timeout = health_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.log = log or (lambda message: None)
+
+    def run(self):
+        """ロールアウトを実行して結果（report）を返す。report["ok"] は全ノードの更新に成功したか"""
+        started = time.monotonic()
+        results = [NodeResult(node) for node in self.nodes]
+        batches = [results[i:i + self.batch_size] for i in range(0, len(results), self.batch_size)]
+        ok = True
+        completed = 0
+        with ThreadPoolExecutor(max_workers=self.batch_size) as pool:
+            for number, batch in enumerate(batches, 1):
+                self.log(f"バッチ {number}/{len(batches)}: {', '.join(r.node.instance_id for r in batch)}")
+                list(pool.map(lambda result: self._apply(result, self.deploy, "updated"), batch))
+                completed = number
+                failed = [result for result in batch if result.state == "failed"]
+                if failed:
+                    ok = False
+                    self.log(f"❌ バッチ {number} で ready にならないノードがあるため中止します")
+                    break
+
+            if not ok and self.rollback is not None:
+                # 更新したノードを新しいバッチから順に戻す
+                for batch in reversed(batches[:completed]):
+                    list(pool.map(lambda result: self._apply(result, self.rollback, "rolled_back"), batch))
+
+        finished = time.monotonic()
+        return {
+            "ok": ok,
+            "seconds": finished - started,
+            "batches": completed,
+            # 1台以上が止まっていた時間と、止まっていた時間の合計（台・秒）
+            "degraded_seconds": covered_seconds(o for r in results for o in r.outages),
+            "node_seconds_out": sum(stop - start for r in results for start, stop in r.outages),
+            "nodes": [
+                {"instance_id": r.node.instance_id, "host": r.node.host, "state": r.state, "error": r.error,
+                 "seconds_out": sum(stop - start for start, stop in r.outages)}
+                for r in results
+            ],
+        }
+
+    def _apply(self, result, step, state):
+        """1台に step を実行して ready を待つ。result.state は成功なら state、失敗なら "failed" """
+        node = result.node
+        start = time.monotonic()
+        try:
+            step(node)
+            ready = wait_healthy(node.health_url, self.health_timeout, self.poll_interval, self.max_poll_interval)
+            error = None if ready else f"{self.health_timeout:.0f}秒以内に ready になりませんでした"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        end = time.monotonic()
+        result.outages.append((start, end))
+        if error is None:
+            result.state, result.error = state, None
+            self.log(f"✅ {node.instance_id} ({node.host}): {state}（{end - start:.1f}秒）")
+        else:
+            result.state, result.error = "failed", error
+            self.log(f"❌ {node.instance_id} ({node.host}): {error}")
+        return result
+
+
+def parse_node(value, port):
+    instance_id, sep, host = value.partition('=')
+    if not sep or not instance_id or not host:
+        raise argparse.ArgumentTypeError(f"--node は インスタンスID=ホスト の形式です: {value}")
+    return Node(instance_id, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ヘルスチェックで区切るローリングデプロイ")
+    parser.add_argument('--node', action='append', required=True, metavar='INSTANCE_ID=HOST',
+                        help="デプロイ先（並べた順に更新する）")
+    parser.add_argument('--port', type=int, default=8000, help="/health を確認するポート")
+    step = parser.add_mutually_exclusive_group(required=True)
+    step.add_argument('--ssm-command', action='append', help="SSM でノードに実行させるコマンド（複数指定可）")
+    step.add_argument('--command', help="ノード毎にローカルで実行するシェルコマンド（{instance_id}、{host} を置き換える）")
+    rollback = parser.add_mutually_exclusive_group()
+    rollback.add_argument('--ssm-rollback-command', action='append', help="失敗時に SSM で実行するコマンド")
+    rollback.add_argument('--rollback-command', help="失敗時にローカルで実行するシェルコマンド")
+    parser.add_argument('--batch-size', type=int, default=1, help="同時に更新するノード数")
+    parser.add_argument('--health-timeout', type=float, default=300.0, help="ready になるまで待つ秒数")
+    parser.add_argument('--poll-interval', type=float, default=0.5, help="/health の最初のポーリング間隔（秒）")
+    parser.add_argument('--max-poll-interval', type=float, default=8.0, help="/health のポーリング間隔の上限（秒）")
+    parser.add_argument('--region', default=DEFAULT_REGION)
+    parser.add_argument('--json', help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    nodes = [parse_node(value, args.port) for value in args.node]
+    deploy = (ssm_step(args.ssm_command, args.region, "rollout deploy") if args.ssm_command
+              else shell_step(args.command))
+    rollback = None
+    if args.ssm_rollback_command:
+        rollback = ssm_step(args.ssm_rollback_command, args.region, "rollout rollback")
+    elif args.rollback_command:
+        rollback = shell_step(args.rollback_command)
+
+    report = Rollout(nodes, deploy, rollback, batch_size=args.batch_size, health_timeout=args.health_timeout,
+                     poll_interval=args.poll_interval, max_poll_interval=args.max_poll_interval).run()
+    print(f"\n{'完了' if report['ok'] else '失敗'}: {report['seconds']:.1f}秒"
+          f"（1台以上が停止 {report['degraded_seconds']:.1f}秒、停止の合計 {report['node_seconds_out']:.1f}台・秒）")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n結果を保存しました: {args.json}")
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
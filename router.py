@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+複数の API バックエンドの前に置く asyncio のルーター（リバースプロキシ）
+
+ALB の単純なラウンドロビンの代わりに、各バックエンドの混み具合を見て振り分けます。
+
+- queue: バックエンドが応答毎に返す X-Queue-Depth（推論待ち・推論中のリクエスト数）と
+  ルーターから送信中のリクエスト数の大きい方が最も小さいノードへ送る
+- affinity（既定）: queue に加えて、同じ system プロンプトのリクエストを同じノードへ送る
+  （rendezvous hashing）。そのノードのプレフィックスKVキャッシュが温まっているため prefill を省ける。
+  ただし最も空いているノードより --affinity-slack 件以上混んでいれば空いているノードへ送る
+- round_robin: 比較用
+
+バックエンドとは keep-alive 接続を使い回し、応答ボディ（SSE のストリームを含む）は
+受信した bytes をそのまま（再パース・再エンコードせずに）クライアントへ書き出します。
+/health と /router/stats はルーター自身が応答し、それ以外は全てバックエンドへ転送します。
+
+例:
+    python3 router.py --backends http://10.0.0.1:8000,http://10.0.0.2:8000,http://10.0.0.3:8000 --port 8080
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import random
+import urllib.parse
+from http import HTTPStatus
+
+from fastjson import dumps, loads
+from prompting import prefix_key
+from request_limits import RequestRejected, body_length
+
+# バックエンドへ転送しないホップ毎のヘッダー
+HOP_BY_HOP = frozenset([
+    b'connection', b'keep-alive', b'proxy-connection', b'te', b'trailer', b'upgrade', b'host'
+])
+# バックエンド毎に保持する idle 接続の上限
+MAX_IDLE = 64
+# アフィニティのキーを取り出すパス
+AFFINITY_PATHS = frozenset([b'/v1/chat/completions'])
+
+
+class BackendError(Exception):
+    """クライアントに何も返す前にバックエンドとの通信に失敗した（別のノードで再試行できる）"""
+
+
+class Backend:
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.url = url.rstrip('/')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.host_header = parts.netloc.encode('latin-1')
+        self.idle = []
+        self.healthy = True
+        # ルーターから送信中のリクエスト数と、バックエンドが最後に返した X-Queue-Depth
+        self.outstanding = 0
+        self.reported_depth = 0
+        self.requests = 0
+        self.errors = 0
+        self.affinity_hits = 0
+
+    def load(self):
+        return max(self.outstanding, self.reported_depth)
+
+    def rendezvous(self, key):
+        return hashlib.blake2b(self.host_header + key, digest_size=8).digest()
+
+    async def connect(self):
+        """(reader, writer, 使い回した接続か)"""
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable):
+        if reusable and len(self.idle) < MAX_IDLE:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "reported_depth": self.reported_depth,
+            "requests": self.requests,
+            "errors": self.errors,
+            "affinity_hits": self.affinity_hits,
+        }
+
+
+async def read_headers(reader):
+    """ヘッダー行を読み、(生の行のリスト, {小文字の名前: 値}) を返す"""
+    lines = []
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return lines, headers
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        headers[name] = value.strip()
+        lines.append((name, line))
+
+
+class Router:
+    def __init__(self, backends, policy="affinity", affinity_slack=2, health_interval=1.0,
+                 timeout=300, quiet=False):
+        if policy not in ("affinity", "queue", "round_robin"):
+            raise ValueError(f"Unknown policy: {policy}")
+        self.backends = [Backend(url) for url in backends]
+        self.policy = policy
+        self.affinity_slack = affinity_slack
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self.quiet = quiet
+        self._round_robin = itertools.count()
+
+    def affinity_key(self, method, path, body):
+        if self.policy != "affinity" or method != b'POST' or path not in AFFINITY_PATHS:
+            return None
+        try:
+            key = prefix_key(loads(body).get("messages") or [])
+        except (ValueError, AttributeError, KeyError, TypeError):
+            return None
+        return key.encode('utf-8') if isinstance(key, str) else None
+
+    def choose(self, key, exclude):
+        """(バックエンド, アフィニティで選んだか)。候補がなければ (None, False)"""
+        remaining = [backend for backend in self.backends if backend not in exclude]
+        candidates = [backend for backend in remaining if backend.healthy] or remaining
+        if not candidates:
+            return None, False
+        if self.policy == "round_robin":
+            return candidates[next(self._round_robin) % len(candidates)], False
+
+        least = min(backend.load() for backend in candidates)
+        if key is not None:
+            preferred = max(candidates, key=lambda backend: backend.rendezvous(key))
+            if preferred.load() < least + self.affinity_slack:
+                return preferred, True
+        return random.choice([backend for backend in candidates if backend.load() == least]), False
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.split()
+                except ValueError:
+                    break
+                header_lines, headers = await read_headers(reader)
+
+                connection = headers.get(b'connection', b'').lower()
+                keep_alive = connection != b'close' if version == b'HTTP/1.1' else connection == b'keep-alive'
+                # ボディを読む前に検証する（Content-Length が不正なら 400、MAX_BODY_BYTES を超えれば 413、chunked は 411）
+                content_length = headers.get(b'content-length')
+                transfer_encoding = headers.get(b'transfer-encoding')
+                try:
+                    length = body_length(content_length.decode('latin-1') if content_length is not None else None,
+                                         transfer_encoding.decode('latin-1') if transfer_encoding is not None else None)
+                except RequestRejected as e:
+                    await self.respond(writer, e.status, {"error": str(e)}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                path = target.split(b'?', 1)[0]
+                if method == b'GET' and path == b'/health':
+                    healthy = sum(backend.healthy for backend in self.backends)
+                    await self.respond(writer, 200 if healthy else 503,
+                                       {"status": "ok" if healthy else "unavailable",
+                                        "healthy_backends": healthy}, keep_alive)
+                elif method == b'GET' and path == b'/router/stats':
+                    await self.respond(writer, 200, self.stats(), keep_alive)
+                else:
+                    keep_alive = await self.proxy(method, target, path, header_lines, body, writer, keep_alive)
+
+                if not self.quiet:
+                    print(f'"{request_line.decode("latin-1").strip()}"')
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = dumps(payload)
+        writer.write(
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def proxy(self, method, target, path, header_lines, body, client, keep_alive):
+        """バックエンドを選んで転送する。クライアント接続を続けられるかを返す"""
+        key = self.affinity_key(method, path, body)
+        head = b''.join([method, b' ', target, b' HTTP/1.1\r\n'] + [
+            line for name, line in header_lines if name not in HOP_BY_HOP
+        ])
+        tried = []
+        while True:
+            backend, affinity = self.choose(key, tried)
+            if backend is None:
+                await self.respond(client, 502, {"error": "No backend available"}, keep_alive)
+                return keep_alive
+            tried.append(backend)
+            backend.outstanding += 1
+            backend.requests += 1
+            backend.affinity_hits += affinity
+            try:
+                return await self.forward(backend, head, body, client, keep_alive)
+            except BackendError:
+                backend.errors += 1
+                backend.healthy = False
+            except asyncio.TimeoutError:
+                backend.errors += 1
+                await self.respond(client, 504, {"error": "Backend timeout"}, False)
+                return False
+            finally:
+                backend.outstanding -= 1
+
+    async def forward(self, backend, head, body, client, keep_alive):
+        """1件を転送し、応答をそのままクライアントへ流す"""
+        request = head + b'Host: ' + backend.host_header + b'\r\nConnection: keep-alive\r\n\r\n'
+        while True:
+            try:
+                reader, writer, reused = await backend.connect()
+            except OSError as e:
+                raise BackendError(str(e))
+            try:
+                writer.writelines([request, body])
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not status_line:
+                    raise ConnectionResetError("Connection closed by backend")
+                break
+            except asyncio.TimeoutError:
+                # 処理中かもしれないので別のノードには送り直さない
+                writer.close()
+                raise
+            except (OSError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                # idle 中にバックエンドが閉じた接続なら、新しい接続でもう一度だけ送る
+                if not reused:
+                    raise BackendError(str(e))
+            except BaseException:
+                writer.close()
+                raise
+
+        reusable = False
+        try:
+            header_lines, headers = await read_headers(reader)
+            depth = headers.get(b'x-queue-depth')
+            if depth is not None and depth.isdigit():
+                backend.reported_depth = int(depth)
+
+            chunked = b'chunked' in headers.get(b'transfer-encoding', b'').lower()
+            length = headers.get(b'content-length')
+            framed = chunked or length is not None
+            backend_keep_alive = framed and headers.get(b'connection', b'').lower() != b'close' \
+                and status_line.startswith(b'HTTP/1.1')
+            # 長さの指定がない応答は接続を閉じるまでがボディなので、クライアント側も閉じる
+            keep_alive = keep_alive and framed
+
+            client.writelines([status_line] + [
+                line for name, line in header_lines if name not in (b'connection', b'keep-alive')
+            ] + [b'Connection: keep-alive\r\n\r\n' if keep_alive else b'Connection: close\r\n\r\n'])
+
+            if chunked:
+                # チャンクの区切りも含めて受信したまま書き出す（SSE のイベントは1チャンク毎に届く）
+                while True:
+                    size_line = await reader.readline()
+                    size = int(size_line.split(b';', 1)[0], 16)
+                    if size == 0:
+                        trailer, _ = await read_headers(reader)
+                        client.writelines([size_line] + [line for _, line in trailer] + [b'\r\n'])
+                        break
+                    client.writelines([size_line, await reader.readexactly(size + 2)])
+                    await client.drain()
+            elif length is not None:
+                remaining = int(length)
+                while remaining:
+                    data = await reader.read(min(remaining, 65536))
+                    if not data:
+                        raise ConnectionResetError("Connection closed by backend")
+                    client.write(data)
+                    remaining -= len(data)
+                    await client.drain()
+            else:
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    client.write(data)
+                    await client.drain()
+            await client.drain()
+            reusable = backend_keep_alive
+            return keep_alive
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            # 応答の途中でバックエンドかクライアントが切断した。再試行できないのでクライアント接続を閉じる
+            return False
+        finally:
+            backend.release(reader, writer, reusable)
+
+    async def check_health(self, backend):
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(backend.host, backend.port), self.health_interval
+            )
+        except (OSError, asyncio.TimeoutError):
+            backend.healthy = False
+            return
+        try:
+            writer.write(b'GET /health HTTP/1.1\r\nHost: ' + backend.host_header + b'\r\nConnection: close\r\n\r\n')
+            status_line = await asyncio.wait_for(reader.readline(), max(1.0, self.health_interval))
+            _, headers = await read_headers(reader)
+            backend.healthy = status_line.split()[1:2] == [b'200']
+            depth = headers.get(b'x-queue-depth')
+            if depth is not None and depth.isdigit():
+                backend.reported_depth = int(depth)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            backend.healthy = False
+        finally:
+            writer.close()
+
+    async def health_loop(self):
+        while True:
+            await asyncio.gather(*(self.check_health(backend) for backend in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "affinity_slack": self.affinity_slack,
+            "backends": [backend.stats() for backend in self.backends],
+        }
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port, backlog=1024)
+        health = asyncio.create_task(self.health_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            health.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jan Nano API ルーター")
+    parser.add_argument('--backends', required=True, help="バックエンドの URL（カンマ区切り）")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--policy', choices=['affinity', 'queue', 'round_robin'], default='affinity')
+    parser.add_argument('--affinity-slack', type=int, default=2,
+                        help="アフィニティのノードが最も空いているノードよりこの件数以上混んでいれば使わない")
+    parser.add_argument('--health-interval', type=float, default=1.0, help="ヘルスチェックの間隔（秒）")
+    parser.add_argument('--timeout', type=float, default=300, help="バックエンドの応答開始までの上限（秒）")
+    parser.add_argument('--quiet', action='store_true', help="アクセスログを出力しない")
+    args = parser.parse_args()
+
+    router = Router(
+        [url.strip() for url in args.backends.split(',') if url.strip()],
+        policy=args.policy, affinity_slack=args.affinity_slack,
+        health_interval=args.health_interval, timeout=args.timeout, quiet=args.quiet
+    )
+    print(f"Jan Nano API Router: {args.host}:{args.port} ({args.policy})")
+    for backend in router.backends:
+        print(f"  -> {backend.url}")
+    asyncio.run(router.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
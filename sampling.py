@@ -0,0 +1,44 @@
+"""
+トークンサンプリングの共通処理
+リクエスト毎に異なる temperature / top_p をバッチのまま適用します
+"""
+
+import torch
+
+
+def sampling_probs(logits, temperature, top_p):
+    """logits (batch, vocab) から temperature と top_p を適用した確率分布を返す
+
+    temperature / top_p は行毎の値を持つ (batch,) のテンソル。
+    temperature が 0 以下の行は argmax の one-hot（貪欲デコード）になる。
+    """
+    logits = logits.float()
+    greedy = temperature <= 0
+    temperature = torch.where(greedy, torch.ones_like(temperature), temperature)
+    probs = torch.softmax(logits / temperature[:, None], dim=-1)
+
+    # top_p: 確率の高い順に累積し、top_p を超えた以降のトークンを除外（先頭は必ず残す）
+    sorted_probs, sorted_index = probs.sort(dim=-1, descending=True)
+    cumulative = sorted_probs.cumsum(dim=-1)
+    sorted_probs = sorted_probs.masked_fill(cumulative - sorted_probs > top_p[:, None], 0.0)
+    probs = torch.zeros_like(probs).scatter(-1, sorted_index, sorted_probs)
+    probs = probs / probs.sum(dim=-1, keepdim=True)
+
+    if greedy.any():
+        one_hot = torch.nn.functional.one_hot(logits[greedy].argmax(dim=-1), logits.shape[-1])
+        probs[greedy] = one_hot.to(probs.dtype)
+    return probs
+
+
+def sample_tokens(logits, temperature, top_p, generators=None):
+    """行毎のパラメーターで次のトークンをサンプリングし (batch,) のトークンIDを返す
+
+    generators に行毎の torch.Generator（または None）のリストを渡すと、
+    seed を指定したリクエストの行は自分の乱数列でサンプリングする。
+    """
+    probs = sampling_probs(logits, temperature, top_p)
+    if generators is None or not any(generators):
+        return torch.multinomial(probs, 1).squeeze(-1)
+    return torch.cat([
+        torch.multinomial(row, 1, generator=generator) for row, generator in zip(probs, generators)
+    ])
@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 """
 シンプルなJan Nano API互換サーバー
-EC2インスタンスにSSH経由でデプロイ用
+EC2インスタンスに SSM 経由でデプロイします（rollout.py で1台ずつ、/health で ready を確認しながら）
+
+    python3 simple_api.py                 # 1台ずつ
+    python3 simple_api.py --batch-size 2  # 2台ずつ
 """
 
+import argparse
+import base64
+
+from rollout import DEFAULT_REGION, Node, Rollout, ssm_step
+
 SIMPLE_API_CODE = '''#!/usr/bin/env python3
 import json
 import time
@@ -19,6 +27,12 @@ class APIHandler(BaseHTTPRequestHandler):
             self.end_headers()
             response = {"message": "Jan Nano 4B Q8 API Server", "status": "running"}
             self.wfile.write(json.dumps(response).encode())
+
+        elif self.path == '/health':
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"status": "healthy"}).encode())
             
         elif self.path == '/v1/models':
             self.send_response(200)
@@ -93,40 +107,55 @@ INSTANCES = [
     ("i-04d289a5e01244e64", "54.95.55.10")
 ]
 
-print("シンプルAPIサーバーを3台のインスタンスにデプロイします...")
+# 古いプロセスが終了するまで待ってから起動する（rollout.py が古いプロセスの /health を見ないように）
+RESTART_COMMANDS = [
+    "pkill -f 'python3 /tmp/api.py' || true",
+    "while pgrep -f 'python3 /tmp/api.py' > /dev/null; do sleep 0.2; done",
+    "nohup python3 /tmp/api.py > /tmp/api.log 2>&1 &",
+]
 
-# まず現在のインスタンス状態を確認
-import subprocess
-import time
 
-for instance_id, ip in INSTANCES:
-    print(f"\\nインスタンス {instance_id} ({ip}) を処理中...")
-    
-    # SSM経由でコマンド実行を試行
-    try:
-        # APIサーバーファイルを作成
-        cmd1 = f'''aws ssm send-command --instance-ids {instance_id} --document-name "AWS-RunShellScript" --parameters 'commands=["cat > /tmp/api.py << \\'EOF\\'\\n{SIMPLE_API_CODE}\\nEOF\\n", "chmod +x /tmp/api.py", "nohup python3 /tmp/api.py > /tmp/api.log 2>&1 &"]' --region ap-northeast-1'''
-        
-        result = subprocess.run(cmd1, shell=True, capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"✅ {instance_id}: SSMコマンド送信成功")
-        else:
-            print(f"❌ {instance_id}: SSMコマンド失敗 - {result.stderr}")
-            
-    except Exception as e:
-        print(f"❌ {instance_id}: エラー - {str(e)}")
-
-print("\\n=== デプロイ完了 ===")
-print("APIサーバーの起動まで1-2分お待ちください...")
-print("\\nテスト用アドレス:")
-for _, ip in INSTANCES:
-    print(f"  http://{ip}:8000/")
-print(f"\\nLoad Balancer: http://jan-nano-api.teai.io/")
-'''
+def deploy_commands(code):
+    """APIサーバーを /tmp/api.py に置き（前のものは /tmp/api.py.prev に残す）、再起動するコマンド"""
+    encoded = base64.b64encode(code.encode()).decode('ascii')
+    return [
+        f"echo {encoded} | base64 -d > /tmp/api.py.new",
+        "if [ -f /tmp/api.py ]; then cp /tmp/api.py /tmp/api.py.prev; fi",
+        "mv /tmp/api.py.new /tmp/api.py",
+        "chmod +x /tmp/api.py",
+        *RESTART_COMMANDS,
+    ]
+
+
+ROLLBACK_COMMANDS = ["if [ -f /tmp/api.py.prev ]; then cp /tmp/api.py.prev /tmp/api.py; fi", *RESTART_COMMANDS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="シンプルAPIサーバーをEC2インスタンスにデプロイする")
+    parser.add_argument('--batch-size', type=int, default=1, help="同時に更新するインスタンス数")
+    parser.add_argument('--health-timeout', type=float, default=120.0, help="ready になるまで待つ秒数")
+    parser.add_argument('--region', default=DEFAULT_REGION)
+    args = parser.parse_args()
+
+    print(f"シンプルAPIサーバーを{len(INSTANCES)}台のインスタンスにデプロイします...")
+    nodes = [Node(instance_id, ip) for instance_id, ip in INSTANCES]
+    report = Rollout(
+        nodes,
+        ssm_step(deploy_commands(SIMPLE_API_CODE), args.region, "simple_api deploy"),
+        ssm_step(ROLLBACK_COMMANDS, args.region, "simple_api rollback"),
+        batch_size=args.batch_size,
+        health_timeout=args.health_timeout
+    ).run()
+
+    if not report["ok"]:
+        print("\n=== デプロイ失敗（更新したインスタンスはロールバックしました） ===")
+        raise SystemExit(1)
+    print(f"\n=== デプロイ完了（{report['seconds']:.1f}秒） ===")
+    print("\nテスト用アドレス:")
+    for _, ip in INSTANCES:
+        print(f"  http://{ip}:8000/")
+    print("\nLoad Balancer: http://jan-nano-api.teai.io/")
 
-# ファイルとして保存
-with open('/tmp/deploy_simple_api.py', 'w') as f:
-    f.write(SIMPLE_API_CODE)
 
-print("シンプルAPIサーバーコードを生成しました")
-print("EC2インスタンスにSSM経由でデプロイを試行します...")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
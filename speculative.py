@@ -0,0 +1,133 @@
+"""
+ドラフトモデルによる投機的デコーディング（バッチサイズ 1）
+
+小さなドラフトモデルが k トークンを順に提案し、メインモデルは提案をまとめた1回の forward で検証します。
+提案 x は確率 min(1, p(x) / q(x)) で採用し（p: メインモデル、q: ドラフトモデルの分布）、
+不採用の位置では max(0, p - q) を正規化した分布からサンプリングし直すので、
+サンプリング時の出力分布はメインモデルだけで生成した場合と同じになります。
+temperature / top_p は sampling.py の処理を p と q の両方に適用します（temperature 0 は貪欲デコード）。
+
+ドラフトモデルはメインモデルと同じトークナイザー（語彙）である必要があります。
+"""
+
+import threading
+
+import torch
+from transformers import DynamicCache
+
+from sampling import sampling_probs
+
+
+def _probs(logits, temperature, top_p):
+    rows = logits.shape[0]
+    return sampling_probs(logits, torch.full((rows,), float(temperature)), torch.full((rows,), float(top_p)))
+
+
+def _sample(probs, generator):
+    return int(torch.multinomial(probs, 1, generator=generator))
+
+
+def _truncate(cache, length):
+    """KV キャッシュを先頭 length トークンに切り詰める"""
+    excess = cache.get_seq_length() - length
+    if excess > 0:
+        cache.crop(-excess)
+
+
+def speculative_generate(model, draft_model, input_ids, max_new_tokens, temperature=0.0, top_p=1.0,
+                         num_draft_tokens=4, eos_token_id=None, generator=None, on_tokens=None, should_stop=None):
+    """input_ids (1, seq_len) に続けて最大 max_new_tokens トークンを生成し、(プロンプトを含むトークン列, 統計) を返す
+
+    on_tokens(token_ids) は検証毎に確定したトークンのリストで呼ばれる（ストリーミング用）。
+    should_stop() が True を返すと検証の境界で打ち切る。
+    統計は {"rounds": メインモデルの forward 回数, "proposed": 提案数, "accepted": 採用数, "tokens": 生成数}。
+    """
+    tokens = input_ids[0].tolist()
+    prompt_length = len(tokens)
+    main_cache, draft_cache = DynamicCache(), DynamicCache()
+    main_length = draft_length = 0  # 各キャッシュに入っているトークン数
+    stats = {"rounds": 0, "proposed": 0, "accepted": 0, "tokens": 0}
+
+    with torch.no_grad():
+        while len(tokens) - prompt_length < max_new_tokens:
+            if should_stop is not None and should_stop():
+                break
+            # 検証の最後に必ず1トークン加わるので、提案は残りより1少ない数まで
+            k = min(num_draft_tokens, max_new_tokens - (len(tokens) - prompt_length) - 1)
+
+            draft_tokens, draft_probs = [], []
+            feed = tokens[draft_length:]
+            for _ in range(k):
+                logits = draft_model(input_ids=torch.tensor([feed]), past_key_values=draft_cache,
+                                     use_cache=True).logits[0, -1:]
+                draft_length += len(feed)
+                q = _probs(logits, temperature, top_p)[0]
+                token = _sample(q, generator)
+                draft_tokens.append(token)
+                draft_probs.append(q)
+                feed = [token]
+
+            # 未処理のトークンと提案をまとめて1回の forward で検証する
+            logits = model(input_ids=torch.tensor([tokens[main_length:] + draft_tokens]), past_key_values=main_cache,
+                           use_cache=True).logits[0, -(k + 1):]
+            p = _probs(logits, temperature, top_p)
+
+            new_tokens, accepted = [], 0
+            for i, (token, q) in enumerate(zip(draft_tokens, draft_probs)):
+                if torch.rand((), generator=generator) * q[token] < p[i, token]:
+                    new_tokens.append(token)
+                    accepted += 1
+                    if token == eos_token_id:
+                        break
+                else:
+                    residual = (p[i] - q).clamp(min=0)
+                    new_tokens.append(_sample(residual if residual.sum() > 0 else p[i], generator))
+                    break
+            else:
+                # 全て採用されたら、最後の位置の分布からもう1トークン得られる
+                new_tokens.append(_sample(p[k], generator))
+
+            stats["rounds"] += 1
+            stats["proposed"] += k
+            stats["accepted"] += accepted
+
+            # 採用したトークンまでの KV を残す（最後に加えたトークンはまだキャッシュにない）
+            main_length = len(tokens) + accepted
+            _truncate(main_cache, main_length)
+            draft_length = min(draft_length, main_length)
+            _truncate(draft_cache, draft_length)
+
+            if eos_token_id in new_tokens:
+                new_tokens = new_tokens[:new_tokens.index(eos_token_id) + 1]
+            tokens.extend(new_tokens)
+            stats["tokens"] += len(new_tokens)
+            if on_tokens is not None:
+                on_tokens(new_tokens)
+            if new_tokens[-1] == eos_token_id:
+                break
+
+    return torch.tensor([tokens]), stats
+
+
+class SpeculativeStats:
+    """speculative_generate() の統計を集計する（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {"rounds": 0, "proposed": 0, "accepted": 0, "tokens": 0}
+
+    def record(self, stats):
+        with self._lock:
+            for key in self.totals:
+                self.totals[key] += stats[key]
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self.totals)
+        return {
+            **totals,
+            # 提案のうちメインモデルが採用した割合
+            "acceptance_rate": totals["accepted"] / totals["proposed"] if totals["proposed"] else 0.0,
+            # メインモデルの forward 1回あたりの生成トークン数（通常のデコードは 1）
+            "tokens_per_forward": totals["tokens"] / totals["rounds"] if totals["rounds"] else 0.0,
+        }
@@ -0,0 +1,128 @@
+"""
+OpenAI互換ストリーミング（Server-Sent Events）の共通処理
+api_server.py と proven_api.py の両方から利用します
+
+ストリームは chat.completion.chunk イベントの列で、最後に `data: [DONE]` を送ります。
+生成が途中で失敗した場合は、finish_reason のチャンクの代わりに error イベントを送ります。
+"""
+
+import time
+
+from fastjson import Slot, Template, dumps, loads
+
+SSE_HEADERS = [
+    ('Content-Type', 'text/event-stream; charset=utf-8'),
+    ('Cache-Control', 'no-cache'),
+]
+
+DONE_EVENT = b"data: [DONE]\n\n"
+
+# テキスト片の chat.completion.chunk イベント。id・created・model はストリーム毎に bind する
+CONTENT_EVENT = Template({
+    "id": Slot("id"),
+    "object": "chat.completion.chunk",
+    "created": Slot("created"),
+    "model": Slot("model"),
+    "choices": [
+        {
+            "index": 0,
+            "delta": {"content": Slot("content")},
+            "finish_reason": None
+        }
+    ]
+}, prefix=b"data: ", suffix=b"\n\n")
+
+
+def format_event(payload):
+    """辞書を1つの SSE イベント（`data: ...\\n\\n`）にエンコードする"""
+    return b"data: " + dumps(payload) + b"\n\n"
+
+
+def completion_chunk(completion_id, created, model, delta, finish_reason=None):
+    """chat.completion.chunk オブジェクトを作成する"""
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": delta,
+                "finish_reason": finish_reason
+            }
+        ]
+    }
+
+
+def error_event(error):
+    """生成の失敗を伝える SSE イベント（ステータスコードは送信済みなので本文で伝える）"""
+    return format_event({
+        "error": {
+            "message": str(error) or type(error).__name__,
+            "type": type(error).__name__
+        }
+    })
+
+
+def stream_chat_completion(pieces, model, started=None, on_complete=None, finish=None):
+    """生成テキスト片のイテレーターを SSE イベント（bytes）のジェネレーターに変換する
+
+    finish を渡すと、テキスト片を送り終えた後に finish() を呼び、戻り値を finish_reason にする
+    （省略時は "stop"）。finish() が例外を送出したら、finish_reason の代わりに error イベントを送る。
+    started にリクエスト受付時刻（time.perf_counter()）を渡すと、
+    ストリーム終了時に on_complete(stats) を呼び出す。
+    stats には ttft（最初のトークンまでの秒数）、chunks、duration、finish_reason（失敗時は "error"）が入る。
+    """
+    created = int(time.time())
+    completion_id = f"chatcmpl-{created}"
+    if started is None:
+        started = time.perf_counter()
+
+    ttft = None
+    chunks = 0
+    content_event = CONTENT_EVENT.bind(id=completion_id, created=created, model=model)
+
+    yield format_event(completion_chunk(completion_id, created, model, {"role": "assistant", "content": ""}))
+
+    for piece in pieces:
+        if not piece:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        chunks += 1
+        yield content_event.render(content=piece)
+
+    try:
+        finish_reason = finish() if finish is not None else "stop"
+    except Exception as e:
+        finish_reason = "error"
+        yield error_event(e)
+    else:
+        yield format_event(completion_chunk(completion_id, created, model, {}, finish_reason))
+    yield DONE_EVENT
+
+    if on_complete:
+        on_complete({
+            "ttft": ttft,
+            "chunks": chunks,
+            "duration": time.perf_counter() - started,
+            "finish_reason": finish_reason
+        })
+
+
+def iter_events(lines):
+    """SSE レスポンスの行イテレーターから data ペイロード（dict）を順に取り出す
+
+    `data: [DONE]` で終了する。クライアント側（テストスクリプト）用。
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return
+        yield loads(data)
@@ -2,11 +2,19 @@
 """
 SSL証明書検証状況監視スクリプト
 証明書検証完了時にHTTPSリスナーを自動作成
+
+SITES の各サイトについて、証明書（ISSUED）→ HTTPSリスナー → HTTPS エンドポイント（200）の順に
+readiness.py の Watcher で並行して監視します。証明書が ISSUED になった時点でリスナーを作成し、
+リスナーができた時点でエンドポイントの確認を始めます（固定の待ち時間はありません）。
 """
 
-import boto3
+import argparse
+import asyncio
 import time
-import json
+
+import boto3
+
+from readiness import READY, Resource, Watcher, certificate_probe, endpoint_probe, listener_probe
 
 # AWS設定
 REGION = 'ap-northeast-1'
@@ -14,128 +22,106 @@ CERTIFICATE_ARN = 'arn:aws:acm:ap-northeast-1:495350830663:certificate/5e605155-
 LOAD_BALANCER_ARN = 'arn:aws:elasticloadbalancing:ap-northeast-1:495350830663:loadbalancer/app/jan-nano-api-v2/570dd07d7e80ac61'
 TARGET_GROUP_ARN = 'arn:aws:elasticloadbalancing:ap-northeast-1:495350830663:targetgroup/jan-nano-targets-v2/c2fe36bb8c5fcfb6'
 
-def check_certificate_status():
-    """SSL証明書の検証状況を確認"""
-    acm = boto3.client('acm', region_name=REGION)
-    
-    try:
-        response = acm.describe_certificate(CertificateArn=CERTIFICATE_ARN)
-        status = response['Certificate']['Status']
-        
-        print(f"Certificate Status: {status}")
-        
-        if status == 'ISSUED':
-            print("✅ SSL証明書検証完了!")
-            return True
-        elif status == 'PENDING_VALIDATION':
-            print("⏳ SSL証明書検証中...")
-            return False
-        else:
-            print(f"❌ SSL証明書エラー: {status}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ 証明書確認エラー: {e}")
-        return False
-
-def create_https_listener():
-    """HTTPSリスナーを作成"""
-    elbv2 = boto3.client('elbv2', region_name=REGION)
-    
-    try:
-        response = elbv2.create_listener(
-            LoadBalancerArn=LOAD_BALANCER_ARN,
-            Protocol='HTTPS',
-            Port=443,
-            Certificates=[{
-                'CertificateArn': CERTIFICATE_ARN
-            }],
-            DefaultActions=[{
-                'Type': 'forward',
-                'TargetGroupArn': TARGET_GROUP_ARN
-            }]
-        )
-        
-        print("✅ HTTPSリスナー作成成功!")
-        print(f"ListenerArn: {response['Listeners'][0]['ListenerArn']}")
-        return True
-        
-    except Exception as e:
-        print(f"❌ HTTPSリスナー作成失敗: {e}")
-        return False
-
-def test_https_endpoint():
-    """HTTPS接続をテスト"""
-    import requests
-    
-    try:
-        url = "https://jan-nano-api.teai.io/"
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            print("✅ HTTPS接続成功!")
-            print(f"Response: {response.text}")
-            return True
-        else:
-            print(f"❌ HTTPS接続失敗: {response.status_code}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ HTTPS接続テストエラー: {e}")
-        return False
+# 監視するサイト（証明書・ロードバランサー・ターゲットグループ・確認するURL）
+SITES = [
+    {
+        "name": "jan-nano-api",
+        "certificate_arn": CERTIFICATE_ARN,
+        "load_balancer_arn": LOAD_BALANCER_ARN,
+        "target_group_arn": TARGET_GROUP_ARN,
+        "url": "https://jan-nano-api.teai.io/",
+    },
+]
+
+
+def create_https_listener(elbv2, load_balancer_arn, certificate_arn, target_group_arn):
+    """HTTPSリスナーを作成（443 のリスナーが既にあれば何もしない）"""
+    listeners = elbv2.describe_listeners(LoadBalancerArn=load_balancer_arn)['Listeners']
+    if any(listener['Port'] == 443 for listener in listeners):
+        print("HTTPSリスナーは作成済みです")
+        return
+    response = elbv2.create_listener(
+        LoadBalancerArn=load_balancer_arn,
+        Protocol='HTTPS',
+        Port=443,
+        Certificates=[{
+            'CertificateArn': certificate_arn
+        }],
+        DefaultActions=[{
+            'Type': 'forward',
+            'TargetGroupArn': target_group_arn
+        }]
+    )
+    print("✅ HTTPSリスナー作成成功!")
+    print(f"ListenerArn: {response['Listeners'][0]['ListenerArn']}")
+
+
+def print_usage():
+    print("\n🎉 HTTPS設定完了!")
+    print("\n📋 利用可能なエンドポイント:")
+    print("  HTTP:  http://jan-nano-api.teai.io/v1/chat/completions")
+    print("  HTTPS: https://jan-nano-api.teai.io/v1/chat/completions")
+    print("\n✨ Jan Nano 4B Q8 OpenAI互換APIクラスター完全構築完了!")
+
+    # 使用例を表示
+    print("\n📝 使用例:")
+    print("curl -X POST https://jan-nano-api.teai.io/v1/chat/completions \\")
+    print("  -H 'Content-Type: application/json' \\")
+    print("  -d '{\"messages\":[{\"role\":\"user\",\"content\":\"日本語で答えてください\"}]}'")
+
+
+def build_resources(acm, elbv2, sites, deadline=3600.0, max_interval=15.0, ssl_context=None):
+    """サイト毎に 証明書 → リスナー → エンドポイント の Resource を作る（クライアントは全サイトで共有）"""
+    resources = []
+    for site in sites:
+        name = site["name"]
+
+        def create_listener(site=site):
+            return asyncio.to_thread(create_https_listener, elbv2, site["load_balancer_arn"],
+                                     site["certificate_arn"], site["target_group_arn"])
+
+        resources += [
+            Resource(f"{name}/certificate", certificate_probe(acm, site["certificate_arn"]),
+                     action=create_listener, deadline=deadline, max_interval=max_interval),
+            Resource(f"{name}/listener", listener_probe(elbv2, site["load_balancer_arn"]),
+                     after=[f"{name}/certificate"], deadline=deadline, max_interval=max_interval),
+            Resource(f"{name}/endpoint", endpoint_probe(site["url"], ssl_context),
+                     after=[f"{name}/listener"], deadline=deadline, max_interval=max_interval),
+        ]
+    return resources
+
 
 def main():
-    """メイン監視ループ"""
+    """メイン監視"""
+    parser = argparse.ArgumentParser(description="SSL証明書検証状況監視スクリプト")
+    parser.add_argument('--deadline', type=float, default=3600.0, help="リソース毎に ready を待つ秒数")
+    parser.add_argument('--max-interval', type=float, default=15.0, help="確認間隔の上限（秒）")
+    args = parser.parse_args()
+
     print("🔍 SSL証明書検証監視開始...")
-    print(f"証明書ARN: {CERTIFICATE_ARN}")
-    print(f"監視間隔: 60秒")
+    for site in SITES:
+        print(f"{site['name']}: 証明書ARN {site['certificate_arn']}")
+    print(f"確認間隔: 1秒から倍々に最大 {args.max_interval:.0f}秒")
     print("-" * 50)
-    
-    https_created = False
-    check_count = 0
-    
-    while not https_created and check_count < 60:  # 最大60回 (1時間)
-        check_count += 1
-        print(f"\n[チェック {check_count}/60] {time.strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        # 証明書状況確認
-        if check_certificate_status():
-            print("\n🎉 SSL証明書検証完了! HTTPSリスナーを作成します...")
-            
-            # HTTPSリスナー作成
-            if create_https_listener():
-                print("\n⏳ HTTPS接続テスト中...")
-                time.sleep(30)  # DNS伝播とリスナー起動を待機
-                
-                # HTTPS接続テスト
-                if test_https_endpoint():
-                    print("\n🎉 HTTPS設定完了!")
-                    print("\n📋 利用可能なエンドポイント:")
-                    print("  HTTP:  http://jan-nano-api.teai.io/v1/chat/completions")
-                    print("  HTTPS: https://jan-nano-api.teai.io/v1/chat/completions")
-                    print("\n✨ Jan Nano 4B Q8 OpenAI互換APIクラスター完全構築完了!")
-                    
-                    # 使用例を表示
-                    print("\n📝 使用例:")
-                    print("curl -X POST https://jan-nano-api.teai.io/v1/chat/completions \\")
-                    print("  -H 'Content-Type: application/json' \\")
-                    print("  -d '{\"messages\":[{\"role\":\"user\",\"content\":\"日本語で答えてください\"}]}'")
-                    
-                    https_created = True
-                else:
-                    print("⚠️ HTTPS接続テスト失敗、もう少し待機が必要かもしれません")
-            else:
-                print("❌ HTTPSリスナー作成失敗")
-                break
+
+    acm = boto3.client('acm', region_name=REGION)
+    elbv2 = boto3.client('elbv2', region_name=REGION)
+    watcher = Watcher(build_resources(acm, elbv2, SITES, args.deadline, args.max_interval),
+                      on_transition=lambda resource, state: print(
+                          f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {resource.name}: {state}"
+                          f"（{resource.attempts}回目）" + (f" - {resource.error}" if resource.error else "")))
+    resources = asyncio.run(watcher.run())
+
+    for site in SITES:
+        if resources[f"{site['name']}/endpoint"].state == READY:
+            print_usage()
         else:
-            # 60秒待機
-            print("次のチェックまで60秒待機...")
-            time.sleep(60)
-    
-    if not https_created:
-        print("\n⚠️ タイムアウトまたはエラーのため監視を終了")
-        print("手動で証明書状況を確認してください:")
-        print(f"aws acm describe-certificate --certificate-arn {CERTIFICATE_ARN} --region {REGION}")
+            print(f"\n⚠️ {site['name']}: タイムアウトまたはエラーのため監視を終了")
+            if resources[f"{site['name']}/certificate"].state == READY:
+                continue
+            print("手動で証明書状況を確認してください:")
+            print(f"aws acm describe-certificate --certificate-arn {site['certificate_arn']} --region {REGION}")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -7,52 +7,138 @@ date
 cat > /home/ubuntu/api.py << 'EOF'
 #!/usr/bin/env python3
 import json
+import os
+import signal
+import threading
 import time
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+# /metrics 用のルート・ステータス別リクエスト数（シングルスレッドのサーバーなのでロック不要）
+ROUTES = ('/', '/health', '/metrics', '/v1/models', '/v1/chat/completions')
+REQUEST_COUNTS = {}
+
+def render_metrics():
+    lines = ['# HELP jan_nano_http_requests_total HTTP requests by route and status',
+             '# TYPE jan_nano_http_requests_total counter']
+    for (method, route, status), count in sorted(REQUEST_COUNTS.items()):
+        lines.append(f'jan_nano_http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    lines += ['# HELP jan_nano_process_resident_memory_bytes Resident memory size',
+              '# TYPE jan_nano_process_resident_memory_bytes gauge',
+              f'jan_nano_process_resident_memory_bytes {rss}']
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+# 応答は内容が変わらないので起動時にエンコードしておく
+STATIC_RESPONSES = {
+    '/': json.dumps({"message": "Jan Nano 4B Q8 API Server", "status": "running"}).encode('utf-8'),
+    '/health': json.dumps({"status": "healthy"}).encode('utf-8'),
+    '/v1/models': json.dumps({"object": "list", "data": [{"id": "jan-nano-4b-q8", "object": "model"}]}).encode('utf-8'),
+}
+NOT_FOUND = json.dumps({"error": "Not found"}).encode('utf-8')
+# SIGTERM を受けたら /health を 503 にし、DRAIN_GRACE 秒後に受け付けを止める（ALB がターゲットを外す猶予）
+DRAINING_BODY = json.dumps({"status": "draining"}).encode('utf-8')
+DRAIN_GRACE = float(os.environ.get('JAN_NANO_DRAIN_GRACE', '15'))
+draining = threading.Event()
+# リクエストの上限（proven_api.py / api_server.py の request_limits.py と同じ）
+MAX_BODY_BYTES = int(os.environ.get('JAN_NANO_MAX_BODY_BYTES', str(1024 * 1024)))
+MAX_MESSAGES = int(os.environ.get('JAN_NANO_MAX_MESSAGES', '256'))
+MAX_TOKENS_LIMIT = int(os.environ.get('JAN_NANO_MAX_TOKENS_LIMIT', '4096'))
+
+def check_request(headers, rfile):
+    """Content-Length をボディを読む前に検証し、ボディを 64 KiB ずつ読んで検証する。(ステータス, エラー) を返す"""
+    if headers.get('Transfer-Encoding'):
+        return 411, "Transfer-Encoding is not supported, send Content-Length"
+    value = (headers.get('Content-Length') or '0').strip()
+    if not (value.isascii() and value.isdigit()):
+        return 400, "Invalid Content-Length"
+    remaining = int(value)
+    if remaining > MAX_BODY_BYTES:
+        return 413, f"Request body exceeds {MAX_BODY_BYTES} bytes"
+    chunks = []
+    while remaining > 0:
+        chunk = rfile.read(min(65536, remaining))
+        if not chunk:
+            return 400, "Incomplete request body"
+        if not chunks and chunk.lstrip()[:1] not in (b'{', b''):
+            return 400, "Request body must be a JSON object"
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    try:
+        data = json.loads(b''.join(chunks))
+    except ValueError:
+        return 400, "Invalid JSON"
+    messages = data.get('messages', []) if isinstance(data, dict) else None
+    if not isinstance(messages, list):
+        return 400, "messages must be a list"
+    if len(messages) > MAX_MESSAGES:
+        return 400, f"Too many messages ({len(messages)} > {MAX_MESSAGES})"
+    if not all(isinstance(m, dict) and isinstance(m.get('role'), str) and isinstance(m.get('content'), str)
+               for m in messages):
+        return 400, "Each message must have a string role and content"
+    max_tokens = data.get('max_tokens')
+    if max_tokens is not None and (type(max_tokens) is not int or not 1 <= max_tokens <= MAX_TOKENS_LIMIT):
+        return 400, f"max_tokens must be an integer between 1 and {MAX_TOKENS_LIMIT}"
+    return 200, None
+
+CHAT_RESPONSE = json.dumps({
+    "choices": [{
+        "message": {"content": "こんにちは！Jan Nano 4B Q8モデルです。"},
+        "finish_reason": "stop"
+    }],
+    "usage": {"total_tokens": 10}
+}, ensure_ascii=False).encode('utf-8')
+
 class JanNanoAPIHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
+    def send_json(self, body, code=200):
+        self.send_response(code)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        
-        if self.path == '/':
-            response = {"message": "Jan Nano 4B Q8 API Server", "status": "running"}
-        elif self.path == '/health':
-            response = {"status": "healthy"}
-        elif self.path == '/v1/models':
-            response = {"object": "list", "data": [{"id": "jan-nano-4b-q8", "object": "model"}]}
-        else:
-            response = {"error": "Not found"}
-            
-        self.wfile.write(json.dumps(response).encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_response(self, code, message=None):
+        key = (self.command, self.path if self.path in ROUTES else 'other', code)
+        REQUEST_COUNTS[key] = REQUEST_COUNTS.get(key, 0) + 1
+        super().send_response(code, message)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = render_metrics()
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == '/health' and draining.is_set():
+            self.send_json(DRAINING_BODY, 503)
+            return
+        self.send_json(STATIC_RESPONSES.get(self.path, NOT_FOUND))
     
     def do_POST(self):
         if self.path == '/v1/chat/completions':
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            
-            response = {
-                "choices": [{
-                    "message": {"content": "こんにちは！Jan Nano 4B Q8モデルです。"},
-                    "finish_reason": "stop"
-                }],
-                "usage": {"total_tokens": 10}
-            }
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            code, error = check_request(self.headers, self.rfile)
+            if error:
+                self.send_json(json.dumps({"error": error}).encode('utf-8'), code)
+            else:
+                self.send_json(CHAT_RESPONSE)
         else:
             self.send_response(404)
             self.end_headers()
 
 if __name__ == '__main__':
     server = HTTPServer(('0.0.0.0', 8000), JanNanoAPIHandler)
+
+    def on_sigterm(signum, frame):
+        if not draining.is_set():
+            draining.set()
+            # シングルスレッドなので、処理中のリクエストは serve_forever() が止まる前に終わる
+            threading.Timer(DRAIN_GRACE, server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, on_sigterm)
     server.serve_forever()
+    server.server_close()
 EOF
 
 # 権限設定
@@ -71,6 +157,8 @@ User=ubuntu
 ExecStart=/usr/bin/python3 /home/ubuntu/api.py
 Restart=always
 RestartSec=3
+# SIGTERM の後 JAN_NANO_DRAIN_GRACE（15秒）drain してから終了する
+TimeoutStopSec=30
 
 [Install]
 WantedBy=multi-user.target
@@ -0,0 +1,135 @@
+"""
+マルチテナントの設定（API キー → テナント、優先度クラス、トークンバケットのレート制限）
+
+推論の待機キュー（admission.FairQueue）は、リクエストのテナントの優先度クラスと重みで順番を決めます。
+- API キー（Authorization: Bearer）毎にテナントを割り当てる。キーがない・未登録なら既定のテナント
+- 優先度クラス: priority の大きいクラスから実行し、満杯のキューでは低いクラスのリクエストを押し出す。
+  待ち時間が slo_ms を超えたリクエストはクラスに関係なく先に実行する
+- 重み付き公平キューイング: 同じクラスの中は、見込みのトークン数（プロンプト + max_tokens）を weight で割った分を
+  テナント毎に積み、少ないテナントから実行する。policy が "sjf" なら見込みのトークン数が小さい順
+- レート制限: テナント毎に毎秒 rate トークン、最大 burst トークンのトークンバケット。足りなければ
+  RateLimited（HTTP 429 + Retry-After）
+
+設定は JSON（api_server.py では JAN_NANO_TENANTS_FILE）:
+
+    {
+      "policy": "wfq",
+      "classes": {"interactive": {"priority": 2, "slo_ms": 5000}, "batch": {"priority": 0, "slo_ms": 600000}},
+      "default": {"class": "standard"},
+      "tenants": {
+        "chat-app": {"api_keys": ["sk-chat"], "class": "interactive", "weight": 4},
+        "nightly-eval": {"api_keys": ["sk-eval"], "class": "batch", "rate": 2000, "burst": 8000}
+      }
+    }
+
+classes は DEFAULT_CLASSES に足す（同じ名前なら置き換える）。既定のテナントは未登録のキーすべてで共有する。
+"""
+
+import json
+import math
+import threading
+import time
+
+from admission import FairQueue, PriorityClass, QueueTenant, RateLimited
+
+POLICIES = ("wfq", "sjf")
+
+DEFAULT_CLASSES = {
+    "interactive": {"priority": 2, "slo_ms": 5000},
+    "standard": {"priority": 1, "slo_ms": 30000},
+    "batch": {"priority": 0, "slo_ms": 600000},
+}
+
+
+class TokenBucket:
+    """毎秒 rate トークンずつ、最大 burst トークンまで貯まるバケット"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount):
+        """amount トークンを取り出して 0 を返す。足りなければ取り出さずに、貯まるまでの秒数を返す
+
+        burst より大きいリクエストは、バケットが満タンなら通す（いつまでも通らないことはない）。
+        """
+        amount = min(amount, self.burst)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < amount:
+                return (amount - self.tokens) / self.rate
+            self.tokens -= amount
+            return 0.0
+
+    def give_back(self, amount):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + min(amount, self.burst))
+
+
+class Tenant(QueueTenant):
+    """API キーで識別するテナント（rate を指定するとトークンバケットでレート制限する）"""
+
+    def __init__(self, name, priority_class, weight=1.0, rate=None, burst=None):
+        super().__init__(name, priority_class, weight)
+        self.bucket = TokenBucket(rate, burst) if rate else None
+
+    def acquire(self, cost):
+        if self.bucket is None:
+            return
+        wait = self.bucket.take(cost)
+        if wait > 0:
+            raise RateLimited(self.name, max(1, math.ceil(wait)))
+
+    def release(self, cost):
+        if self.bucket is not None:
+            self.bucket.give_back(cost)
+
+
+class Tenants:
+    """API キーからテナントを引く表"""
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.policy = config.get("policy", "wfq")
+        if self.policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}: {self.policy}")
+        self.classes = {
+            name: PriorityClass(name, spec.get("priority", 0),
+                                spec["slo_ms"] / 1000 if spec.get("slo_ms") is not None else None)
+            for name, spec in {**DEFAULT_CLASSES, **config.get("classes", {})}.items()
+        }
+        self.default = self._tenant("default", config.get("default", {"class": "standard"}))
+        self.tenants = {"default": self.default}
+        self._by_key = {}
+        for name, spec in config.get("tenants", {}).items():
+            tenant = self.tenants[name] = self._tenant(name, spec)
+            for api_key in spec.get("api_keys", []):
+                if api_key in self._by_key:
+                    raise ValueError(f"API key of tenant {name} is also used by {self._by_key[api_key].name}")
+                self._by_key[api_key] = tenant
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def _tenant(self, name, spec):
+        class_name = spec.get("class", "standard")
+        if class_name not in self.classes:
+            raise ValueError(f"Unknown class for tenant {name}: {class_name}")
+        weight = spec.get("weight", 1.0)
+        if weight <= 0:
+            raise ValueError(f"weight of tenant {name} must be positive")
+        return Tenant(name, self.classes[class_name], weight, spec.get("rate"), spec.get("burst"))
+
+    def resolve(self, api_key):
+        """API キーのテナント（None・未登録なら既定のテナント）"""
+        return self._by_key.get(api_key, self.default)
+
+    def fair_queue(self):
+        return FairQueue(sjf=self.policy == "sjf")
@@ -8,6 +8,8 @@ import requests
 import json
 import time
 
+from sse import iter_events
+
 API_BASE = "http://13.230.95.222:8000"
 
 def test_health_check():
@@ -81,6 +83,66 @@ def test_chat_completion():
         print(f"Error: {e}")
         return False
 
+def test_streaming_chat_completion():
+    """ストリーミング（stream: true）テスト - 最初のトークンまでの時間 (TTFT) を計測"""
+    print("\n=== ストリーミングテスト ===")
+    
+    payload = {
+        "model": "jan-nano-4b-q8",
+        "messages": [
+            {"role": "user", "content": "日本の首都について教えてください。"}
+        ],
+        "max_tokens": 150,
+        "temperature": 0.7,
+        "stream": True
+    }
+    
+    try:
+        start_time = time.time()
+        first_token_time = None
+        chunks = []
+        
+        response = requests.post(
+            f"{API_BASE}/v1/chat/completions",
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            stream=True,
+            timeout=60
+        )
+        
+        print(f"Status: {response.status_code}")
+        print(f"Content-Type: {response.headers.get('Content-Type')}")
+        
+        if response.status_code != 200:
+            print(f"Error response: {response.text}")
+            return False
+        
+        for event in iter_events(response.iter_lines()):
+            if event.get("object") != "chat.completion.chunk":
+                print(f"Unexpected object: {event.get('object')}")
+                return False
+            content = event["choices"][0]["delta"].get("content")
+            if content:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                chunks.append(content)
+        
+        end_time = time.time()
+        
+        if first_token_time is None:
+            print("トークンを受信できませんでした")
+            return False
+        
+        print(f"TTFT (最初のトークンまで): {first_token_time - start_time:.2f}秒")
+        print(f"合計時間: {end_time - start_time:.2f}秒")
+        print(f"チャンク数: {len(chunks)}")
+        print(f"\n生成されたメッセージ: {''.join(chunks)}")
+        return True
+        
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+
 def test_openai_compatibility():
     """OpenAI互換性テスト"""
     print("\n=== OpenAI互換性テスト ===")
@@ -155,6 +217,7 @@ def main():
     tests = [
         ("モデル一覧取得", test_list_models),
         ("チャット完了", test_chat_completion),
+        ("ストリーミング", test_streaming_chat_completion),
         ("OpenAI互換性", test_openai_compatibility)
     ]
     
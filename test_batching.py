@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+連続バッチングのスケジューラー（batching.py）の失敗時の後始末のテスト
+
+forward が例外を送出するモデルで、ストリーミングのリクエストのプリフィルを失敗させ、
+future に例外が入ることと、ストリーマー（TextIteratorStreamer）の読み出しが終わることを確かめます。
+SSE（sse.stream_chat_completion）は finish_reason "stop" ではなく error イベントで終わることも確かめます。
+
+    python3 test_batching.py
+    python3 -m pytest -q test_batching.py
+"""
+
+import queue
+
+from transformers import TextIteratorStreamer
+
+from batching import ContinuousBatchScheduler
+from fastjson import loads
+from sse import stream_chat_completion
+from tiny_model import build_tiny_tokenizer
+
+# ストリーマーの読み出しを待つ上限（終わらなければ queue.Empty）
+STREAM_TIMEOUT = 5
+
+
+class FailingModel:
+    """forward が必ず失敗するモデル"""
+
+    def __call__(self, **kwargs):
+        raise RuntimeError("forward failed")
+
+
+def submit_failing_stream():
+    """プリフィルが失敗するスケジューラーにストリーミングのリクエストを投入し、(リクエスト, ストリーマー) を返す"""
+    streamer = TextIteratorStreamer(build_tiny_tokenizer(), skip_prompt=False, timeout=STREAM_TIMEOUT)
+    scheduler = ContinuousBatchScheduler(FailingModel(), eos_token_id=1).start()
+    try:
+        request = scheduler.submit([0, 5, 6, 7], max_new_tokens=4, streamer=streamer)
+        request.future.exception(timeout=STREAM_TIMEOUT)
+    finally:
+        scheduler.stop()
+    return request, streamer
+
+
+def test_failed_prefill_ends_stream():
+    request, streamer = submit_failing_stream()
+    assert isinstance(request.future.exception(), RuntimeError)
+    try:
+        pieces = list(streamer)
+    except queue.Empty:
+        raise AssertionError("streamer was not ended after the prefill failed")
+    assert "".join(pieces) == ""
+
+
+def test_failed_prefill_sends_error_event():
+    request, streamer = submit_failing_stream()
+
+    def finish():
+        # api_server.scheduled_completion と同じ
+        request.future.result()
+        return request.finish_reason
+
+    events = list(stream_chat_completion(streamer, "tiny", finish=finish))
+    assert events[-1] == b"data: [DONE]\n\n"
+    last = loads(events[-2][len(b"data: "):])
+    assert last["error"]["type"] == "RuntimeError"
+    assert all(b'"finish_reason":"stop"' not in event for event in events)
+
+
+def main():
+    test_failed_prefill_ends_stream()
+    test_failed_prefill_sends_error_event()
+    print("プリフィルの失敗でストリームが error イベントで終わりました")
+
+
+if __name__ == "__main__":
+    main()
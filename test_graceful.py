@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+SIGTERM での drain と SO_REUSEPORT での再起動の引き継ぎ（graceful.py）のテスト
+
+負荷をかけたまま、同じポートに --reuse-port で新しいプロセスを起動し、/health が新しいプロセスの pid を
+返すようになってから古いプロセスに SIGTERM を送ります。失敗したリクエストが0件であることを
+proven_api.py（thread / asyncio）と api_server.py（小さなチェックポイント）で確かめます。
+比較として、引き継ぎなしの再起動（停止してから起動、systemd の Restart と同じ）の失敗数も表示します。
+
+    python3 test_graceful.py
+    python3 -m pytest -q test_graceful.py
+"""
+
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from test_support import HERE, free_port, start_server
+from tiny_model import save_tiny_checkpoint
+
+CLIENTS = 8
+
+
+class Load:
+    """clients 本の keep-alive 接続でチャットのリクエストを送り続け、成功数と失敗を数える"""
+
+    def __init__(self, port, body, clients=CLIENTS):
+        self.port = port
+        self.body = body
+        self.ok = 0
+        self.failures = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._client, daemon=True) for _ in range(clients)]
+
+    def __enter__(self):
+        for t in self._threads:
+            t.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        for t in self._threads:
+            t.join()
+
+    def _client(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        while not self._stopped.is_set():
+            try:
+                conn.request('POST', '/v1/chat/completions', body=self.body,
+                             headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                error = None if response.status == 200 else f"HTTP {response.status}"
+            except (OSError, http.client.HTTPException) as e:
+                error = type(e).__name__
+                conn.close()
+            with self._lock:
+                if error is None:
+                    self.ok += 1
+                else:
+                    self.failures.append(error)
+            if error is not None:
+                time.sleep(0.01)
+        conn.close()
+
+
+def get_health(port):
+    """(ステータス, JSON)。接続できなければ (None, None)"""
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        conn.request('GET', '/health')
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    except (OSError, http.client.HTTPException, ValueError):
+        return None, None
+    finally:
+        conn.close()
+
+
+def wait_for_pid(port, pid, timeout=120):
+    """/health が pid のプロセスから 200 を返すまで待つ（新しい接続が新しいプロセスに届いている）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, body = get_health(port)
+        if status == 200 and body.get("pid") == pid:
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"pid {pid} が {timeout}秒以内に ready になりませんでした")
+
+
+def start_proven_api(mode, port, reuse_port=True):
+    extra = ('--drain-grace', '1', '--reuse-port') if reuse_port else ('--drain-grace', '1')
+    return start_server(mode, port, 16, 0.2, extra_args=extra)
+
+
+def start_api_server(model_path, port):
+    env = dict(os.environ, JAN_NANO_MODEL_PATH=model_path, JAN_NANO_PORT=str(port), JAN_NANO_WARMUP_TOKENS='0',
+               JAN_NANO_MAX_BATCH='8', JAN_NANO_REUSE_PORT='1', JAN_NANO_DRAIN_GRACE='1')
+    return subprocess.Popen([sys.executable, os.path.join(HERE, 'api_server.py')], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def restart_under_load(start, port, body, handoff=True, settle=1.0):
+    """負荷をかけたまま再起動し、(成功数, 失敗のリスト, 古いプロセスの終了コード, drain の秒数) を返す"""
+    old = start()
+    new = None
+    try:
+        wait_for_pid(port, old.pid)
+        with Load(port, body) as load:
+            time.sleep(settle)
+            if handoff:
+                new = start()
+                wait_for_pid(port, new.pid)
+            drain_started = time.monotonic()
+            old.send_signal(signal.SIGTERM)
+            old.wait(timeout=60)
+            drain_seconds = time.monotonic() - drain_started
+            if not handoff:
+                new = start()
+                wait_for_pid(port, new.pid)
+            time.sleep(settle)
+        return load.ok, load.failures, old.returncode, drain_seconds
+    finally:
+        for proc in (old, new):
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+def chat_body(max_tokens=8):
+    payload = {
+        "model": "jan-nano-4b-q8",
+        "messages": [
+            {"role": "system", "content": "あなたは日本語AIアシスタントです。"},
+            {"role": "user", "content": "「存在とは何か」という問いについて、西洋哲学と東洋哲学の違いを比較してください。"}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0
+    }
+    return json.dumps(payload).encode()
+
+
+def check_handoff(mode):
+    port = free_port()
+    ok, failures, returncode, drain_seconds = restart_under_load(lambda: start_proven_api(mode, port), port,
+                                                                 chat_body())
+    assert ok > 0
+    assert failures == [], failures
+    assert returncode == 0
+    return ok, failures, drain_seconds
+
+
+def test_proven_api_thread_handoff():
+    check_handoff('thread')
+
+
+def test_proven_api_asyncio_handoff():
+    check_handoff('asyncio')
+
+
+def test_drain_finishes_in_flight_and_reports_draining():
+    port = free_port()
+    proc = start_server('thread', port, 16, 2.0, extra_args=('--drain-grace', '0.5'))
+    try:
+        result = {}
+
+        def slow_request():
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request('POST', '/v1/chat/completions', body=chat_body(), headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            result.update(status=response.status, body=response.read(), connection=response.getheader('Connection'))
+
+        request = threading.Thread(target=slow_request)
+        request.start()
+        time.sleep(0.3)
+        proc.send_signal(signal.SIGTERM)
+        time.sleep(0.1)
+        status, body = get_health(port)
+        assert status == 503 and body["status"] == "draining"
+
+        # grace の後は接続を受け付けない
+        time.sleep(0.8)
+        assert get_health(port) == (None, None)
+        request.join()
+        assert result["status"] == 200
+        assert result["connection"] == "close"
+        assert proc.wait(timeout=10) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def run_api_server_handoff():
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = save_tiny_checkpoint(os.path.join(tmp, 'model'), hidden_size=64, num_layers=2)
+        port = free_port()
+        ok, failures, returncode, drain_seconds = restart_under_load(lambda: start_api_server(model_path, port),
+                                                                     port, chat_body(), settle=2.0)
+    # uvicorn は drain の後に SIGTERM を再送して終了する
+    assert returncode in (0, -signal.SIGTERM), returncode
+    return ok, failures, drain_seconds
+
+
+def test_api_server_handoff():
+    ok, failures, _ = run_api_server_handoff()
+    assert ok > 0
+    assert failures == [], failures
+
+
+def main():
+    test_drain_finishes_in_flight_and_reports_draining()
+    print("✅ test_drain_finishes_in_flight_and_reports_draining")
+
+    rows = []
+    for mode in ('thread', 'asyncio'):
+        ok, failures, drain_seconds = check_handoff(mode)
+        rows.append((f"proven_api {mode} handoff", ok, failures, drain_seconds))
+        print(f"✅ test_proven_api_{mode}_handoff")
+    ok, failures, drain_seconds = run_api_server_handoff()
+    assert ok > 0 and failures == [], failures
+    rows.append(("api_server handoff", ok, failures, drain_seconds))
+    print("✅ test_api_server_handoff")
+
+    port = free_port()
+    ok, failures, _, drain_seconds = restart_under_load(lambda: start_proven_api('thread', port, reuse_port=False),
+                                                        port, chat_body(), handoff=False)
+    rows.append(("proven_api stop → start", ok, failures, drain_seconds))
+
+    print(f"\n=== 負荷をかけたままの再起動（{CLIENTS}クライアント） ===")
+    print(f"{'restart':<26} {'ok':>6} {'failed':>7} {'drain':>7}  errors")
+    for name, ok, failures, drain_seconds in rows:
+        errors = {error: failures.count(error) for error in sorted(set(failures))}
+        print(f"{name:<26} {ok:>6} {len(failures):>7} {drain_seconds:>6.1f}s  {errors or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,14 @@ Jan Nano 4B Q8 クラスター - 日本語複雑質問テスト
 """
 
 import requests
+import asyncio
 import json
 import time
 import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cluster_client import ClusterClient
+from loadgen import run_batch, summarize
+from quality import evaluate_response_quality
 
 # クラスター設定
 ALB_ENDPOINT = "http://jan-nano-api-alb-979792439.ap-northeast-1.elb.amazonaws.com"
@@ -18,6 +22,9 @@ INDIVIDUAL_ENDPOINTS = [
     "http://43.207.37.132:8000"
 ]
 
+# 同時に送信するリクエスト数（エンドポイント毎）
+CONCURRENCY = 3
+
 # 複雑な日本語質問セット
 COMPLEX_QUESTIONS = [
     {
@@ -57,9 +64,9 @@ COMPLEX_QUESTIONS = [
     }
 ]
 
-def send_request(endpoint, question_data, test_id):
-    """API リクエストを送信"""
-    payload = {
+def build_payload(question_data):
+    """質問のリクエストボディ"""
+    return {
         "model": "jan-nano-4b-q8",
         "messages": [
             {
@@ -74,6 +81,10 @@ def send_request(endpoint, question_data, test_id):
         "max_tokens": 800,
         "temperature": 0.7
     }
+
+def send_request(endpoint, question_data, test_id):
+    """API リクエストを送信"""
+    payload = build_payload(question_data)
     
     try:
         start_time = time.time()
@@ -118,34 +129,9 @@ def send_request(endpoint, question_data, test_id):
             "success": False
         }
 
-def evaluate_response_quality(response_text, keywords):
-    """回答の質を評価"""
-    score = 0
-    
-    # キーワード含有チェック
-    keyword_count = sum(1 for keyword in keywords if keyword in response_text)
-    score += (keyword_count / len(keywords)) * 30
-    
-    # 文字数による複雑さ評価
-    char_count = len(response_text)
-    if char_count > 1000:
-        score += 25
-    elif char_count > 500:
-        score += 15
-    elif char_count > 200:
-        score += 10
-    
-    # 論理的構造の評価（簡易）
-    logical_indicators = ["まず", "次に", "さらに", "結論として", "一方で", "しかし", "したがって"]
-    logical_count = sum(1 for indicator in logical_indicators if indicator in response_text)
-    score += min(logical_count * 5, 25)
-    
-    # 学術的表現の評価
-    academic_terms = ["分析", "考察", "論証", "検討", "仮説", "理論", "概念", "観点"]
-    academic_count = sum(1 for term in academic_terms if term in response_text)
-    score += min(academic_count * 3, 20)
-    
-    return min(score, 100)
+async def run_endpoints(endpoints, payloads):
+    """全エンドポイントに同じ質問セットを並行して送信する"""
+    return await asyncio.gather(*(run_batch(endpoint, payloads, CONCURRENCY) for endpoint in endpoints))
 
 def test_cluster_performance():
     """クラスター全体のパフォーマンステスト"""
@@ -166,17 +152,19 @@ def test_cluster_performance():
     
     # 個別インスタンスの稼働確認
     print("\n2. 個別インスタンス稼働確認...")
+    # 全インスタンスの /health を並行して確認する
+    client = ClusterClient(INDIVIDUAL_ENDPOINTS, health_interval=None, health_timeout=5)
+    try:
+        health = client.check_health()
+    finally:
+        client.close()
     active_endpoints = []
     for i, endpoint in enumerate(INDIVIDUAL_ENDPOINTS):
-        try:
-            response = requests.get(f"{endpoint}/", timeout=15)
-            if response.status_code == 200:
-                print(f"✅ インスタンス{i+1} ({endpoint}) 正常稼働")
-                active_endpoints.append(endpoint)
-            else:
-                print(f"❌ インスタンス{i+1} ({endpoint}) 応答不良")
-        except Exception as e:
-            print(f"❌ インスタンス{i+1} ({endpoint}) 接続失敗")
+        if health[endpoint.rstrip('/')]:
+            print(f"✅ インスタンス{i+1} ({endpoint}) 正常稼働")
+            active_endpoints.append(endpoint)
+        else:
+            print(f"❌ インスタンス{i+1} ({endpoint}) 応答不良")
     
     if not active_endpoints:
         print("❌ 稼働中のインスタンスがありません")
@@ -190,26 +178,50 @@ def test_cluster_performance():
     test_results = []
     test_id = 1
     
-    # 各質問をランダムなエンドポイントに送信
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        futures = []
-        
-        for question_data in COMPLEX_QUESTIONS:
-            # ALBと個別インスタンスの両方でテスト
-            for endpoint in [ALB_ENDPOINT] + active_endpoints[:1]:  # ALB + 1個のインスタンス
-                future = executor.submit(send_request, endpoint, question_data, test_id)
-                futures.append(future)
-                test_id += 1
-        
-        # 結果を収集
-        for future in as_completed(futures):
-            result = future.result()
-            test_results.append(result)
-            
-            if result["success"]:
-                print(f"✅ テスト{result['test_id']}: {result['category']} - {result['response_time']:.2f}秒")
+    # ALBと個別インスタンスの両方でテスト（keep-alive の接続プールで同時に CONCURRENCY 件ずつ送信）
+    endpoints = [ALB_ENDPOINT] + active_endpoints[:1]  # ALB + 1個のインスタンス
+    payloads = [build_payload(question_data) for question_data in COMPLEX_QUESTIONS]
+    started = time.time()
+    batches = asyncio.run(run_endpoints(endpoints, payloads))
+    elapsed = time.time() - started
+    
+    for endpoint, results in zip(endpoints, batches):
+        for question_data, result in zip(COMPLEX_QUESTIONS, results):
+            if result["ok"]:
+                test_results.append({
+                    "test_id": test_id,
+                    "endpoint": endpoint,
+                    "category": question_data["category"],
+                    "question": question_data["question"][:100] + "...",
+                    "response": result["text"],
+                    "response_time": result["latency"],
+                    "keywords": question_data["keywords"],
+                    "success": True,
+                    "token_usage": result.get("usage", {})
+                })
+                print(f"✅ テスト{test_id}: {question_data['category']} - {result['latency']:.2f}秒")
             else:
-                print(f"❌ テスト{result['test_id']}: {result['category']} - {result['error']}")
+                test_results.append({
+                    "test_id": test_id,
+                    "endpoint": endpoint,
+                    "category": question_data["category"],
+                    "error": result["error"],
+                    "success": False
+                })
+                print(f"❌ テスト{test_id}: {question_data['category']} - {result['error']}")
+            test_id += 1
+    
+    # エンドポイント別のレイテンシ分布
+    print("\nエンドポイント別レイテンシ:")
+    for endpoint, results in zip(endpoints, batches):
+        summary = summarize(results, elapsed)
+        latency = summary["latency_ms"]
+        if latency["p50"] is None:
+            print(f"  {endpoint}: 成功なし")
+            continue
+        print(f"  {endpoint}: p50 {latency['p50'] / 1000:.2f}秒  p90 {latency['p90'] / 1000:.2f}秒  "
+              f"p99 {latency['p99'] / 1000:.2f}秒  エラー率 {summary['error_rate'] * 100:.0f}%")
+    print("  （継続的な負荷での計測は loadgen.py を使用してください）")
     
     # 結果分析
     print(f"\n{'='*60}")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+readiness.py と ssl_monitor.py の監視のテスト
+
+AWS のクライアントはスタブ（指定した時刻に証明書が ISSUED になる ACM、create_listener で
+リスナーが増える ELBv2）、エンドポイントはローカルの HTTPS サーバー（自己署名証明書、openssl で作成）です。
+状態が変わってから検出（action の実行）までの遅れを計測し、変更前の ssl_monitor.py
+（60秒毎の確認 + リスナー作成後に固定の30秒待ち）と比べます。
+
+    python3 test_readiness.py
+    python3 -m pytest -q test_readiness.py
+"""
+
+import asyncio
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from readiness import (EXPIRED, FAILED, READY, SKIPPED, Resource, ResourceFailed, Watcher, backoff_delays)
+from ssl_monitor import build_resources
+from test_support import free_port
+
+# テスト用の確認間隔（本番は 1秒から最大 15秒）
+INITIAL_INTERVAL = 0.05
+MAX_INTERVAL = 0.4
+
+
+class StubACM:
+    """issue_at（time.monotonic() 基準）以降は status を返す ACM"""
+
+    def __init__(self, issue_at, status='ISSUED'):
+        self.issue_at = issue_at
+        self.status = status
+        self.calls = 0
+
+    def describe_certificate(self, CertificateArn):
+        self.calls += 1
+        status = self.status if time.monotonic() >= self.issue_at else 'PENDING_VALIDATION'
+        return {'Certificate': {'CertificateArn': CertificateArn, 'Status': status}}
+
+
+class StubELBv2:
+    """create_listener でリスナーを追加する ELBv2。on_create(load_balancer_arn) を呼ぶ"""
+
+    def __init__(self, on_create=None):
+        self.listeners = {}
+        self.created_at = {}
+        self.on_create = on_create
+        self.lock = threading.Lock()
+
+    def describe_listeners(self, LoadBalancerArn):
+        with self.lock:
+            return {'Listeners': list(self.listeners.get(LoadBalancerArn, []))}
+
+    def create_listener(self, LoadBalancerArn, Protocol, Port, Certificates, DefaultActions):
+        with self.lock:
+            listener = {'ListenerArn': f"{LoadBalancerArn}/listener/{Port}", 'Port': Port, 'Protocol': Protocol}
+            self.listeners.setdefault(LoadBalancerArn, []).append(listener)
+            self.created_at[LoadBalancerArn] = time.monotonic()
+        if self.on_create is not None:
+            self.on_create(LoadBalancerArn)
+        return {'Listeners': [listener]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalHTTPSServer:
+    """start() するまで接続を受け付けない HTTPS サーバー"""
+
+    def __init__(self, certfile, keyfile):
+        self.port = free_port()
+        self.url = f"https://127.0.0.1:{self.port}/"
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(certfile, keyfile)
+        self.server = None
+        self.started_at = None
+
+    def start(self, delay=0.0):
+        def serve():
+            time.sleep(delay)
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+            self.server.socket = self.context.wrap_socket(self.server.socket, server_side=True)
+            self.started_at = time.monotonic()
+            self.server.serve_forever(poll_interval=0.05)
+
+        threading.Thread(target=serve, daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def self_signed_certificate(directory):
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', keyfile, '-out', certfile,
+                    '-days', '1', '-subj', '/CN=localhost', '-addext', 'subjectAltName=IP:127.0.0.1'],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def make_sites(count, url_for):
+    return [{
+        "name": f"site{i}",
+        "certificate_arn": f"arn:aws:acm:test:certificate/{i}",
+        "load_balancer_arn": f"arn:aws:elasticloadbalancing:test:loadbalancer/{i}",
+        "target_group_arn": f"arn:aws:elasticloadbalancing:test:targetgroup/{i}",
+        "url": url_for(i),
+    } for i in range(count)]
+
+
+def watch(resources):
+    """Watcher を実行して (name -> Resource, name -> 状態が変わった時刻) を返す"""
+    transitions = {}
+    watcher = Watcher(resources, on_transition=lambda r, state: transitions.setdefault(r.name, time.monotonic()))
+    return asyncio.run(watcher.run()), transitions
+
+
+def test_backoff_delays_are_jittered_and_capped():
+    delays = backoff_delays(1.0, 8.0)
+    values = [next(delays) for _ in range(20)]
+    for interval, value in zip([1, 2, 4, 8] + [8] * 16, values):
+        assert interval * 0.5 <= value <= interval
+    assert len(set(values)) == len(values)
+
+
+def measure_detection_latency(sites=4, issue_after=1.0, listener_delay=0.5):
+    """sites 個のサイトを並行に監視し、証明書の発行 → リスナー作成と、エンドポイントの起動 → ready の遅れ（秒）を返す"""
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = self_signed_certificate(tmp)
+        servers = [LocalHTTPSServer(certfile, keyfile) for _ in range(sites)]
+        # リスナーが作られてから listener_delay 秒後にエンドポイントが応答するようになる
+        by_load_balancer = {}
+        elbv2 = StubELBv2(on_create=lambda arn: by_load_balancer[arn].start(listener_delay))
+        site_list = make_sites(sites, lambda i: servers[i].url)
+        for site, server in zip(site_list, servers):
+            by_load_balancer[site["load_balancer_arn"]] = server
+        # 証明書はサイト毎に少しずつずらして発行される
+        started = time.monotonic()
+        issued_at = [started + issue_after + 0.1 * i for i in range(sites)]
+        acms = [StubACM(at) for at in issued_at]
+
+        class ACM:
+            """サイト（証明書ARN）毎に StubACM に振り分ける1つのクライアント"""
+            def describe_certificate(self, CertificateArn):
+                return acms[int(CertificateArn.rsplit('/', 1)[1])].describe_certificate(CertificateArn)
+
+        resources = build_resources(ACM(), elbv2, site_list, deadline=10,
+                                    ssl_context=ssl.create_default_context(cafile=certfile))
+        for resource in resources:
+            resource.initial_interval = INITIAL_INTERVAL
+            resource.max_interval = MAX_INTERVAL
+        try:
+            results, transitions = watch(resources)
+        finally:
+            for server in servers:
+                server.stop()
+
+    latencies = {"certificate": [], "endpoint": []}
+    for i, site in enumerate(site_list):
+        for kind in ("certificate", "listener", "endpoint"):
+            assert results[f"{site['name']}/{kind}"].state == READY, results[f"{site['name']}/{kind}"].error
+        latencies["certificate"].append(elbv2.created_at[site["load_balancer_arn"]] - issued_at[i])
+        latencies["endpoint"].append(transitions[f"{site['name']}/endpoint"] - servers[i].started_at)
+    return latencies
+
+
+def test_https_rollout_detection_latency():
+    """遅れは確認間隔の上限程度に収まる"""
+    for values in measure_detection_latency().values():
+        assert max(values) < MAX_INTERVAL + 0.3, values
+
+
+def test_failed_certificate_skips_listener():
+    elbv2 = StubELBv2()
+    resources = build_resources(StubACM(0, status='FAILED'), elbv2, make_sites(1, lambda i: "https://127.0.0.1:1/"),
+                                deadline=5)
+    results, _ = watch(resources)
+    assert results["site0/certificate"].state == FAILED
+    assert "FAILED" in results["site0/certificate"].error
+    assert results["site0/listener"].state == SKIPPED
+    assert results["site0/endpoint"].state == SKIPPED
+    assert not elbv2.listeners
+
+
+def test_deadline_expires():
+    acm = StubACM(float('inf'))
+    resources = build_resources(acm, StubELBv2(), make_sites(1, lambda i: "https://127.0.0.1:1/"), deadline=0.5)
+    resources[0].initial_interval = INITIAL_INTERVAL
+    started = time.monotonic()
+    results, _ = watch(resources)
+    assert results["site0/certificate"].state == EXPIRED
+    assert results["site0/endpoint"].state == SKIPPED
+    assert time.monotonic() - started < 1.0
+    assert acm.calls >= 3
+
+
+def test_transient_errors_are_retried():
+    calls = []
+
+    async def flaky():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise ConnectionError("throttled")
+        return True
+
+    async def broken():
+        raise ResourceFailed("gone")
+
+    actions = []
+    results, _ = watch([
+        Resource("flaky", flaky, action=lambda: actions.append("flaky"), initial_interval=0.01),
+        Resource("broken", broken, action=lambda: actions.append("broken")),
+    ])
+    assert results["flaky"].state == READY and len(calls) == 3
+    assert results["broken"].state == FAILED
+    assert actions == ["flaky"]
+
+
+def main():
+    tests = [test_backoff_delays_are_jittered_and_capped, test_failed_certificate_skips_listener,
+             test_deadline_expires, test_transient_errors_are_retried]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+    latencies = measure_detection_latency()
+    for values in latencies.values():
+        assert max(values) < MAX_INTERVAL + 0.3, values
+    print("✅ test_https_rollout_detection_latency")
+    print(f"\n=== 検出の遅れ（{len(latencies['certificate'])}サイト並行、確認間隔 "
+          f"{INITIAL_INTERVAL}〜{MAX_INTERVAL}秒 + jitter） ===")
+    print(f"{'transition':<28} {'mean':>7} {'max':>7}   変更前（60秒毎の確認 + 30秒待ち）")
+    for name, values, before in (("証明書 ISSUED → リスナー作成", latencies["certificate"], "0〜60秒"),
+                                 ("エンドポイント起動 → ready", latencies["endpoint"], "30秒固定")):
+        print(f"{name:<28} {sum(values) / len(values) * 1000:>6.0f}ms {max(values) * 1000:>6.0f}ms   {before}")
+
+
+if __name__ == "__main__":
+    main()
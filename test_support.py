@@ -0,0 +1,36 @@
+"""
+テストとベンチマークで共通のローカルサーバーの起動処理
+（bench_serving.py からも再エクスポートしています）
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, workers, delay, extra_args=(), root=HERE):
+    """root の proven_api.py を別プロセスで起動し、接続できるまで待つ"""
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(root, 'proven_api.py'),
+         '--host', '127.0.0.1', '--port', str(port), '--mode', mode,
+         '--workers', str(workers), '--delay', str(delay), '--quiet', *extra_args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{mode} サーバーが起動しませんでした")
@@ -0,0 +1,63 @@
+"""
+ベンチマーク用の小さなランダム初期化モデル
+Jan Nano と同じ Llama 系アーキテクチャを数MBの規模で作ります
+"""
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+TINY_VOCAB_SIZE = 512
+TINY_EOS_TOKEN_ID = 1
+
+
+def build_tiny_model(hidden_size=128, num_layers=4, num_heads=4, vocab_size=TINY_VOCAB_SIZE, seed=0):
+    """ランダム初期化の小さな因果言語モデルを作成する（eval モード）"""
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=num_heads,
+        num_key_value_heads=num_heads,
+        max_position_embeddings=2048,
+        bos_token_id=0,
+        eos_token_id=TINY_EOS_TOKEN_ID,
+        pad_token_id=0,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def build_tiny_tokenizer(vocab_size=TINY_VOCAB_SIZE):
+    """小さな BPE トークナイザーを作成する（<s>=0, </s>=1 で tiny モデルと揃える）"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    corpus = ["こんにちは！Jan Nano 4B Q8モデルです。", "Hello, how are you?", "User: Assistant: System:"] * 10
+    tokenizer.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=["<s>", "</s>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    ))
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>")
+
+
+def save_tiny_checkpoint(path, hidden_size=128, num_layers=4, num_heads=4,
+                         vocab_size=TINY_VOCAB_SIZE, dtype=torch.float32, seed=0):
+    """tiny モデルとトークナイザーを api_server.py で読み込めるディレクトリに保存する"""
+    build_tiny_tokenizer(vocab_size).save_pretrained(path)
+    model = build_tiny_model(hidden_size, num_layers, num_heads, vocab_size, seed)
+    model.to(dtype).save_pretrained(path)
+    return path
+
+
+def random_prompts(count, min_length=16, max_length=64, vocab_size=TINY_VOCAB_SIZE, seed=0):
+    """ランダムなトークンIDのプロンプトを count 件作成する（EOS は含めない）"""
+    generator = torch.Generator().manual_seed(seed)
+    prompts = []
+    for _ in range(count):
+        length = int(torch.randint(min_length, max_length + 1, (1,), generator=generator))
+        prompts.append(torch.randint(2, vocab_size, (length,), generator=generator).tolist())
+    return prompts